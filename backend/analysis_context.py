@@ -0,0 +1,54 @@
+"""
+Contexto de análise de uma digitalização: resultados intermediários da
+detecção da área de teste (PaloDetector.detect_test_area).
+
+Cada valor é calculado na primeira leitura e reaproveitado depois. A
+máscara de traços verticais (abertura 1xVERTICAL_STROKE_LEN) é feita uma vez
+sobre a imagem inteira. O ROIValidator não usa o contexto: ele abre o recorte
+da ROI com o próprio comprimento de traço (estrutura 1x20, densidade 1x25).
+"""
+
+from functools import cached_property
+from typing import Tuple
+
+import cv2
+import numpy as np
+
+import cv_resources
+
+VERTICAL_STROKE_LEN = 25  # altura mínima (px) de um traço vertical na máscara
+
+# Faixa do cabeçalho onde se procura a linha separadora do formulário
+HEADER_SCAN_START = 0.10
+HEADER_SCAN_END = 0.60
+
+
+class AnalysisContext:
+    def __init__(self, img: np.ndarray):
+        self.img = img  # imagem binária do preprocess (traços = 255)
+        self.height, self.width = img.shape[:2]
+
+    @cached_property
+    def vertical_mask(self) -> np.ndarray:
+        """Só os traços verticais com pelo menos VERTICAL_STROKE_LEN px."""
+        kernel = cv_resources.structuring_element((1, VERTICAL_STROKE_LEN))
+        return cv2.morphologyEx(self.img, cv2.MORPH_OPEN, kernel)
+
+    @cached_property
+    def row_profile(self) -> np.ndarray:
+        """Soma de cada linha da máscara vertical (perfil de densidade por y)."""
+        return np.sum(self.vertical_mask, axis=1)
+
+    @cached_property
+    def header_region(self) -> Tuple[int, np.ndarray]:
+        """
+        (y inicial, faixa binarizada) da região onde fica a linha separadora:
+        CLAHE forte + threshold adaptativo, para a busca de linhas horizontais.
+        """
+        start = int(self.height * HEADER_SCAN_START)
+        search_roi = self.img[start:int(self.height * HEADER_SCAN_END), :]
+        clahe = cv_resources.clahe(4.0, (8, 8))
+        enhanced = clahe.apply(search_roi)
+        thresh = cv2.adaptiveThreshold(enhanced, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+                                       cv2.THRESH_BINARY_INV, 21, 15)
+        return start, thresh
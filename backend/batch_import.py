@@ -0,0 +1,176 @@
+"""
+Importação em lote: um ZIP de imagens ou um PDF de várias páginas vira um
+caso por imagem/página, com arquivo e job já enfileirado para os workers.
+
+Duas fases: primeiro as páginas são extraídas em streaming para
+blob_store.INCOMING_DIR (cada uma validada como um upload comum, sem tocar no
+banco); depois todos os Case/CaseFile/Job do lote são criados numa única
+transação. A renderização do PDF, que é a parte lenta, não segura o lock de
+escrita do banco.
+"""
+
+import os
+import shutil
+import tempfile
+import zipfile
+from pathlib import Path, PurePosixPath
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import blob_store
+import models
+import uploads
+
+IMPORT_MAX_MB = float(os.getenv("IMPORT_MAX_MB", "500"))
+IMPORT_MAX_ITEMS = int(os.getenv("IMPORT_MAX_ITEMS", "500"))
+IMPORT_PDF_DPI = int(os.getenv("IMPORT_PDF_DPI", "300"))
+IMPORT_PDF_CHUNK_PAGES = int(os.getenv("IMPORT_PDF_CHUNK_PAGES", "8"))  # páginas por chamada ao poppler
+
+
+class TooManyItems(uploads.UploadError):
+    status_code = 413
+
+
+class PdfSupportMissing(uploads.UploadError):
+    status_code = 501
+
+
+class ExtractedItem(NamedTuple):
+    name: str  # nome da entrada no ZIP ou "pagina-007"
+    stored: uploads.StoredUpload
+
+
+Skipped = Dict[str, str]  # {"name": ..., "reason": ...}
+
+
+def _is_candidate(info: zipfile.ZipInfo) -> bool:
+    path = PurePosixPath(info.filename)
+    return not info.is_dir() and "__MACOSX" not in path.parts and not path.name.startswith(".")
+
+
+def extract_zip(archive: Path, dest_dir: Path) -> Tuple[List[ExtractedItem], List[Skipped]]:
+    """
+    Cada entrada é descompactada em streaming por uploads.receive_upload: o
+    limite UPLOAD_MAX_MB vale para o conteúdo descompactado (não confia no
+    tamanho declarado no ZIP) e entradas que não são imagem são puladas.
+    """
+    items, skipped = [], []
+    max_bytes = int(uploads.UPLOAD_MAX_MB * 1024 * 1024)
+    with zipfile.ZipFile(archive) as zf:
+        entries = sorted((i for i in zf.infolist() if _is_candidate(i)), key=lambda i: i.filename)
+        if len(entries) > IMPORT_MAX_ITEMS:
+            raise TooManyItems(f"O lote tem {len(entries)} arquivos; o limite é {IMPORT_MAX_ITEMS}")
+        for info in entries:
+            if info.file_size > max_bytes:
+                skipped.append({"name": info.filename, "reason": f"excede o limite de {uploads.UPLOAD_MAX_MB:.0f} MB"})
+                continue
+            try:
+                with zf.open(info) as member:
+                    stored = uploads.receive_upload(member, dest_dir, max_bytes=max_bytes)
+            except uploads.UploadError as e:
+                skipped.append({"name": info.filename, "reason": str(e)})
+                continue
+            except (zipfile.BadZipFile, RuntimeError, NotImplementedError) as e:
+                # entrada corrompida, criptografada ou com compressão não suportada
+                skipped.append({"name": info.filename, "reason": f"entrada ilegível: {e}"})
+                continue
+            items.append(ExtractedItem(info.filename, stored))
+    return items, skipped
+
+
+def extract_pdf(archive: Path, dest_dir: Path) -> Tuple[List[ExtractedItem], List[Skipped]]:
+    """
+    Renderiza as páginas em blocos de IMPORT_PDF_CHUNK_PAGES direto para PNG
+    em disco (pdf2image/poppler), sem manter o documento inteiro em memória.
+    """
+    try:
+        from pdf2image import convert_from_path, pdfinfo_from_path
+    except ImportError as e:
+        raise PdfSupportMissing("Importação de PDF indisponível: instale pdf2image e poppler") from e
+
+    try:
+        pages = int(pdfinfo_from_path(str(archive))["Pages"])
+    except Exception as e:
+        raise uploads.UploadError(f"PDF ilegível: {e}") from e
+    if pages > IMPORT_MAX_ITEMS:
+        raise TooManyItems(f"O PDF tem {pages} páginas; o limite é {IMPORT_MAX_ITEMS}")
+
+    items = []
+    max_bytes = int(uploads.UPLOAD_MAX_MB * 1024 * 1024)
+    threads = max(1, min(IMPORT_PDF_CHUNK_PAGES, os.cpu_count() or 1))
+    render_dir = Path(tempfile.mkdtemp(dir=dest_dir, prefix=".pdf-"))
+    try:
+        for first in range(1, pages + 1, IMPORT_PDF_CHUNK_PAGES):
+            last = min(pages, first + IMPORT_PDF_CHUNK_PAGES - 1)
+            rendered = convert_from_path(str(archive), dpi=IMPORT_PDF_DPI, first_page=first, last_page=last,
+                                         output_folder=str(render_dir), fmt="png", paths_only=True,
+                                         thread_count=threads)
+            # poppler nomeia os arquivos com o número da página: a ordem alfabética é a do documento
+            for page, path in enumerate(sorted(rendered), start=first):
+                with open(path, "rb") as f:
+                    stored = uploads.receive_upload(f, dest_dir, max_bytes=max_bytes)
+                os.unlink(path)
+                items.append(ExtractedItem(f"pagina-{page:03d}", stored))
+    except BaseException:
+        discard(items)
+        raise
+    finally:
+        shutil.rmtree(render_dir, ignore_errors=True)
+    return items, []
+
+
+def extract(archive: uploads.StoredUpload, dest_dir: Path) -> Tuple[List[ExtractedItem], List[Skipped]]:
+    extractor = extract_pdf if archive.extension == ".pdf" else extract_zip
+    try:
+        return extractor(archive.path, Path(dest_dir))
+    except zipfile.BadZipFile as e:
+        raise uploads.UploadError(f"ZIP inválido: {e}") from e
+
+
+def discard(items: List[ExtractedItem]) -> None:
+    for item in items:
+        Path(item.stored.path).unlink(missing_ok=True)
+
+
+def patient_code_for(item: ExtractedItem, prefix: Optional[str]) -> str:
+    stem = PurePosixPath(item.name).stem
+    return (f"{prefix}-{stem}" if prefix else stem)[:100]
+
+
+def create_batch(db, user_id: int, source_name: Optional[str], source_type: str,
+                 items: List[ExtractedItem], skipped: List[Skipped],
+                 patient_code_prefix: Optional[str] = None) -> models.ImportBatch:
+    """
+    Lote + um Case/CaseFile/Job QUEUED por item, numa transação (um commit).
+    Os workers reivindicam os jobs pela fila do banco, como no /analyze.
+    Se algo falhar, nada do lote fica no banco; blobs já movidos sem
+    referência são removidos pelo `blob_store.py gc`.
+    """
+    if source_type == "pdf" and not patient_code_prefix:
+        patient_code_prefix = PurePosixPath(source_name or "lote").stem  # senão todo PDF geraria "pagina-001"...
+    try:
+        batch = models.ImportBatch(source_name=source_name, source_type=source_type,
+                                   total_items=len(items), skipped=skipped, created_by=user_id)
+        db.add(batch)
+        db.flush()
+
+        cases = [models.Case(patient_code=patient_code_for(item, patient_code_prefix),
+                             created_by=user_id, batch_id=batch.id) for item in items]
+        db.add_all(cases)
+        db.flush()
+
+        files = []
+        for case, item in zip(cases, items):
+            dest_path = blob_store.ingest(db, item.stored)
+            files.append(models.CaseFile(case_id=case.id, original_file_url=str(dest_path),
+                                         processed_images_urls={}, dpi=300, content_hash=item.stored.sha256))
+        db.add_all(files)
+        db.flush()
+
+        db.add_all([models.Job(case_id=f.case_id, file_id=f.id, status=models.JobStatus.QUEUED,
+                               progress=0, current_step="iniciando") for f in files])
+        db.commit()
+    except BaseException:
+        db.rollback()
+        discard(items)  # os que ainda estavam em INCOMING_DIR
+        raise
+    return batch
@@ -0,0 +1,254 @@
+"""
+Armazenamento endereçado por conteúdo para uploads, imagens retificadas e
+cópias do dataset de treinamento.
+
+Cada arquivo vive uma única vez em storage/blobs/ab/cd/<sha256><ext> e tem
+uma linha em `blobs` com o número de referências (CaseFile original, imagem
+retificada, entrada do dataset). Blobs são imutáveis: o export do dataset
+usa reflink ou hard link em vez de copiar. Blobs sem referência são
+removidos por `gc()`, que também limpa arquivos órfãos (gravados por uma
+transação que falhou) depois de um período de carência.
+
+    python blob_store.py gc [--dry-run] [--recount]
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+from sqlalchemy.exc import IntegrityError
+
+import models
+
+STORAGE_ROOT = Path("../storage")  # mesmo diretório servido em /storage
+BLOB_DIR = Path(os.getenv("BLOB_DIR", str(STORAGE_ROOT / "blobs")))
+INCOMING_DIR = BLOB_DIR / "_incoming"  # uploads em andamento (mesmo filesystem -> os.replace atômico)
+DATASET_DIR = Path(os.getenv("DATASET_DIR", "storage/dataset"))
+BLOB_GC_GRACE_S = float(os.getenv("BLOB_GC_GRACE_S", "3600"))
+
+_FICLONE = 0x40049409  # ioctl do Linux (btrfs/xfs): cópia com compartilhamento de extents
+
+
+def blob_path(sha256: str, extension: str) -> Path:
+    return BLOB_DIR / sha256[:2] / sha256[2:4] / f"{sha256}{extension}"
+
+
+def path_of(db, sha256: Optional[str]) -> Optional[Path]:
+    """Caminho do blob registrado, ou None se não existir (arquivos antigos fora do store)."""
+    blob = db.get(models.Blob, sha256) if sha256 else None
+    return blob_path(blob.sha256, blob.extension) if blob else None
+
+
+def storage_url(path) -> str:
+    """URL pública de um arquivo sob storage/ (blobs ou uploads antigos)."""
+    p = Path(path).resolve()
+    for root, prefix in ((BLOB_DIR, "blobs"), (STORAGE_ROOT, "")):
+        try:
+            rel = (Path(prefix) / p.relative_to(root.resolve())).as_posix()
+            break
+        except ValueError:
+            continue
+    else:
+        rel = f"uploads/{p.name}"
+    return f"http://localhost:8000/storage/{rel}"
+
+
+# -- referências ---------------------------------------------------------------
+
+def add_ref(db, sha256: str, extension: str, size: int) -> None:
+    """+1 referência; cria a linha na primeira vez. Não faz commit."""
+    updated = (db.query(models.Blob).filter(models.Blob.sha256 == sha256)
+               .update({models.Blob.ref_count: models.Blob.ref_count + 1}, synchronize_session=False))
+    if updated:
+        return
+    try:
+        with db.begin_nested():
+            db.add(models.Blob(sha256=sha256, extension=extension, size=size, ref_count=1))
+    except IntegrityError:
+        # Outro processo registrou o mesmo conteúdo entre o UPDATE e o INSERT
+        db.query(models.Blob).filter(models.Blob.sha256 == sha256).update(
+            {models.Blob.ref_count: models.Blob.ref_count + 1}, synchronize_session=False)
+
+
+def release(db, sha256: Optional[str]) -> None:
+    """-1 referência (sem ficar negativo). O arquivo só sai do disco no gc()."""
+    if not sha256:
+        return
+    db.query(models.Blob).filter(models.Blob.sha256 == sha256, models.Blob.ref_count > 0).update(
+        {models.Blob.ref_count: models.Blob.ref_count - 1}, synchronize_session=False)
+
+
+# -- escrita ---------------------------------------------------------------------
+
+def ingest(db, stored) -> Path:
+    """
+    Move um upload recebido (uploads.StoredUpload, gravado em INCOMING_DIR)
+    para o store. Se o conteúdo já existe, o arquivo novo é descartado.
+    """
+    add_ref(db, stored.sha256, stored.extension, stored.size)
+    dest = blob_path(stored.sha256, stored.extension)
+    if dest.is_file():
+        Path(stored.path).unlink(missing_ok=True)
+        print(f"[BLOB] Conteúdo já armazenado (sha256 {stored.sha256[:12]}), reutilizando")
+    else:
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(stored.path, dest)
+    return dest
+
+
+def put_bytes(db, data: bytes, extension: str) -> Tuple[str, Path]:
+    """Grava bytes já codificados (ex.: imagem retificada) e registra +1 referência."""
+    sha256 = hashlib.sha256(data).hexdigest()
+    add_ref(db, sha256, extension, len(data))
+    dest = blob_path(sha256, extension)
+    if not dest.is_file():
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=dest.parent, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, dest)
+        except BaseException:
+            Path(tmp).unlink(missing_ok=True)
+            raise
+    return sha256, dest
+
+
+def link_to(src: Path, dest: Path) -> str:
+    """
+    Materializa um blob em `dest` sem duplicar dados quando possível:
+    reflink -> hard link -> cópia. Retorna o método usado.
+    """
+    dest = Path(dest)
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    dest.unlink(missing_ok=True)  # nunca escrever através de um link existente
+    try:
+        import fcntl
+        with open(src, "rb") as s, open(dest, "wb") as d:
+            fcntl.ioctl(d.fileno(), _FICLONE, s.fileno())
+        return "reflink"
+    except (ImportError, OSError):
+        dest.unlink(missing_ok=True)
+    try:
+        os.link(src, dest)
+        return "hardlink"
+    except OSError:
+        shutil.copyfile(src, dest)
+        return "copy"
+
+
+# -- manutenção --------------------------------------------------------------------
+
+def recount(db) -> int:
+    """
+    Recalcula ref_count a partir do banco e das entradas do dataset
+    (ex.: depois de um crash entre a escrita e o commit). Faz commit.
+    Retorna quantas linhas mudaram.
+    """
+    counts: Dict[str, int] = {}
+    for content_hash, processed in db.query(models.CaseFile.content_hash, models.CaseFile.processed_images_urls):
+        processed = processed or {}
+        for sha in (content_hash, processed.get("warped_sha256"), processed.get("preview_sha256")):
+            if sha:
+                counts[sha] = counts.get(sha, 0) + 1
+    for meta in DATASET_DIR.glob("*_meta.json"):
+        try:
+            sha = json.loads(meta.read_text()).get("image_sha256")
+        except (OSError, ValueError):
+            continue
+        if sha:
+            counts[sha] = counts.get(sha, 0) + 1
+
+    changed = 0
+    for blob in db.query(models.Blob):
+        expected = counts.get(blob.sha256, 0)
+        if blob.ref_count != expected:
+            blob.ref_count = expected
+            changed += 1
+    db.commit()
+    return changed
+
+
+def gc(db, dry_run: bool = False, grace_s: float = BLOB_GC_GRACE_S) -> Dict[str, Any]:
+    """
+    Remove blobs sem referências e arquivos sem linha no banco mais velhos
+    que `grace_s` (uploads interrompidos, transações desfeitas).
+    """
+    removed, freed = [], 0
+    candidates = (db.query(models.Blob.sha256, models.Blob.extension, models.Blob.size)
+                  .filter(models.Blob.ref_count <= 0).all())
+    for sha256, extension, size in candidates:
+        path = blob_path(sha256, extension)
+        if not dry_run:
+            # DELETE condicional: uma referência nova entre o SELECT e aqui mantém o blob
+            gone = db.query(models.Blob).filter(models.Blob.sha256 == sha256, models.Blob.ref_count <= 0).delete(
+                synchronize_session=False)
+            db.commit()
+            if not gone:
+                continue
+            path.unlink(missing_ok=True)
+        removed.append(path)
+        freed += size
+
+    known = {sha for (sha,) in db.query(models.Blob.sha256)}
+    cutoff = time.time() - grace_s
+    orphans = 0
+    for path in BLOB_DIR.glob("**/*"):
+        if not path.is_file():
+            continue
+        try:
+            st = path.stat()
+        except FileNotFoundError:
+            continue
+        sha = path.name.split(".", 1)[0]
+        if sha in known or st.st_mtime > cutoff:
+            continue
+        orphans += 1
+        freed += st.st_size
+        if not dry_run:
+            path.unlink(missing_ok=True)
+
+    # Pirâmides de tiles (renditions.py) são derivadas da retificada: saem junto com o blob
+    from renditions import TILE_DIR
+    tile_sets = 0
+    for path in TILE_DIR.glob("*"):
+        if not path.is_dir() or path.name in known:
+            continue
+        try:
+            if path.stat().st_mtime > cutoff:
+                continue  # pirâmide em geração ou de uma transação ainda não confirmada
+        except FileNotFoundError:
+            continue
+        tile_sets += 1
+        if not dry_run:
+            shutil.rmtree(path, ignore_errors=True)
+
+    result = {"removed_blobs": len(removed), "removed_orphans": orphans, "removed_tile_sets": tile_sets,
+              "freed_bytes": freed, "dry_run": dry_run}
+    print(f"[BLOB-GC] {result}")
+    return result
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from database import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Manutenção do armazenamento de blobs")
+    parser.add_argument("command", choices=["gc"])
+    parser.add_argument("--dry-run", action="store_true")
+    parser.add_argument("--recount", action="store_true", help="recalcula ref_count antes de coletar")
+    args = parser.parse_args()
+
+    session = SessionLocal()
+    try:
+        if args.recount:
+            print(f"[BLOB-GC] ref_count corrigido em {recount(session)} blobs")
+        gc(session, dry_run=args.dry_run)
+    finally:
+        session.close()
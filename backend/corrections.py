@@ -0,0 +1,231 @@
+"""
+Motor incremental das correções manuais (adicionar/remover palos e marcas).
+
+Com marcas delimitadoras, o intervalo de um palo depende só do próprio palo e
+das 4 primeiras marcas (PaloDetector.assign_intervals); sem marcas, as
+contagens dependem só do total de palos (PaloDetector.chunk_counts). Por isso
+cada clique atualiza as contagens em O(k), k <= 4, sem decodificar a imagem e
+sem reclusterizar o caso. As contagens ficam em Detection.roi_config junto
+com o run_meta da detecção, usado para recalcular NOR/CV/tendência.
+"""
+
+import uuid
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+import models
+from utils import jsonify_dict
+from vision import PaloDetector, get_detector
+
+TOTAL_INTERVALS = 5
+
+
+class IntervalIndex:
+    """Contagens por intervalo de um caso, mantidas palo a palo."""
+
+    def __init__(self, marks: List[Dict], counts: List[int], total: int):
+        self.marks = list(marks)
+        self._counts = list(counts)
+        self.total = total
+
+    @classmethod
+    def build(cls, palos: List[Dict], marks: List[Dict]) -> "IntervalIndex":
+        index = cls(marks, [0] * TOTAL_INTERVALS, len(palos))
+        if palos and index.marks:
+            centers = [p["center"] for p in palos]
+            heights = [p.get("height", 30) for p in palos]
+            assignment = PaloDetector.assign_intervals(centers, heights, index.marks, TOTAL_INTERVALS)
+            index._counts = np.bincount(assignment, minlength=TOTAL_INTERVALS).tolist()
+        return index
+
+    @classmethod
+    def load(cls, detection) -> "IntervalIndex":
+        """Usa as contagens persistidas quando batem com os objetos salvos; senão reconstrói."""
+        objects = detection.palo_objects or {}
+        palos, marks = objects.get("palos", []), objects.get("marks", [])
+        saved = (detection.roi_config or {}).get("interval_counts")
+        if marks and saved and len(saved) == TOTAL_INTERVALS and sum(saved) == len(palos):
+            return cls(marks, saved, len(palos))
+        return cls.build(palos, marks)
+
+    def _interval_of(self, palo: Dict) -> int:
+        return int(PaloDetector.assign_intervals(palo["center"], palo.get("height", 30), self.marks, TOTAL_INTERVALS)[0])
+
+    def add_palo(self, palo: Dict) -> None:
+        self.total += 1
+        if self.marks:
+            self._counts[self._interval_of(palo)] += 1
+
+    def remove_palo(self, palo: Dict) -> None:
+        self.total -= 1
+        if self.marks:
+            self._counts[self._interval_of(palo)] -= 1
+
+    def set_marks(self, marks: List[Dict], palos: List[Dict]) -> None:
+        # Marcas mudam os limites de todos os intervalos: reatribuição vetorizada
+        rebuilt = IntervalIndex.build(palos, marks)
+        self.marks, self._counts, self.total = rebuilt.marks, rebuilt._counts, rebuilt.total
+
+    @property
+    def counts(self) -> List[int]:
+        if self.marks:
+            return list(self._counts)
+        return PaloDetector.chunk_counts(self.total, TOTAL_INTERVALS)
+
+
+class CorrectionError(ValueError):
+    """Operação de correção malformada; nada do lote é aplicado."""
+
+
+def _center_of(value, what: str) -> List[float]:
+    try:
+        x, y = value
+        return [float(x), float(y)]
+    except (TypeError, ValueError):
+        raise CorrectionError(f"{what}: 'center' deve ser [x, y]")
+
+
+def _moved(item: Dict[str, Any], center: List[float], bbox) -> Dict[str, Any]:
+    """`item` no novo centro; sem `bbox` explícita, a antiga é transladada junto."""
+    moved = dict(item, center=center)
+    if bbox is not None:
+        moved["bbox"] = list(bbox)
+    elif item.get("bbox") is not None:
+        x, y, w, h = item["bbox"]
+        old_x, old_y = item["center"]
+        moved["bbox"] = [x + center[0] - old_x, y + center[1] - old_y, w, h]
+    return moved
+
+
+def apply_operations(detection, operations: List[Dict[str, Any]]) -> Tuple[Dict[str, Any], IntervalIndex, List[int]]:
+    """
+    Aplica operações add/remove/move de palos e marcas sobre cópias dos objetos
+    da detecção. Retorna (novos palo_objects, índice atualizado, índices das
+    operações sem efeito). Remover um ID inexistente ou adicionar um ID já
+    presente é ignorado (idempotente, como nos endpoints unitários); operações
+    malformadas levantam CorrectionError antes de qualquer escrita.
+
+    Edições de palo atualizam as contagens incrementalmente; se o lote mexe em
+    marcas, a atribuição é refeita uma única vez no final.
+    """
+    index = IntervalIndex.load(detection)
+    objects = dict(detection.palo_objects or {})
+    palos: List[Optional[Dict]] = list(objects.get("palos", []))
+    marks: List[Dict] = list(objects.get("marks", []))
+    positions: Dict[str, List[int]] = {}
+    for i, p in enumerate(palos):
+        positions.setdefault(str(p.get("id")), []).append(i)
+
+    marks_changed = False
+    skipped = []
+    for n, op in enumerate(operations):
+        kind, target = op.get("op"), op.get("type")
+        if target not in ("palo", "mark"):
+            raise CorrectionError(f"Operação {n}: tipo inválido {target!r}")
+        what = f"Operação {n} ({kind} {target})"
+
+        if kind == "add":
+            item = op.get("item")
+            if not isinstance(item, dict):
+                raise CorrectionError(f"{what}: 'item' é obrigatório")
+            item = dict(item, center=_center_of(item.get("center"), what))
+            if item.get("id") is None:
+                item["id"] = f"{target}_manual_{uuid.uuid4().hex[:8]}"
+            item_id = str(item["id"])
+            if target == "palo":
+                if positions.get(item_id):
+                    skipped.append(n)
+                    continue
+                positions[item_id] = [len(palos)]
+                palos.append(item)
+                if not marks_changed:
+                    index.add_palo(item)
+            else:
+                if any(str(m.get("id")) == item_id for m in marks):
+                    skipped.append(n)
+                    continue
+                marks.append(item)
+                marks_changed = True
+
+        elif kind in ("remove", "move"):
+            if op.get("id") is None:
+                raise CorrectionError(f"{what}: 'id' é obrigatório")
+            item_id = str(op["id"])
+            new_center = _center_of(op.get("center"), what) if kind == "move" else None
+            if target == "palo":
+                hits = positions.get(item_id) or []
+                if not hits:
+                    if kind == "move":
+                        raise CorrectionError(f"{what}: palo {item_id} não encontrado")
+                    skipped.append(n)
+                    continue
+                for i in hits:
+                    old = palos[i]
+                    if not marks_changed:
+                        index.remove_palo(old)
+                    if kind == "remove":
+                        palos[i] = None
+                        continue
+                    moved = _moved(old, new_center, op.get("bbox"))
+                    palos[i] = moved
+                    if not marks_changed:
+                        index.add_palo(moved)
+                if kind == "remove":
+                    positions.pop(item_id)
+            else:
+                hits = [i for i, m in enumerate(marks) if str(m.get("id")) == item_id]
+                if not hits:
+                    if kind == "move":
+                        raise CorrectionError(f"{what}: marca {item_id} não encontrada")
+                    skipped.append(n)
+                    continue
+                if kind == "remove":
+                    marks = [m for m in marks if str(m.get("id")) != item_id]
+                else:
+                    for i in hits:
+                        marks[i] = _moved(marks[i], new_center, op.get("bbox"))
+                marks_changed = True
+        else:
+            raise CorrectionError(f"Operação {n}: op inválida {kind!r}")
+
+    objects["palos"] = [p for p in palos if p is not None]
+    objects["marks"] = marks
+    if marks_changed:
+        index.set_marks(marks, objects["palos"])
+    return objects, index, skipped
+
+
+def run_meta_for(detection, metric) -> Dict[str, Any]:
+    """Metadados da detecção; detecções antigas sem run_meta usam o que ficou em Metric.stats."""
+    run_meta = (detection.roi_config or {}).get("run_meta")
+    if run_meta:
+        return dict(run_meta)
+    stats = (metric.stats if metric else None) or {}
+    return {
+        "roi_confidence": (stats.get("confidence_score") or 0) / 100,
+        "roi_source": stats.get("roi_source", "unknown"),
+        "total_detected_raw": stats.get("total_detected_raw"),
+        "total_kept_in_roi": stats.get("total_kept_in_roi"),
+        "total_discarded_outside_roi": stats.get("total_discarded_outside_roi"),
+        "discard_reasons": stats.get("discard_reasons"),
+    }
+
+
+def apply_metrics(db, detection, index: IntervalIndex) -> Optional[Dict[str, Any]]:
+    """Persiste as contagens no roi_config e atualiza o Metric do caso (sem commit)."""
+    roi_config = dict(detection.roi_config or {})
+    roi_config["interval_counts"] = index.counts
+    detection.roi_config = roi_config
+
+    db_metric = db.query(models.Metric).filter(models.Metric.case_id == detection.case_id).first()
+    if not db_metric:
+        return None
+
+    metrics_data = get_detector().metrics_from_counts(index.counts, run_meta=run_meta_for(detection, db_metric))
+
+    is_na = metrics_data.get("total") == "N/A"
+    db_metric.total_count = -1 if is_na else int(metrics_data["total"])
+    db_metric.by_interval = jsonify_dict({"counts": metrics_data["intervals"]})
+    db_metric.stats = jsonify_dict({k: v for k, v in metrics_data.items() if k not in ["total", "intervals"]})
+    return metrics_data
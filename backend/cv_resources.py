@@ -0,0 +1,70 @@
+"""
+Objetos OpenCV reaproveitados entre execuções do pipeline (um registro por
+processo) e configuração de threads do OpenCV por worker.
+
+- Elementos estruturantes: construídos uma vez por (forma, tamanho) e
+  marcados como somente-leitura, então podem ser compartilhados por todas
+  as threads.
+- CLAHE: um objeto por (clipLimit, grade) e por thread. `apply` reutiliza
+  buffers internos do objeto, por isso ele não é compartilhado entre as
+  threads que usam o mesmo detector (PaloDetector.detect).
+- configure_process: chamado no initializer dos processos do worker e da
+  CLI em lote. Limita cv2.setNumThreads para que N processos no mesmo nó
+  não disputem todos os núcleos cada um.
+"""
+
+import os
+import threading
+from functools import lru_cache
+from typing import Dict, Optional, Tuple
+
+import cv2
+import numpy as np
+
+# Threads internas do OpenCV por processo (vazio = dividir os núcleos entre os
+# processos do pool; 0 = sem paralelismo interno do OpenCV)
+CV_THREADS = os.getenv("CV_THREADS", "")
+CV_USE_OPTIMIZED = os.getenv("CV_USE_OPTIMIZED", "1") != "0"
+
+_local = threading.local()
+
+
+@lru_cache(maxsize=None)
+def structuring_element(ksize: Tuple[int, int], shape: int = cv2.MORPH_RECT) -> np.ndarray:
+    """Elemento estruturante (largura, altura) compartilhado, somente-leitura."""
+    kernel = cv2.getStructuringElement(shape, tuple(ksize))
+    kernel.flags.writeable = False
+    return kernel
+
+
+def clahe(clip_limit: float, tile_grid: Tuple[int, int]):
+    """Objeto CLAHE da thread atual para (clip_limit, tile_grid)."""
+    registry: Optional[Dict] = getattr(_local, "clahe", None)
+    if registry is None:
+        registry = _local.clahe = {}
+    key = (float(clip_limit), tuple(tile_grid))
+    obj = registry.get(key)
+    if obj is None:
+        obj = registry[key] = cv2.createCLAHE(clipLimit=key[0], tileGridSize=key[1])
+    return obj
+
+
+def threads_per_process(processes: int) -> int:
+    """Núcleos por processo quando `processes` processos dividem o nó."""
+    return max(1, (os.cpu_count() or 1) // max(1, processes))
+
+
+def configure_process(processes: Optional[int] = None) -> None:
+    """
+    Ajusta o OpenCV do processo atual. CV_THREADS tem precedência; sem ele,
+    com `processes` informado (tamanho do pool), divide os núcleos entre os
+    processos. Sem nenhum dos dois mantém o padrão do OpenCV.
+    """
+    cv2.setUseOptimized(CV_USE_OPTIMIZED)
+    if CV_THREADS.strip():
+        threads = int(CV_THREADS)
+    elif processes:
+        threads = threads_per_process(processes)
+    else:
+        return
+    cv2.setNumThreads(threads)
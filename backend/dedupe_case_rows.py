@@ -0,0 +1,83 @@
+"""
+Manutenção: remove Detection/Metric duplicadas por caso e cria os índices
+únicos uq_detections_case_id / uq_metrics_case_id.
+
+Bancos anteriores ao upsert por caso acumulavam uma linha por (re)análise,
+e os endpoints liam uma delas com .first() sem ordem definida. Por caso fica
+a linha mais recente (maior id, a última análise gravada); `--keep oldest`
+mantém a mais antiga. Cada linha removida é listada no log; `--dry-run` só
+lista. Não roda no startup: create_missing_indexes apenas avisa e deixa o
+índice único para depois deste comando.
+
+Uso:
+    python dedupe_case_rows.py [--dry-run] [--keep newest|oldest]
+"""
+
+import argparse
+from typing import List, Optional, Tuple
+
+from sqlalchemy import func, select
+
+import database
+import models
+
+# (modelo, coluna de data exibida no log)
+TABLES = ((models.Detection, "updated_at"), (models.Metric, "created_at"))
+
+
+def find_duplicates(conn, model, keep: str = "newest") -> List[Tuple[int, int, List[Tuple[int, object]]]]:
+    """[(case_id, id mantido, [(id removido, data)])] dos casos com mais de uma linha."""
+    table = model.__table__
+    stamp = table.c[dict(TABLES)[model]]
+    duplicated = select(table.c.case_id).group_by(table.c.case_id).having(func.count() > 1)
+    rows = conn.execute(
+        select(table.c.case_id, table.c.id, stamp)
+        .where(table.c.case_id.in_(duplicated))
+        .order_by(table.c.case_id, table.c.id)
+    ).all()
+
+    groups = {}
+    for case_id, row_id, when in rows:
+        groups.setdefault(case_id, []).append((row_id, when))
+    result = []
+    for case_id, members in groups.items():
+        kept = members[-1] if keep == "newest" else members[0]
+        result.append((case_id, kept[0], [m for m in members if m is not kept]))
+    return result
+
+
+def dedupe(bind, keep: str = "newest", apply: bool = False) -> int:
+    """Lista (e com `apply` remove) as duplicatas; devolve o número de linhas."""
+    removed = 0
+    for model, _ in TABLES:
+        table = model.__table__
+        with bind.begin() as conn:
+            for case_id, kept, dropped in find_duplicates(conn, model, keep):
+                verb = "removida" if apply else "seria removida"
+                for row_id, when in dropped:
+                    print(f"[DEDUPE] {table.name} id={row_id} (caso {case_id}, {when}) {verb}; mantida id={kept}")
+                if apply:
+                    conn.execute(table.delete().where(table.c.id.in_([row_id for row_id, _ in dropped])))
+                removed += len(dropped)
+    if apply:
+        models.create_missing_indexes(bind)
+    return removed
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Remove Detection/Metric duplicadas por caso")
+    parser.add_argument("--dry-run", action="store_true", help="Só lista o que seria removido")
+    parser.add_argument("--keep", choices=["newest", "oldest"], default="newest",
+                        help="Linha mantida em cada caso (maior ou menor id)")
+    args = parser.parse_args(argv)
+
+    removed = dedupe(database.engine, keep=args.keep, apply=not args.dry_run)
+    if args.dry_run:
+        print(f"[DEDUPE] {removed} linha(s) seriam removidas")
+    else:
+        print(f"[DEDUPE] {removed} linha(s) removida(s)")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
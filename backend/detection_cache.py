@@ -0,0 +1,205 @@
+"""
+Cache de resultados de detecção endereçado por conteúdo.
+
+A chave é o SHA-256 de (versão do pipeline, config do detector, bytes da
+imagem original): reprocessar um caso ou reenviar o mesmo arquivo com a mesma
+configuração reaproveita o resultado anterior em vez de rodar o OpenCV de novo.
+
+Cada entrada é um único .npz (sem pickle) com a imagem retificada já
+codificada, as colunas do PaloSet e um JSON com ROI, marcas, métricas e
+metadados da execução. O diretório é limitado por tamanho com despejo LRU
+(mtime atualizado a cada hit). Hits/misses de todos os processos (os
+workers rodam em processos distintos) são somados num único _stats.json,
+atualizado sob lock de arquivo; os totais sobrevivem a reinícios do worker.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows (dev): só o lock entre threads do processo
+    fcntl = None
+
+from vision import PIPELINE_VERSION, PaloSet
+
+DETECTION_CACHE_DIR = os.getenv("DETECTION_CACHE_DIR", "../storage/cache/detections")
+DETECTION_CACHE_MAX_MB = float(os.getenv("DETECTION_CACHE_MAX_MB", "512"))  # 0 desativa o cache
+
+_HASH_CHUNK = 1024 * 1024
+_COUNTERS = ("hits", "misses", "stores", "evictions")
+_stats_lock = threading.Lock()
+
+
+class DetectionCache:
+    def __init__(self, root=DETECTION_CACHE_DIR, max_mb: float = DETECTION_CACHE_MAX_MB):
+        self.root = Path(root)
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.enabled = self.max_bytes > 0
+        self._stats_path = self.root / "_stats.json"
+
+    # -- chave -------------------------------------------------------------
+
+    @staticmethod
+    def key_for_file(path, config: Dict[str, Any]) -> str:
+        """Hash do arquivo em blocos (não carrega a imagem inteira em memória)."""
+        h = hashlib.sha256()
+        h.update(f"pipeline:{PIPELINE_VERSION}\n".encode())
+        h.update(json.dumps(config, sort_keys=True, default=str).encode())
+        h.update(b"\n")
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(_HASH_CHUNK), b""):
+                h.update(chunk)
+        return h.hexdigest()
+
+    def _entry_path(self, key: str) -> Path:
+        return self.root / key[:2] / f"{key}.npz"
+
+    # -- leitura / escrita ---------------------------------------------------
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        if not self.enabled:
+            return None
+        path = self._entry_path(key)
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                payload = json.loads(data["payload"].tobytes().decode())
+                palos = PaloSet(*(data[f"palos_{k}"] for k in PaloSet.__slots__))
+                warped_bytes = data["warped"].tobytes()
+            os.utime(path)  # LRU: entrada recém-usada
+        except FileNotFoundError:
+            self._count("misses")
+            return None
+        except Exception as e:
+            # Entrada truncada/corrompida: descarta e trata como miss
+            print(f"[DETECTION-CACHE] Entrada inválida {key[:12]}: {e}")
+            path.unlink(missing_ok=True)
+            self._count("misses")
+            return None
+
+        self._count("hits")
+        payload["palos"] = palos
+        payload["warped_bytes"] = warped_bytes
+        return payload
+
+    def put(self, key: str, *, warped_bytes: bytes, warped_ext: str, roi, palos: PaloSet,
+            marks, metrics: Dict[str, Any], run_meta: Dict[str, Any], image_dims) -> None:
+        if not self.enabled:
+            return
+        from utils import jsonify_dict
+
+        payload = jsonify_dict({
+            "warped_ext": warped_ext,
+            "roi": roi,
+            "marks": marks,
+            "metrics": metrics,
+            "run_meta": run_meta,
+            "image_dims": image_dims,
+        })
+        arrays = {f"palos_{k}": getattr(palos, k) for k in PaloSet.__slots__}
+        if arrays["palos_ids"].dtype == object:
+            arrays["palos_ids"] = np.array(palos.id_labels(), dtype=str)
+        arrays["payload"] = np.frombuffer(json.dumps(payload).encode(), dtype=np.uint8)
+        arrays["warped"] = np.frombuffer(warped_bytes, dtype=np.uint8)
+
+        path = self._entry_path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Escrita atômica: outro worker nunca lê um .npz pela metade
+        fd, tmp = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez(f, **arrays)
+            os.replace(tmp, path)
+        except BaseException:
+            Path(tmp).unlink(missing_ok=True)
+            raise
+        self._count("stores")
+        self.evict(keep=path)
+
+    # -- LRU -------------------------------------------------------------------
+
+    def _entries(self):
+        entries = []
+        for path in self.root.glob("*/*.npz"):
+            try:
+                st = path.stat()
+            except FileNotFoundError:
+                continue  # removida por outro processo
+            entries.append((st.st_mtime, st.st_size, path))
+        return entries
+
+    def evict(self, keep: Optional[Path] = None) -> int:
+        """
+        Remove as entradas menos usadas até o diretório caber em max_bytes.
+        `keep` (a entrada recém-gravada) nunca é despejada.
+        """
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for _, size, path in sorted(entries, key=lambda e: e[0]):
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            path.unlink(missing_ok=True)
+            total -= size
+            removed += 1
+        if removed:
+            self._count("evictions", removed)
+        return removed
+
+    # -- métricas ----------------------------------------------------------------
+
+    def _read_counters(self) -> Dict[str, int]:
+        try:
+            data = json.loads(self._stats_path.read_text())
+        except (OSError, ValueError):
+            data = {}
+        return {k: int(data.get(k, 0)) for k in _COUNTERS}
+
+    def _count(self, name: str, n: int = 1) -> None:
+        """Soma `n` ao contador em _stats.json (ler-somar-gravar sob lock exclusivo)."""
+        try:
+            self.root.mkdir(parents=True, exist_ok=True)
+            with _stats_lock, open(self.root / "_stats.lock", "a") as lock:
+                if fcntl is not None:
+                    fcntl.flock(lock, fcntl.LOCK_EX)  # liberado ao fechar o arquivo
+                counters = self._read_counters()
+                counters[name] += n
+                tmp = self.root / "_stats.json.tmp"
+                tmp.write_text(json.dumps(counters))
+                os.replace(tmp, self._stats_path)
+        except OSError as e:
+            print(f"[DETECTION-CACHE] Falha ao gravar estatísticas: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        """Contadores de todos os processos + ocupação do diretório."""
+        totals = self._read_counters()
+        lookups = totals["hits"] + totals["misses"]
+        entries = self._entries()
+        return {
+            **totals,
+            "hit_ratio": round(totals["hits"] / lookups, 4) if lookups else 0.0,
+            "entries": len(entries),
+            "size_mb": round(sum(size for _, size, _ in entries) / 2**20, 2),
+            "max_mb": round(self.max_bytes / 2**20, 2),
+            "enabled": self.enabled,
+        }
+
+
+_default_cache: Optional[DetectionCache] = None
+
+
+def get_cache() -> DetectionCache:
+    """Instância do processo, configurada pelo ambiente."""
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = DetectionCache()
+    return _default_cache
@@ -0,0 +1,155 @@
+"""
+Canal de progresso dos jobs para a interface (long-poll com ETag e SSE).
+
+Os workers rodam em outros processos e só escrevem no banco, então a API
+observa a tabela `jobs`: um único laço por processo consulta, a cada
+JOB_EVENTS_POLL_MS, o job mais recente de todos os casos com alguém
+assistindo (uma consulta para N espectadores) e acorda quem espera por
+mudança. Sem espectadores o laço para.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+from contextlib import asynccontextmanager
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.orm import aliased
+
+import database
+import models
+import schemas
+
+JOB_EVENTS_POLL_MS = int(os.getenv("JOB_EVENTS_POLL_MS", "500"))
+
+TERMINAL_STATUSES = {models.JobStatus.DONE.value, models.JobStatus.FAILED.value}
+
+Snapshot = Tuple[str, Dict[str, Any]]  # (ETag, JobResponse serializado)
+
+
+def snapshot_of(job: models.Job) -> Snapshot:
+    payload = schemas.JobResponse.model_validate(job).model_dump(mode="json")
+    digest = hashlib.sha1(json.dumps(payload, sort_keys=True).encode()).hexdigest()[:20]
+    return f'"{digest}"', payload
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    tags = [t.strip().removeprefix("W/") for t in if_none_match.split(",")]
+    return etag in tags or "*" in tags
+
+
+def fetch_latest(case_ids: Iterable[int]) -> Dict[int, Snapshot]:
+    """Job mais recente de cada caso, numa consulta (usa ix_jobs_case_id_created_at)."""
+    case_ids = list(case_ids)
+    if not case_ids:
+        return {}
+    Job = models.Job
+    inner = aliased(Job)
+    latest = (select(inner.id).where(inner.case_id == Job.case_id)
+              .order_by(inner.created_at.desc(), inner.id.desc()).limit(1)
+              .correlate(Job).scalar_subquery())
+    db = database.SessionLocal()
+    try:
+        return {job.case_id: snapshot_of(job)
+                for job in db.query(Job).filter(Job.case_id.in_(case_ids), Job.id == latest)}
+    finally:
+        db.close()
+
+
+class JobProgressHub:
+    def __init__(self, poll_interval_ms: int = JOB_EVENTS_POLL_MS):
+        self.poll_interval = poll_interval_ms / 1000
+        self._watchers: Dict[int, int] = {}
+        self._state: Dict[int, Snapshot] = {}
+        self._loop = None
+        self._changed: Optional[asyncio.Condition] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def _bind_loop(self) -> None:
+        # Primitivas asyncio pertencem a um loop; TestClient/recarga podem trocar o loop
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._changed = asyncio.Condition()
+            self._task = None
+            self._state.clear()
+
+    @asynccontextmanager
+    async def watch(self, case_id: int):
+        self._bind_loop()
+        self._watchers[case_id] = self._watchers.get(case_id, 0) + 1
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        try:
+            yield
+        finally:
+            self._watchers[case_id] -= 1
+            if not self._watchers[case_id]:
+                del self._watchers[case_id]
+                self._state.pop(case_id, None)
+
+    async def current(self, case_id: int) -> Optional[Snapshot]:
+        """Estado atual: do laço quando o caso já é observado, senão uma consulta direta."""
+        self._bind_loop()
+        if case_id in self._state:
+            return self._state[case_id]
+        return (await asyncio.to_thread(fetch_latest, [case_id])).get(case_id)
+
+    async def wait_for_change(self, case_id: int, etag: Optional[str], timeout: float) -> Optional[Snapshot]:
+        """Espera até o ETag do caso mudar; None se o tempo acabar."""
+        async with self.watch(case_id):
+            async with self._changed:
+                try:
+                    await asyncio.wait_for(
+                        self._changed.wait_for(lambda: case_id in self._state and self._state[case_id][0] != etag),
+                        timeout)
+                except asyncio.TimeoutError:
+                    return None
+                return self._state[case_id]
+
+    async def _run(self) -> None:
+        while self._watchers:
+            try:
+                latest = await asyncio.to_thread(fetch_latest, list(self._watchers))
+            except Exception as e:
+                print(f"[JOB-EVENTS] Falha ao consultar jobs: {e}")
+                latest = {}
+            async with self._changed:
+                changed = False
+                for case_id, snap in latest.items():
+                    if case_id in self._watchers and self._state.get(case_id, (None,))[0] != snap[0]:
+                        self._state[case_id] = snap
+                        changed = True
+                if changed:
+                    self._changed.notify_all()
+            await asyncio.sleep(self.poll_interval)
+
+
+hub = JobProgressHub()
+
+
+def sse_message(etag: str, payload: Dict[str, Any]) -> str:
+    return f"id: {etag.strip(chr(34))}\nevent: progress\ndata: {json.dumps(payload)}\n\n"
+
+
+async def sse_stream(case_id: int, last_etag: Optional[str] = None, heartbeat_s: float = 15.0):
+    """Eventos `progress` a cada mudança do job; termina em done/failed."""
+    snap = await hub.current(case_id)
+    if snap is None:
+        yield "event: missing\ndata: {}\n\n"
+        return
+    if snap[0] != last_etag:
+        yield sse_message(*snap)
+    etag = snap[0]
+    while snap[1]["status"] not in TERMINAL_STATUSES:
+        changed = await hub.wait_for_change(case_id, etag, heartbeat_s)
+        if changed is None:
+            yield ": keep-alive\n\n"  # mantém proxies/conexão abertos
+            continue
+        snap = changed
+        etag = snap[0]
+        yield sse_message(*snap)
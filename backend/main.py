@@ -1,12 +1,13 @@
-from fastapi import FastAPI, Depends, HTTPException, status, UploadFile, File, BackgroundTasks
+from fastapi import FastAPI, Depends, HTTPException, status, UploadFile, File, Form, Header, Response, Query
 from fastapi.staticfiles import StaticFiles
+from fastapi.responses import JSONResponse, StreamingResponse
 import shutil
 from pathlib import Path
 import uuid
 from fastapi.middleware.cors import CORSMiddleware
 from sqlalchemy.orm import Session
 import os
-from typing import List
+from typing import List, Optional
 from datetime import datetime
 
 import models, schemas, auth, database
@@ -16,32 +17,31 @@ import hashlib
 from datetime import timedelta
 import numpy as np
 import json
+from utils import jsonify_dict
+import worker
+import corrections
+import uploads
+import blob_store
+import renditions
+import repository
+import job_events
+import batch_import
 
-def jsonify_dict(obj):
-    """
-    Recursively converts NumPy types to standard Python types for JSON serialization.
-    """
-    if isinstance(obj, dict):
-        return {k: jsonify_dict(v) for k, v in obj.items()}
-    elif isinstance(obj, list):
-        return [jsonify_dict(v) for v in obj]
-    elif isinstance(obj, (np.int64, np.int32, np.int16, np.int8)):
-        return int(obj)
-    elif isinstance(obj, (np.float64, np.float32, np.float16)):
-        return float(obj)
-    elif isinstance(obj, np.ndarray):
-        return jsonify_dict(obj.tolist())
-    else:
-        return obj
+# "embedded": a API sobe o pool de workers de visão no startup (dev / deploy único).
+# "external": os jobs são consumidos por processos `python worker.py` separados.
+VISION_WORKER_MODE = os.getenv("VISION_WORKER_MODE", "embedded")
 
-# Create tables in SQLite
-models.Base.metadata.create_all(bind=engine)
+# Create tables (e colunas/índices novos em bancos existentes)
+models.init_db(engine)
 
 app = FastAPI(title="PaloCheck API", version="1.0.0")
 
 # Setup static files for storage access
 UPLOAD_DIR = Path("../storage/uploads")
 UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
+# BLOB_DIR pode ficar fora de ../storage (ex.: outro volume): montado antes de /storage
+blob_store.BLOB_DIR.mkdir(parents=True, exist_ok=True)
+app.mount("/storage/blobs", StaticFiles(directory=str(blob_store.BLOB_DIR)), name="blobs")
 app.mount("/storage", StaticFiles(directory="../storage"), name="storage")
 
 @app.on_event("startup")
@@ -64,12 +64,28 @@ def ensure_default_user():
     finally:
         db.close()
 
+vision_pool = None
+
+@app.on_event("startup")
+def start_vision_workers():
+    global vision_pool
+    if VISION_WORKER_MODE == "embedded":
+        vision_pool = worker.VisionWorkerPool()
+        vision_pool.start()
+
+@app.on_event("shutdown")
+def stop_vision_workers():
+    if vision_pool:
+        print("[SHUTDOWN] Encerrando workers de visão...")
+        vision_pool.stop()
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"], # In prod, restrict to frontend URL
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Total-Count", "X-Next-Cursor", "ETag"],
 )
 
 # Marketing & Funnel Endpoints (Public)
@@ -174,10 +190,49 @@ def create_user(user: schemas.UserCreate, db: Session = Depends(get_db), current
     return new_user
 
 # Cases Management
+CASES_PAGE_SIZE = int(os.getenv("CASES_PAGE_SIZE", "100"))  # páginas seguintes sem `limit` explícito
+
 @app.get("/cases", response_model=List[schemas.CaseResponse])
-def get_cases(db: Session = Depends(get_db), current_user: models.User = Depends(auth.get_current_user)):
+def get_cases(
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=500, description="Tamanho da página (sem limit nem cursor: todos os casos)"),
+    cursor: Optional[str] = None,
+    status_filter: Optional[List[models.CaseStatus]] = Query(None, alias="status"),
+    created_by: Optional[int] = None,
+    created_from: Optional[datetime] = None,
+    created_to: Optional[datetime] = None,
+    patient_code: Optional[str] = Query(None, description="Prefixo do código do paciente"),
+    batch_id: Optional[int] = Query(None, description="Casos de uma importação em lote"),
+    with_total: Optional[bool] = None,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(auth.get_current_user)
+):
     # Simple isolation: Assistents see all, but only psychologists edit
-    return db.query(models.Case).all()
+    # Mais recentes primeiro; próxima página via X-Next-Cursor (corpo continua sendo uma lista).
+    # Sem limit nem cursor a lista vem inteira, como antes da paginação (dashboard atual).
+    if limit is None and cursor:
+        limit = CASES_PAGE_SIZE
+    try:
+        page = repository.list_cases(
+            db, limit=limit, cursor=cursor, statuses=status_filter, created_by=created_by,
+            created_from=created_from, created_to=created_to, patient_code_prefix=patient_code,
+            batch_id=batch_id, with_total=with_total
+        )
+    except repository.InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if page.total is not None:
+        response.headers["X-Total-Count"] = str(page.total)
+    if page.next_cursor:
+        response.headers["X-Next-Cursor"] = page.next_cursor
+    return page.items
+
+@app.get("/cases/{case_id}", response_model=schemas.CaseBundleResponse)
+def get_case(case_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(auth.get_current_user)):
+    # Caso, arquivo mais recente, detecção, métricas e último job numa única consulta
+    bundle = repository.get_case_bundle(db, case_id)
+    if not bundle:
+        raise HTTPException(status_code=404, detail="Caso não encontrado")
+    return bundle._asdict()
 
 @app.post("/cases", response_model=schemas.CaseResponse)
 def create_case(
@@ -201,6 +256,67 @@ def create_case(
         print(f"[API-ERROR] Falha ao criar caso: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/cases/import", response_model=schemas.ImportBatchResponse, status_code=status.HTTP_201_CREATED)
+def import_cases(
+    file: UploadFile = File(...),
+    patient_code_prefix: Optional[str] = Form(None),
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(auth.check_role([models.UserRole.ADMIN, models.UserRole.PSYCHOLOGIST, models.UserRole.ASSISTANT]))
+):
+    """
+    Importação em lote: um ZIP de imagens ou PDF de várias páginas vira um caso
+    por imagem/página, já com arquivo e job enfileirado (substitui o trio
+    POST /cases -> /upload -> /analyze por candidato).
+    """
+    print(f"[API] Importação em lote iniciada: {file.filename} por User: {current_user.id}")
+    max_bytes = int(batch_import.IMPORT_MAX_MB * 1024 * 1024)
+    if file.size is not None and file.size > max_bytes:
+        raise HTTPException(status_code=413, detail=f"Arquivo excede o limite de {batch_import.IMPORT_MAX_MB:.0f} MB")
+
+    archive = None
+    try:
+        archive = uploads.receive_upload(file.file, blob_store.INCOMING_DIR, max_bytes=max_bytes,
+                                         require=uploads.require_archive)
+        items, skipped = batch_import.extract(archive, blob_store.INCOMING_DIR)
+    except uploads.UploadError as e:
+        print(f"[API-ERROR] Importação rejeitada: {file.filename}, {e}")
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    finally:
+        if archive is not None:
+            Path(archive.path).unlink(missing_ok=True)
+    if not items:
+        reasons = "; ".join(f"{s['name']}: {s['reason']}" for s in skipped[:5])
+        raise HTTPException(status_code=422, detail=f"Nenhuma imagem válida no arquivo. {reasons}".strip())
+
+    try:
+        batch = batch_import.create_batch(db, current_user.id, file.filename, archive.extension.lstrip("."),
+                                          items, skipped, patient_code_prefix=patient_code_prefix)
+    except Exception as e:
+        print(f"[API-ERROR] Falha na importação em lote: {e}")
+        raise HTTPException(status_code=500, detail=f"Erro interno na importação: {str(e)}")
+    print(f"[API] Lote {batch.id}: {batch.total_items} casos enfileirados, {len(skipped)} entradas ignoradas")
+    return _import_batch_response(db, batch)
+
+@app.get("/imports/{batch_id}", response_model=schemas.ImportBatchResponse)
+def get_import_batch(batch_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(auth.get_current_user)):
+    batch = db.get(models.ImportBatch, batch_id)
+    if not batch:
+        raise HTTPException(status_code=404, detail="Importação não encontrada")
+    return _import_batch_response(db, batch)
+
+def _import_batch_response(db: Session, batch: models.ImportBatch) -> dict:
+    case_ids = db.query(models.Case.id).filter(models.Case.batch_id == batch.id).order_by(models.Case.id)
+    return {
+        "id": batch.id,
+        "source_name": batch.source_name,
+        "source_type": batch.source_type,
+        "total_items": batch.total_items,
+        "skipped": batch.skipped or [],
+        "created_at": batch.created_at,
+        "progress": repository.batch_progress(db, batch.id),
+        "case_ids": [case_id for (case_id,) in case_ids],
+    }
+
 @app.post("/cases/{case_id}/upload", response_model=schemas.CaseFileResponse)
 def upload_case_file(
     case_id: int, 
@@ -216,46 +332,51 @@ def upload_case_file(
         print(f"[API-ERROR] Caso {case_id} não encontrado para upload")
         raise HTTPException(status_code=404, detail="Caso não encontrado")
 
+    # Rejeita cedo quando o tamanho já é conhecido (Content-Length do multipart)
+    max_bytes = int(uploads.UPLOAD_MAX_MB * 1024 * 1024)
+    if file.size is not None and file.size > max_bytes:
+        raise HTTPException(status_code=413, detail=f"Arquivo excede o limite de {uploads.UPLOAD_MAX_MB:.0f} MB")
+
     try:
-        # 1. Save file to disk
-        file_id = str(uuid.uuid4())
-        extension = Path(file.filename).suffix
-        file_name = f"{file_id}{extension}"
-        dest_path = UPLOAD_DIR / file_name
-        
-        with dest_path.open("wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-            
+        # 1. Stream file to disk (chunks + sha256 + magic bytes, atomic move)
+        try:
+            stored = uploads.receive_upload(file.file, blob_store.INCOMING_DIR, max_bytes=max_bytes)
+        except uploads.UploadError as e:
+            print(f"[API-ERROR] Upload rejeitado: Caso {case_id}, {e}")
+            raise HTTPException(status_code=e.status_code, detail=str(e))
+
+        # Armazenamento por conteúdo: o mesmo arquivo enviado várias vezes fica uma vez só no disco
+        dest_path = blob_store.ingest(db, stored)
+
         # 2. Save record in database
         new_file = models.CaseFile(
             case_id=case_id,
             original_file_url=str(dest_path),
             processed_images_urls={},
-            dpi=300 # Default
+            dpi=300, # Default
+            content_hash=stored.sha256
         )
         db.add(new_file)
         db.commit()
         db.refresh(new_file)
-        print(f"[API] Upload concluído: ID {new_file.id} para Caso {case_id}")
+        print(f"[API] Upload concluído: ID {new_file.id} para Caso {case_id} ({stored.size} bytes)")
         return new_file
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"[API-ERROR] Falha no upload: {e}")
         raise HTTPException(status_code=500, detail=f"Erro interno no upload: {str(e)}")
 
-from fastapi import BackgroundTasks
-import uuid
-
 @app.post("/cases/{case_id}/analyze", response_model=schemas.JobResponse)
 def analyze_case(
     case_id: int, 
-    background_tasks: BackgroundTasks,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(auth.get_current_user)
 ):
     print(f"[API] Início de análise solicitado: Caso {case_id}")
     
     # 1. Get the latest file for this case
-    case_file = db.query(models.CaseFile).filter(models.CaseFile.case_id == case_id).order_by(models.CaseFile.created_at.desc()).first()
+    case_file = repository.latest_file(db, case_id)
     if not case_file:
         print(f"[API-ERROR] Tentativa de análise sem arquivo: Caso {case_id}")
         raise HTTPException(status_code=400, detail="Nenhum arquivo encontrado para este caso.")
@@ -273,14 +394,7 @@ def analyze_case(
         db.commit()
         db.refresh(new_job)
         
-        # 3. Schedule task
-        background_tasks.add_task(
-            process_vision_task, 
-            case_id=case_id, 
-            file_name=Path(case_file.original_file_url).name, 
-            dest_path=Path(case_file.original_file_url),
-            job_id=new_job.id
-        )
+        # 3. The vision workers claim QUEUED jobs from the database
         print(f"[API] Job {new_job.id} enfileirado com sucesso para Caso {case_id}")
         return new_job
     except Exception as e:
@@ -288,16 +402,40 @@ def analyze_case(
         raise HTTPException(status_code=500, detail=f"Erro ao iniciar processamento: {str(e)}")
 
 @app.get("/cases/{case_id}/jobs/latest", response_model=schemas.JobResponse)
-def get_latest_job(case_id: int, db: Session = Depends(get_db)):
-    job = db.query(models.Job).filter(models.Job.case_id == case_id).order_by(models.Job.created_at.desc()).first()
-    if not job:
+async def get_latest_job(
+    case_id: int,
+    wait: float = Query(0, ge=0, le=60, description="Long-poll: segundos esperando mudança quando If-None-Match bate"),
+    if_none_match: Optional[str] = Header(None),
+    current_user: models.User = Depends(auth.get_current_user_stream)
+):
+    snap = await job_events.hub.current(case_id)
+    if snap is None:
         raise HTTPException(status_code=404, detail="Nenhum processo em andamento.")
-    return job
+    if job_events.etag_matches(if_none_match, snap[0]):
+        changed = await job_events.hub.wait_for_change(case_id, snap[0], wait) if wait else None
+        if changed is None:
+            return Response(status_code=304, headers={"ETag": snap[0], "Cache-Control": "no-cache"})
+        snap = changed
+    etag, payload = snap
+    return JSONResponse(payload, headers={"ETag": etag, "Cache-Control": "no-cache"})
+
+@app.get("/cases/{case_id}/jobs/latest/events")
+async def stream_latest_job(
+    case_id: int,
+    last_event_id: Optional[str] = Header(None),
+    current_user: models.User = Depends(auth.get_current_user_stream)
+):
+    """Server-Sent Events com o progresso do job mais recente; encerra em done/failed."""
+    last_etag = f'"{last_event_id}"' if last_event_id else None
+    return StreamingResponse(
+        job_events.sse_stream(case_id, last_etag),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 @app.post("/cases/{case_id}/reprocess")
 def reprocess_case(
     case_id: int, 
-    background_tasks: BackgroundTasks,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(auth.get_current_user)
 ):
@@ -308,7 +446,7 @@ def reprocess_case(
         raise HTTPException(status_code=404, detail="Caso não encontrado")
     
     # 2. Get the file to reprocess
-    case_file = db.query(models.CaseFile).filter(models.CaseFile.case_id == case_id).order_by(models.CaseFile.created_at.desc()).first()
+    case_file = repository.latest_file(db, case_id)
     if not case_file:
         raise HTTPException(status_code=400, detail="Nenhum arquivo associado a este caso")
     
@@ -332,15 +470,7 @@ def reprocess_case(
     db.commit()
     db.refresh(new_job)
     
-    # 5. Schedule reprocessing
-    background_tasks.add_task(
-        process_vision_task, 
-        case_id=case_id, 
-        file_name=Path(case_file.original_file_url).name, 
-        dest_path=Path(case_file.original_file_url),
-        job_id=new_job.id
-    )
-    
+    # 5. Reprocessing is picked up by the vision workers
     print(f"[REPROCESS] Job {new_job.id} iniciado para Caso {case_id}")
     return {"status": "reprocessing", "job_id": new_job.id}
 
@@ -380,114 +510,6 @@ def get_active_ruleset(db: Session = Depends(get_db)):
         db.refresh(ruleset)
     return ruleset
 
-# Helper for file paths
-UPLOAD_DIR = Path("../storage/uploads")
-UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
-
-from fastapi import BackgroundTasks
-import uuid
-
-def process_vision_task(case_id: int, file_name: str, dest_path: Path, job_id: int):
-    db_gen = database.get_db()
-    db = next(db_gen)
-    try:
-        db_case = db.query(models.Case).filter(models.Case.id == case_id).first()
-        db_job = db.query(models.Job).filter(models.Job.id == job_id).first()
-        if not db_case or not db_job: return
-        
-        db_job.status = models.JobStatus.PROCESSING
-        db_job.progress = 10
-        db_job.current_step = "preprocess"
-        db.commit()
-
-        from vision import PaloDetector
-        detector = PaloDetector()
-        
-        print(f"[VISION-JOB] Iniciando: {case_id}")
-        raw_img, gray_img, processed_img = detector.preprocess(str(dest_path))
-        
-        # Detect Test Area (ROI) - Ignore header/footer
-        roi, found = detector.detect_test_area(processed_img)
-        
-        db_job.progress = 30
-        db_job.current_step = "detect"
-        db.commit()
-        
-        # Passed ROI to confinement detection to official test area
-        palos = detector.detect_palos(processed_img, gray_img, roi=roi)
-        
-        # 4. Logical Segmentation (Lines -> Intervals)
-        # Use gray_img for consistent height reference
-        lines = detector.cluster_lines(palos, img_height=gray_img.shape[0])
-        intervals = detector.segment_intervals(lines)
-        
-        db_job.progress = 60
-        db_job.current_step = "metrics"
-        db.commit()
-        
-        # Calibration (300DPI fallback)
-        mm_per_px = 25.4 / 300 
-        # Pass img_dims=(width, height) from GRAY image
-        metrics_data = detector.calculate_metrics(intervals, mm_per_px=mm_per_px, img_dims=(gray_img.shape[1], gray_img.shape[0]))
-        
-        # Save Detections
-        new_detection = models.Detection(
-            case_id=case_id,
-            palo_objects=jsonify_dict({
-                "palos": palos,
-                "marks": getattr(detector, 'last_marks', [])
-            }),
-            roi_config=jsonify_dict({"roi": roi})
-        )
-        db.add(new_detection)
-        
-        # Save Metrics (Including Phase 2 Clinical Metrics)
-        is_na = metrics_data.get("total") == "N/A"
-        new_metric = models.Metric(
-            case_id=case_id,
-            total_count=-1 if is_na else int(metrics_data["total"]),
-            by_interval=jsonify_dict({"counts": metrics_data["intervals"]}),
-            stats=jsonify_dict({k: v for k, v in metrics_data.items() if k not in ["total", "intervals"]}),
-            confidence_level="High" if metrics_data.get("confidence_score", 0) > 75 and not is_na else "Low",
-            confidence_reasons=jsonify_dict({
-                "score": metrics_data.get("confidence_score", 0),
-                "alerts": metrics_data.get("confidence_reasons", [])
-            })
-        )
-        db.add(new_metric)
-        
-        # Save Warped Image
-        processed_filename = f"warped_{file_name}"
-        processed_path = UPLOAD_DIR / processed_filename
-        import cv2
-        cv2.imwrite(str(processed_path), raw_img)
-        
-        # Update existing CaseFile or create one? 
-        # The upload endpoint already created one. Let's update it.
-        db_file = db.query(models.CaseFile).filter(models.CaseFile.case_id == case_id).order_by(models.CaseFile.created_at.desc()).first()
-        if db_file:
-            db_file.processed_images_urls = {"warped": str(processed_path)}
-        
-        db_job.progress = 100
-        db_job.status = models.JobStatus.DONE
-        db_job.current_step = "concluido"
-        
-        # Check if needs review
-        if metrics_data.get("regional_confidence", {}).get("needs_review", False):
-             # You might want a specific status for this
-             # For now, let's keep it DONE but the frontend will show the warnings
-             db_case.status = models.CaseStatus.DONE 
-        else:
-             db_case.status = models.CaseStatus.DONE
-             
-        db.commit()
-    except Exception as e:
-        print(f"[VISION-JOB-ERROR]: {e}")
-        db_job.status = models.JobStatus.FAILED
-        db_job.error_message = str(e)
-        db_case.status = models.CaseStatus.FAILED
-        db.commit()
-
 @app.get("/cases/{case_id}/detections", response_model=schemas.DetectionResponse)
 def get_detections(case_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(auth.get_current_user)):
     det = db.query(models.Detection).filter(models.Detection.case_id == case_id).first()
@@ -956,14 +978,69 @@ def save_clinical_analysis(
 
 @app.get("/cases/{case_id}/file")
 def get_case_file_info(case_id: int, db: Session = Depends(get_db)):
-    file = db.query(models.CaseFile).filter(models.CaseFile.case_id == case_id).first()
+    file = repository.latest_file(db, case_id)
     if not file:
         raise HTTPException(status_code=404, detail="Arquivo não encontrado")
     
     # Try to return the warped/processed version if available
-    path_to_serve = file.processed_images_urls.get("warped") or file.original_file_url
-    filename = Path(path_to_serve).name
-    return {"url": f"http://localhost:8000/storage/uploads/{filename}"}
+    processed = file.processed_images_urls or {}
+    path_to_serve = processed.get("warped") or file.original_file_url
+    preview = processed.get("preview")
+    return {
+        "url": blob_store.storage_url(path_to_serve),
+        # Versão reduzida para carregamento rápido na revisão (casos processados após a pirâmide de tiles)
+        "preview_url": blob_store.storage_url(preview) if preview else None,
+    }
+
+# Tiles da imagem retificada para o canvas de revisão (sem auth, como /file: carregados por <img>)
+TILE_CACHE_MAX_AGE = int(os.getenv("TILE_CACHE_MAX_AGE", "31536000"))
+
+def _warped_source(db: Session, case_id: int):
+    files = db.query(models.CaseFile).filter(models.CaseFile.case_id == case_id).order_by(models.CaseFile.created_at.desc()).all()
+    for f in files:
+        processed = f.processed_images_urls or {}
+        path = processed.get("warped")
+        if path and Path(path).is_file():
+            return processed.get("warped_sha256") or renditions.file_sha256(path), Path(path)
+    raise HTTPException(status_code=404, detail="Imagem processada não encontrada")
+
+@app.get("/cases/{case_id}/image/tiles")
+def get_case_tile_info(case_id: int, db: Session = Depends(get_db)):
+    sha, warped_path = _warped_source(db, case_id)
+    info = renditions.ensure_pyramid(sha, warped_path)
+    version = sha[:16]
+    return {
+        **info,
+        "version": version,
+        # `v` muda quando o caso é reprocessado: com ele o navegador pode guardar os tiles para sempre
+        "url_template": f"/cases/{case_id}/image/tiles/{{z}}/{{x}}/{{y}}?v={version}",
+    }
+
+@app.get("/cases/{case_id}/image/tiles/{z}/{x}/{y}")
+def get_case_tile(
+    case_id: int, z: int, x: int, y: int,
+    v: Optional[str] = None,
+    if_none_match: Optional[str] = Header(None),
+    db: Session = Depends(get_db)
+):
+    sha, warped_path = _warped_source(db, case_id)
+    version = sha[:16]
+    etag = f'"{version}-{z}-{x}-{y}"'
+    headers = {
+        "ETag": etag,
+        "Cache-Control": f"private, max-age={TILE_CACHE_MAX_AGE}, immutable" if v == version else "private, no-cache",
+    }
+    if if_none_match:
+        tags = [t.strip().removeprefix("W/") for t in if_none_match.split(",")]
+        if etag in tags or "*" in tags:
+            return Response(status_code=304, headers=headers)
+
+    info = renditions.ensure_pyramid(sha, warped_path)
+    tile = renditions.tile_path(sha, info, z, x, y)
+    if tile is None:
+        raise HTTPException(status_code=404, detail="Tile fora dos limites da imagem")
+    media_type = {".jpg": "image/jpeg", ".webp": "image/webp", ".png": "image/png"}.get(info["extension"], "application/octet-stream")
+    return Response(content=tile.read_bytes(), media_type=media_type, headers=headers)
 
 # Normative Groups Management
 @app.get("/settings/normative-groups", response_model=List[schemas.NormativeGroupResponse])
@@ -1095,33 +1172,53 @@ def approve_for_dataset(
 ):
     """Saves the current case results to the AI Training Dataset folder."""
     # 1. Fetch case and detections
-    case_file = db.query(models.CaseFile).filter(models.CaseFile.case_id == case_id).first()
+    case_file = repository.latest_file(db, case_id)
     detection = db.query(models.Detection).filter(models.Detection.case_id == case_id).first()
     
     if not case_file or not detection:
         raise HTTPException(status_code=404, detail="Dados de detecção não encontrados para este caso.")
     
     # 2. Setup Dataset Directory
-    dataset_dir = Path("storage/dataset")
+    dataset_dir = blob_store.DATASET_DIR
     dataset_dir.mkdir(parents=True, exist_ok=True)
     
-    # 3. Save JSON metadata
+    # 3. Link the image from the blob store (reflink/hard link, no copy)
     import json
     meta_path = dataset_dir / f"case_{case_id}_meta.json"
+    dest_img = dataset_dir / f"case_{case_id}_raw.png"
+    previous_sha = None
+    if meta_path.exists():
+        try:
+            previous_sha = json.loads(meta_path.read_text()).get("image_sha256")
+        except ValueError:
+            previous_sha = None
+
+    image_sha = None
+    blob = blob_store.path_of(db, case_file.content_hash)
+    if blob is not None and blob.is_file():
+        image_sha = case_file.content_hash
+        method = blob_store.link_to(blob, dest_img)
+        if image_sha != previous_sha:
+            blob_store.add_ref(db, image_sha, blob.suffix, blob.stat().st_size)
+        print(f"[DATASET] Caso {case_id}: imagem exportada via {method}")
+    else:
+        # Arquivos anteriores ao blob store
+        img_path = Path(case_file.original_file_url)
+        if img_path.exists():
+            shutil.copy(img_path, dest_img)
+    if previous_sha and previous_sha != image_sha:
+        blob_store.release(db, previous_sha)
+
+    # 4. Save JSON metadata
     with open(meta_path, "w") as f:
         json.dump({
             "case_id": case_id,
             "palos": detection.palo_objects.get("palos", []),
+            "image_sha256": image_sha,
             "approved_by": current_user.id,
             "approved_at": datetime.now().isoformat()
         }, f)
-    
-    # 4. Copy current warped image
-    import shutil
-    img_path = Path(case_file.original_file_url)
-    dest_img = dataset_dir / f"case_{case_id}_raw.png"
-    if img_path.exists():
-        shutil.copy(img_path, dest_img)
+    db.commit()
     
     return {"status": "success", "message": "Caso salvo no dataset de treinamento!"}
 
@@ -1131,7 +1228,7 @@ def get_dataset_stats(
     current_user: models.User = Depends(auth.get_current_user)
 ):
     """Returns statistics about the collected dataset for AI training."""
-    dataset_dir = Path("storage/dataset")
+    dataset_dir = blob_store.DATASET_DIR
     if not dataset_dir.exists():
         return {"case_count": 0, "total_palos": 0}
     
@@ -1154,9 +1251,40 @@ def get_dataset_stats(
         "progress_percent": min(100, round((len(meta_files) / 50) * 100, 1))
     }
 
+@app.get("/settings/detection-cache-stats")
+def get_detection_cache_stats(
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    """Hits/misses (agregados entre os workers), hit ratio e ocupação do cache de detecções."""
+    import detection_cache
+    return detection_cache.get_cache().stats()
+
 # Additional endpoints (etc.) will be added in further phases
 
 # Manual Correction Endpoints
+def apply_detection_edits(db: Session, case_id: int, operations: List[dict]):
+    """
+    Aplica um lote de correções (add/remove/move) numa única transação:
+    uma reescrita do palo_objects, um recálculo de métricas e um commit.
+    """
+    detection = db.query(models.Detection).filter(models.Detection.case_id == case_id).first()
+    if not detection:
+        raise HTTPException(status_code=404, detail="Detecção não encontrada")
+
+    try:
+        new_objects, index, skipped = corrections.apply_operations(detection, operations)
+    except corrections.CorrectionError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    # Atribuição de um novo dict para o SQLAlchemy detectar a mudança no JSON
+    detection.palo_objects = new_objects
+    # Recalculate metrics incrementally (no image decode / re-clustering)
+    metrics_data = corrections.apply_metrics(db, detection, index)
+    db.commit()
+    if metrics_data:
+        print(f"[RECALC] Case {case_id}: Total={metrics_data['total']}, Intervals={metrics_data['intervals']}")
+    return metrics_data, skipped
+
 @app.delete("/cases/{case_id}/detections/items/{item_id}")
 def delete_detection_item(
     case_id: int, 
@@ -1165,66 +1293,7 @@ def delete_detection_item(
     db: Session = Depends(get_db), 
     current_user: models.User = Depends(auth.get_current_user)
 ):
-    detection = db.query(models.Detection).filter(models.Detection.case_id == case_id).first()
-    if not detection:
-        raise HTTPException(status_code=404, detail="Detecção não encontrada")
-    
-    # Create copies to trigger SQLAlchemy change tracking
-    new_objects = dict(detection.palo_objects)
-    
-    if type == "palo":
-        # Convert item_id to int for palos
-        try:
-            p_id = int(item_id)
-            new_list = [p for p in new_objects.get("palos", []) if p.get("id") != p_id]
-            new_objects["palos"] = new_list
-        except:
-            pass
-    elif type == "mark":
-        new_list = [m for m in new_objects.get("marks", []) if m.get("id") != item_id]
-        new_objects["marks"] = new_list
-    
-    detection.palo_objects = new_objects
-    db.commit()
-    
-    # Recalculate metrics automatically after deletion
-    # Get common data
-    case_file = db.query(models.CaseFile).filter(models.CaseFile.case_id == case_id).order_by(models.CaseFile.created_at.desc()).first()
-    if not case_file: return {"status": "item removed"}
-    
-    from vision import PaloDetector
-    detector = PaloDetector()
-    
-    # Load image for height reference in clustering
-    # This is slightly expensive but ensures metrics stay synced
-    try:
-        import cv2
-        img = cv2.imread(case_file.original_file_url)
-        img_h = img.shape[0]
-        img_w = img.shape[1]
-        
-        # 1. Cluster surviving palos
-        # Ensure we pass marks back to detector for segmentation
-        detector.last_marks = new_objects.get("marks", [])
-        lines = detector.cluster_lines(new_objects.get("palos", []), img_height=img_h)
-        intervals = detector.segment_intervals(lines)
-        
-        # 2. Recalculate metrics
-        mm_per_px = detection.scale_mm_per_px or (25.4 / 300)
-        metrics_data = detector.calculate_metrics(intervals, mm_per_px=mm_per_px, img_dims=(img_w, img_h))
-        
-        # 3. Update existing metrics record
-        db_metric = db.query(models.Metric).filter(models.Metric.case_id == case_id).first()
-        if db_metric:
-            db_metric.total_count = int(metrics_data["total"])
-            db_metric.by_interval = jsonify_dict({"counts": metrics_data["intervals"]})
-            
-            # Map remaining metrics to stats field
-            db_metric.stats = jsonify_dict({k: v for k, v in metrics_data.items() if k not in ["total", "intervals"]})
-            db.commit()
-    except Exception as e:
-        print(f"[RECALC-ERROR] {e}")
-
+    apply_detection_edits(db, case_id, [{"op": "remove", "type": type, "id": item_id}])
     return {"status": "item removed and metrics updated"}
 
 @app.post("/cases/{case_id}/detections/items")
@@ -1235,57 +1304,26 @@ def add_detection_item(
     db: Session = Depends(get_db), 
     current_user: models.User = Depends(auth.get_current_user)
 ):
-    detection = db.query(models.Detection).filter(models.Detection.case_id == case_id).first()
-    if not detection:
-        raise HTTPException(status_code=404, detail="Detecção não encontrada")
-    
-    new_objects = dict(detection.palo_objects)
-    
-    if type == "palo":
-        palos = list(new_objects.get("palos", []))
-        # Avoid duplicates
-        if not any(p.get("id") == item.get("id") for p in palos):
-            palos.append(item)
-            new_objects["palos"] = palos
-    elif type == "mark":
-        marks = list(new_objects.get("marks", []))
-        if not any(m.get("id") == item.get("id") for m in marks):
-            marks.append(item)
-            new_objects["marks"] = marks
-    
-    detection.palo_objects = new_objects
-    db.commit()
-    
-    # Recalculate metrics
-    case_file = db.query(models.CaseFile).filter(models.CaseFile.case_id == case_id).order_by(models.CaseFile.created_at.desc()).first()
-    if case_file:
-        from vision import PaloDetector
-        detector = PaloDetector()
-        try:
-            import cv2
-            img = cv2.imread(case_file.original_file_url)
-            img_h = img.shape[0]
-            img_w = img.shape[1]
-            detector.last_marks = new_objects.get("marks", [])
-            lines = detector.cluster_lines(new_objects.get("palos", []), img_height=img_h)
-            intervals = detector.segment_intervals(lines)
-            mm_per_px = detection.scale_mm_per_px or (25.4 / 300)
-            metrics_data = detector.calculate_metrics(intervals, mm_per_px=mm_per_px, img_dims=(img_w, img_h))
-            
-            db_metric = db.query(models.Metric).filter(models.Metric.case_id == case_id).first()
-            if db_metric:
-                print(f"[RECALC] Case {case_id}: Total={metrics_data['total']}, Intervals={metrics_data['intervals']}")
-                db_metric.total_count = int(metrics_data["total"])
-                db_metric.by_interval = jsonify_dict({"counts": metrics_data["intervals"]})
-                db_metric.stats = jsonify_dict({k: v for k, v in metrics_data.items() if k not in ["total", "intervals"]})
-                db.commit()
-        except Exception as e:
-            import traceback
-            print(f"[RECALC-ERROR] {e}")
-            traceback.print_exc()
-
+    apply_detection_edits(db, case_id, [{"op": "add", "type": type, "item": item}])
     return {"status": "item added/restored"}
 
+@app.post("/cases/{case_id}/detections/batch", response_model=schemas.DetectionBatchResponse)
+def batch_edit_detections(
+    case_id: int,
+    payload: schemas.DetectionBatchRequest,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    """Várias correções de uma vez: tudo ou nada, com um único recálculo de métricas."""
+    operations = [op.model_dump(exclude_none=True) for op in payload.operations]
+    metrics_data, skipped = apply_detection_edits(db, case_id, operations)
+    return {
+        "status": "batch applied",
+        "applied": len(operations) - len(skipped),
+        "skipped": skipped,
+        "metrics": jsonify_dict(metrics_data) if metrics_data else None,
+    }
+
 @app.put("/cases/{case_id}/metrics/overrides")
 def override_metrics(
     case_id: int, 
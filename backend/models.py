@@ -1,7 +1,7 @@
 from datetime import datetime
 from enum import Enum
 from typing import List, Optional
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, JSON, Float, Boolean, Text, Enum as SQLEnum
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, JSON, Float, Boolean, Text, Enum as SQLEnum, Index
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
 
 class Base(DeclarativeBase):
@@ -40,6 +40,7 @@ class Case(Base):
     status: Mapped[CaseStatus] = mapped_column(SQLEnum(CaseStatus), default=CaseStatus.QUEUED)
     created_by: Mapped[int] = mapped_column(ForeignKey("users.id"))
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    batch_id: Mapped[Optional[int]] = mapped_column(ForeignKey("import_batches.id")) # Importação em lote de origem
     
     creator = relationship("User", back_populates="cases_created")
     files = relationship("CaseFile", back_populates="case", cascade="all, delete-orphan")
@@ -48,6 +49,14 @@ class Case(Base):
     reports = relationship("Report", back_populates="case", cascade="all, delete-orphan")
     clinical_analysis = relationship("ClinicalAnalysis", back_populates="case", uselist=False, cascade="all, delete-orphan")
 
+    # Listagem paginada (repository.list_cases): ordem (created_at, id) com filtros opcionais
+    __table_args__ = (
+        Index("ix_cases_created_at_id", "created_at", "id"),
+        Index("ix_cases_status_created_at_id", "status", "created_at", "id"),
+        Index("ix_cases_created_by_created_at_id", "created_by", "created_at", "id"),
+        Index("ix_cases_batch_id_created_at_id", "batch_id", "created_at", "id"),
+    )
+
 class CaseFile(Base):
     __tablename__ = "case_files"
     
@@ -56,10 +65,27 @@ class CaseFile(Base):
     original_file_url: Mapped[str] = mapped_column(Text)
     processed_images_urls: Mapped[dict] = mapped_column(JSON) # List of URLs
     dpi: Mapped[Optional[int]] = mapped_column(Integer)
+    content_hash: Mapped[Optional[str]] = mapped_column(String(64), index=True) # SHA-256 do arquivo original
+    # Dimensões da imagem analisada (retificada), no mesmo espaço de coordenadas dos palos
+    width: Mapped[Optional[int]] = mapped_column(Integer)
+    height: Mapped[Optional[int]] = mapped_column(Integer)
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
     
     case = relationship("Case", back_populates="files")
 
+    __table_args__ = (Index("ix_case_files_case_id_created_at", "case_id", "created_at"),)
+
+class Blob(Base):
+    """Arquivo endereçado por conteúdo em storage/blobs (ver blob_store.py)."""
+    __tablename__ = "blobs"
+
+    sha256: Mapped[str] = mapped_column(String(64), primary_key=True)
+    extension: Mapped[str] = mapped_column(String(10))
+    size: Mapped[int] = mapped_column(Integer)
+    # Referências: CaseFile original, imagem retificada, cópia no dataset
+    ref_count: Mapped[int] = mapped_column(Integer, default=0)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
 class ClinicalAnalysis(Base):
     """
     Tabela principal para o Laudo Clínico Profissional (PaloCheck Pro).
@@ -105,6 +131,9 @@ class Detection(Base):
     
     case = relationship("Case", back_populates="detections")
 
+    # Uma detecção por caso: o worker faz upsert (repository.upsert_for_case)
+    __table_args__ = (Index("uq_detections_case_id", "case_id", unique=True),)
+
 class Metric(Base):
     __tablename__ = "metrics"
     
@@ -119,6 +148,8 @@ class Metric(Base):
     
     case = relationship("Case", back_populates="metrics")
 
+    __table_args__ = (Index("uq_metrics_case_id", "case_id", unique=True),)
+
 class Ruleset(Base):
     __tablename__ = "rulesets"
     
@@ -247,5 +278,93 @@ class Job(Base):
     progress: Mapped[int] = mapped_column(Integer, default=0)
     current_step: Mapped[Optional[str]] = mapped_column(String(100)) # preprocess, detect, metrics, interpret
     error_message: Mapped[Optional[str]] = mapped_column(Text)
+    attempts: Mapped[int] = mapped_column(Integer, default=0) # Incrementado a cada claim do worker
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
     updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        Index("ix_jobs_case_id_created_at", "case_id", "created_at"),
+        Index("ix_jobs_status_created_at", "status", "created_at"),  # claim_next_job
+    )
+
+class ImportBatch(Base):
+    __tablename__ = "import_batches"
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    source_name: Mapped[Optional[str]] = mapped_column(String(255)) # Nome do ZIP/PDF enviado
+    source_type: Mapped[str] = mapped_column(String(10)) # zip, pdf
+    total_items: Mapped[int] = mapped_column(Integer, default=0) # Casos criados
+    skipped: Mapped[list] = mapped_column(JSON, default=list) # [{name, reason}] entradas ignoradas
+    created_by: Mapped[int] = mapped_column(ForeignKey("users.id"))
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
+
+def init_db(bind) -> None:
+    """Cria/atualiza o esquema no startup da API e do worker."""
+    Base.metadata.create_all(bind=bind)
+    add_missing_columns(bind)
+    create_missing_indexes(bind)
+
+
+def add_missing_columns(bind) -> None:
+    """
+    create_all não altera tabelas que já existem: adiciona (ALTER TABLE ...
+    ADD COLUMN) as colunas do modelo que faltam em bancos criados por versões
+    anteriores. Roda antes de create_missing_indexes, que pode indexá-las.
+    Colunas novas precisam ser anuláveis ou ter default escalar, que preenche
+    as linhas existentes.
+    """
+    from sqlalchemy import inspect, literal, text
+
+    inspector = inspect(bind)
+    dialect = bind.dialect
+    preparer = dialect.identifier_preparer
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {c["name"] for c in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            ddl = (f"ALTER TABLE {preparer.format_table(table)} ADD COLUMN "
+                   f"{preparer.format_column(column)} {column.type.compile(dialect=dialect)}")
+            if column.default is not None and column.default.is_scalar:
+                value = literal(column.default.arg, column.type).compile(
+                    dialect=dialect, compile_kwargs={"literal_binds": True})
+                ddl += f" DEFAULT {value}"
+            elif not column.nullable:
+                raise RuntimeError(f"Coluna {table.name}.{column.name} obrigatória sem default: migração manual necessária")
+            if not column.nullable:
+                ddl += " NOT NULL"
+            for fk in column.foreign_keys:
+                target = fk.column
+                ddl += f" REFERENCES {preparer.format_table(target.table)} ({preparer.format_column(target)})"
+            with bind.begin() as conn:
+                conn.execute(text(ddl))
+            print(f"[DB] Coluna {table.name}.{column.name} adicionada")
+
+
+def create_missing_indexes(bind) -> None:
+    """
+    create_all não cria índices novos em tabelas que já existem: cria os que
+    faltam. Um índice único não é criado enquanto a tabela tiver duplicatas
+    (ex.: duas Detection do mesmo caso em bancos antigos); o startup nunca
+    apaga linhas, isso fica para `python dedupe_case_rows.py`.
+    """
+    from sqlalchemy import func, inspect, select
+
+    inspector = inspect(bind)
+    for table in Base.metadata.sorted_tables:
+        existing = {ix["name"] for ix in inspector.get_indexes(table.name)} if inspector.has_table(table.name) else set()
+        for index in table.indexes:
+            if index.name in existing:
+                continue
+            if index.unique:
+                groups = select(*index.columns).group_by(*index.columns).having(func.count() > 1).subquery()
+                with bind.connect() as conn:
+                    duplicated = conn.execute(select(func.count()).select_from(groups)).scalar()
+                if duplicated:
+                    print(f"[DB] {table.name}: {duplicated} grupo(s) duplicado(s) em {', '.join(index.columns.keys())}; "
+                          f"índice {index.name} não criado (rode `python dedupe_case_rows.py`)")
+                    continue
+            index.create(bind=bind, checkfirst=True)
@@ -0,0 +1,307 @@
+"""
+Análise offline em lote: roda o PaloDetector sobre um diretório (ou glob)
+de digitalizações num pool de processos, gravando um registro por imagem
+assim que ela termina. Serve para reprocessar arquivos históricos e para
+rodadas de regressão, sem banco nem API.
+
+Uso:
+    python palo_batch.py scans/ "arquivo/2023/**/*.jpg" -o resultados.jsonl --workers 8
+    python palo_batch.py scans/ -o resultados.parquet --format parquet   (requer pyarrow)
+
+Cada registro traz contagens/métricas, ROI e o tempo de cada etapa; no fim
+sai no stderr o resumo de vazão (imagens/s) e tempos por etapa.
+"""
+
+import glob
+import hashlib
+import json
+import os
+import signal
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional
+
+from utils import jsonify_dict
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".tif", ".tiff", ".bmp", ".webp"}
+BATCH_PARQUET_ROW_GROUP = int(os.getenv("BATCH_PARQUET_ROW_GROUP", "500"))
+
+
+def collect_inputs(patterns: Iterable[str]) -> List[Path]:
+    """Diretórios (recursivo, só extensões de imagem), globs ou arquivos; sem repetição, ordenados."""
+    found = set()
+    for pattern in patterns:
+        path = Path(pattern)
+        if path.is_dir():
+            found.update(p for p in path.rglob("*") if p.suffix.lower() in IMAGE_EXTENSIONS and p.is_file())
+        elif glob.has_magic(pattern):
+            found.update(Path(p) for p in glob.glob(pattern, recursive=True) if Path(p).is_file())
+        elif path.is_file():
+            found.add(path)
+        else:
+            print(f"[BATCH] Ignorando entrada inexistente: {pattern}", file=sys.stderr)
+    return sorted(found)
+
+
+def _sha256_of(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _number(value):
+    return None if value == "N/A" else value
+
+
+# -- execução (um detector por processo) -----------------------------------------------
+
+_detector = None
+
+
+def _load_detector(config: Optional[Dict[str, Any]] = None) -> None:
+    global _detector
+    from vision import PaloDetector
+    _detector = PaloDetector(config)
+
+
+def _init_process(config: Optional[Dict[str, Any]] = None, processes: int = 1) -> None:
+    # Ctrl+C é tratado pelo processo principal
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # Cada processo usa sua fatia dos núcleos nas operações do OpenCV
+    import cv_resources
+    cv_resources.configure_process(processes)
+    _load_detector(config)
+
+
+def analyze_file(path: str) -> Dict[str, Any]:
+    """Registro de uma imagem; erros viram status="error" em vez de derrubar o lote."""
+    if _detector is None:
+        _load_detector()
+    record = {"path": path, "pid": os.getpid()}
+    start = time.perf_counter()
+    try:
+        record["sha256"] = _sha256_of(Path(path))
+        result = _detector.detect(path)
+    except Exception as e:
+        record.update(status="error", error=f"{type(e).__name__}: {e}",
+                      total_ms=round((time.perf_counter() - start) * 1000, 2))
+        return record
+
+    metrics = result.metrics
+    meta = result.run_meta
+    intervals = metrics.get("intervals")
+    record.update({
+        "status": "ok",
+        "metrics_status": metrics.get("status"),
+        "reason_code": metrics.get("reason_code"),
+        "total": _number(metrics.get("total")),
+        "intervals": intervals if intervals and "N/A" not in intervals else None,
+        "nor": _number(metrics.get("nor")),
+        "cv": _number(metrics.get("cv")),
+        "mean": _number(metrics.get("mean")),
+        "trend": _number(metrics.get("trend")),
+        "confidence_score": metrics.get("confidence_score"),
+        "roi_source": meta.get("roi_source"),
+        "roi": result.roi,
+        "n_palos": len(result.palos),
+        "n_marks": len(result.marks),
+        "width": result.image_dims[0],
+        "height": result.image_dims[1],
+        "total_ms": round((time.perf_counter() - start) * 1000, 2),
+        "timings_ms": dict(meta.get("stage_timings_ms", {}), **{
+            f"preprocess.{k}": v for k, v in meta.get("preprocess_timings_ms", {}).items()}),
+    })
+    return jsonify_dict(record)
+
+
+# -- saída ------------------------------------------------------------------------------
+
+class JsonlWriter:
+    def __init__(self, output: str):
+        self._file = sys.stdout if output == "-" else open(output, "w", encoding="utf-8")
+
+    def write(self, record: Dict[str, Any]) -> None:
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._file.flush()  # lotes longos: o arquivo parcial já é utilizável
+
+    def close(self) -> None:
+        if self._file is not sys.stdout:
+            self._file.close()
+
+
+class ParquetWriter:
+    """
+    Colunar via pyarrow (opcional), com esquema fixo: um row group a cada
+    BATCH_PARQUET_ROW_GROUP registros. Campos dict (timings_ms) vão como JSON.
+    """
+
+    def __init__(self, output: str, row_group: int = BATCH_PARQUET_ROW_GROUP):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError as e:
+            raise SystemExit("[BATCH] --format parquet requer pyarrow (pip install pyarrow)") from e
+        self._pa = pa
+        self.schema = pa.schema([
+            ("path", pa.string()), ("sha256", pa.string()), ("status", pa.string()), ("error", pa.string()),
+            ("metrics_status", pa.string()), ("reason_code", pa.string()),
+            ("total", pa.int64()), ("intervals", pa.list_(pa.int64())),
+            ("nor", pa.float64()), ("cv", pa.float64()), ("mean", pa.float64()), ("trend", pa.string()),
+            ("confidence_score", pa.int64()), ("roi_source", pa.string()), ("roi", pa.list_(pa.int64())),
+            ("n_palos", pa.int64()), ("n_marks", pa.int64()), ("width", pa.int64()), ("height", pa.int64()),
+            ("total_ms", pa.float64()), ("timings_ms", pa.string()), ("pid", pa.int64()),
+        ])
+        self._writer = pq.ParquetWriter(output, self.schema)
+        self._row_group = row_group
+        self._rows: List[Dict[str, Any]] = []
+
+    def write(self, record: Dict[str, Any]) -> None:
+        row = dict(record)
+        if "timings_ms" in row:
+            row["timings_ms"] = json.dumps(row["timings_ms"])
+        self._rows.append(row)
+        if len(self._rows) >= self._row_group:
+            self._flush()
+
+    def _flush(self) -> None:
+        if self._rows:
+            self._writer.write_table(self._pa.Table.from_pylist(self._rows, schema=self.schema))
+            self._rows = []
+
+    def close(self) -> None:
+        self._flush()
+        self._writer.close()
+
+
+WRITERS = {"jsonl": JsonlWriter, "parquet": ParquetWriter}
+
+
+# -- orquestração -----------------------------------------------------------------------
+
+def _percentile(sorted_values: List[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))]
+
+
+def summarize(records: List[Dict[str, Any]], wall_s: float, workers: int) -> Dict[str, Any]:
+    ok = [r for r in records if r["status"] == "ok"]
+    per_image = sorted(r["total_ms"] for r in ok)
+    stages: Dict[str, float] = {}
+    for r in ok:
+        for name, ms in r["timings_ms"].items():
+            if "." not in name:
+                stages[name] = stages.get(name, 0.0) + ms
+    return {
+        "images": len(records),
+        "ok": len(ok),
+        "errors": len(records) - len(ok),
+        "wall_s": round(wall_s, 2),
+        "images_per_s": round(len(records) / wall_s, 2) if wall_s > 0 else 0.0,
+        "workers": workers,
+        "per_image_ms": {
+            "mean": round(sum(per_image) / len(per_image), 1) if per_image else 0.0,
+            "p50": _percentile(per_image, 50),
+            "p95": _percentile(per_image, 95),
+        },
+        "stage_mean_ms": {k: round(v / len(ok), 1) for k, v in stages.items()},
+    }
+
+
+def run_batch(inputs: List[Path], writer, workers: int = 1, config: Optional[Dict[str, Any]] = None,
+              progress_every: int = 25) -> Dict[str, Any]:
+    """
+    Processa `inputs` e entrega cada registro ao `writer` na ordem em que
+    terminam. Com workers > 1 mantém no máximo 2x workers imagens em voo, para
+    que um arquivo de milhares de imagens não vire milhares de futures.
+    """
+    records = []
+    start = time.perf_counter()
+
+    def emit(record):
+        writer.write(record)
+        # o resumo só precisa dos tempos
+        records.append({k: record.get(k) for k in ("status", "total_ms", "timings_ms")})
+        if record["status"] != "ok":
+            print(f"[BATCH] Falha em {record['path']}: {record.get('error')}", file=sys.stderr)
+        if progress_every and len(records) % progress_every == 0:
+            elapsed = time.perf_counter() - start
+            print(f"[BATCH] {len(records)}/{len(inputs)} imagens ({len(records) / elapsed:.2f} img/s)", file=sys.stderr)
+
+    if workers <= 1:
+        _load_detector(config)
+        for path in inputs:
+            emit(analyze_file(str(path)))
+    else:
+        pending = iter(inputs)
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_process, initargs=(config, workers)) as pool:
+            inflight = {}
+
+            def submit_next():
+                path = next(pending, None)
+                if path is not None:
+                    inflight[pool.submit(analyze_file, str(path))] = path
+
+            for _ in range(workers * 2):
+                submit_next()
+            while inflight:
+                done, _ = wait(list(inflight), return_when=FIRST_COMPLETED)
+                for future in done:
+                    path = inflight.pop(future)
+                    try:
+                        record = future.result()
+                    except Exception as e:  # processo morto (ex.: BrokenProcessPool)
+                        record = {"path": str(path), "status": "error", "error": f"{type(e).__name__}: {e}"}
+                    emit(record)
+                    submit_next()
+
+    return summarize(records, time.perf_counter() - start, workers)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Análise em lote do PaloDetector sobre digitalizações")
+    parser.add_argument("inputs", nargs="+", help="Diretórios, globs (aceita **) ou arquivos de imagem")
+    parser.add_argument("-o", "--output", default="-", help="Arquivo de saída ('-' = stdout)")
+    parser.add_argument("--format", choices=sorted(WRITERS), default=None,
+                        help="jsonl (padrão) ou parquet; padrão deduzido da extensão de --output")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Processos em paralelo (1 = no processo atual)")
+    parser.add_argument("--config", help="JSON com a configuração do PaloDetector (substitui a padrão)")
+    parser.add_argument("--limit", type=int, help="Processa só as N primeiras imagens")
+    parser.add_argument("--progress-every", type=int, default=25)
+    args = parser.parse_args(argv)
+
+    inputs = collect_inputs(args.inputs)[:args.limit]
+    if not inputs:
+        print("[BATCH] Nenhuma imagem encontrada", file=sys.stderr)
+        return 1
+    config = json.loads(Path(args.config).read_text()) if args.config else None
+    fmt = args.format or ("parquet" if args.output.endswith(".parquet") else "jsonl")
+    if fmt == "parquet" and args.output == "-":
+        parser.error("parquet precisa de um arquivo em --output")
+
+    workers = max(1, min(args.workers, len(inputs)))
+    print(f"[BATCH] {len(inputs)} imagens, {workers} processo(s), saída {args.output} ({fmt})", file=sys.stderr)
+    writer = WRITERS[fmt](args.output)
+    try:
+        summary = run_batch(inputs, writer, workers=workers, config=config, progress_every=args.progress_every)
+    finally:
+        writer.close()
+
+    per_image = summary["per_image_ms"]
+    print(f"[BATCH] {summary['images']} imagens em {summary['wall_s']} s ({summary['images_per_s']} img/s, "
+          f"{workers} processo(s)): {summary['ok']} ok, {summary['errors']} erro(s)", file=sys.stderr)
+    print(f"[BATCH] Por imagem: média {per_image['mean']} ms, p50 {per_image['p50']} ms, p95 {per_image['p95']} ms",
+          file=sys.stderr)
+    stages = ", ".join(f"{k} {v}" for k, v in summary["stage_mean_ms"].items())
+    print(f"[BATCH] Etapas (média ms): {stages}", file=sys.stderr)
+    return 0 if summary["errors"] == 0 else 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
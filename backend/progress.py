@@ -0,0 +1,82 @@
+"""
+Progresso fino dos jobs de visão, com escrita econômica no banco.
+
+Os estágios do PaloDetector chamam `progress.update(subetapa, fração)` quantas
+vezes quiserem; o ProgressReporter guarda o último valor em memória e só o
+grava na linha `Job` quando passaram JOB_PROGRESS_FLUSH_MS desde a última
+escrita (ou em `flush()`). Assim a barra anda continuamente sem transformar
+cada passo do pipeline numa ida ao banco.
+"""
+
+import os
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+JOB_PROGRESS_FLUSH_MS = int(os.getenv("JOB_PROGRESS_FLUSH_MS", "500"))
+
+# subetapa -> (current_step exibido, início %, fim %). Os rótulos são os passos
+# que o frontend conhece; as subetapas só dividem a faixa de cada um.
+PIPELINE_STAGES: Dict[str, Tuple[str, int, int]] = {
+    "preprocess": ("preprocess", 10, 25),
+    "roi": ("preprocess", 25, 30),
+    "detect": ("detect", 30, 55),
+    "segment": ("detect", 55, 60),
+    "metrics": ("metrics", 60, 70),
+    "renditions": ("metrics", 70, 95),
+}
+
+
+class NullProgress:
+    """Progresso descartado (uso do detector fora do worker)."""
+
+    def update(self, stage: str, fraction: float = 0.0) -> None:
+        pass
+
+    def flush(self) -> None:
+        pass
+
+
+NULL_PROGRESS = NullProgress()
+
+
+class ProgressReporter:
+    """
+    Agrega atualizações de progresso e as entrega a `write(progress, step)` no
+    máximo uma vez a cada `flush_ms`. O progresso nunca regride; o valor
+    pendente é gravado na próxima atualização após o intervalo ou em `flush()`.
+    """
+
+    def __init__(self, write: Callable[[int, str], None], flush_ms: Optional[int] = None,
+                 stages: Dict[str, Tuple[str, int, int]] = PIPELINE_STAGES,
+                 progress: int = 0, step: Optional[str] = None,
+                 clock: Callable[[], float] = time.monotonic):
+        self._write = write
+        self.interval = (JOB_PROGRESS_FLUSH_MS if flush_ms is None else flush_ms) / 1000
+        self.stages = stages
+        self.progress = progress
+        self.step = step
+        self.flushes = 0
+        self._clock = clock
+        self._dirty = False
+        self._last_flush = clock()  # o estado inicial já está no banco
+
+    def update(self, stage: str, fraction: float = 0.0) -> None:
+        step, start, end = self.stages[stage]
+        value = max(self.progress, int(start + (end - start) * min(max(fraction, 0.0), 1.0)))
+        if value == self.progress and step == self.step:
+            return  # caminho comum em laços: nada mudou, nem consulta o relógio
+        self.progress, self.step, self._dirty = value, step, True
+        if self._clock() - self._last_flush >= self.interval:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self._dirty:
+            return
+        self._dirty = False
+        self._last_flush = self._clock()
+        self.flushes += 1
+        try:
+            self._write(self.progress, self.step)
+        except Exception as e:
+            # Progresso é informativo: falha ao gravar não derruba o job
+            print(f"[JOB-PROGRESS] Falha ao gravar progresso: {e}")
@@ -0,0 +1,260 @@
+"""
+Versões da imagem retificada servidas à interface de revisão.
+
+O detector nunca relê a imagem retificada: reprocessar parte sempre do
+upload original, que continua sem perdas no blob store. Por isso a retificada
+é gravada num formato compacto configurável (JPEG otimizado e progressivo
+por padrão; WebP comprime um pouco melhor mas codifica uma ordem de grandeza
+mais devagar em scans de 600 DPI), junto com uma prévia reduzida e uma
+pirâmide de tiles para o canvas de revisão.
+
+Pirâmide: o nível `max_level` é a resolução total; cada nível abaixo tem
+metade da largura/altura, até o nível 0 caber num único tile. Os tiles
+ficam em TILE_DIR/<sha256 da retificada>/<z>/<x>_<y><ext>, ou seja, são
+compartilhados por casos com a mesma imagem e removidos pelo blob_store.gc
+quando a retificada deixa de existir.
+"""
+
+import functools
+import hashlib
+import json
+import math
+import os
+import shutil
+import tempfile
+import threading
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+import blob_store
+
+WARPED_FORMAT = os.getenv("WARPED_FORMAT", "jpg").lower()  # webp | jpg | png | source (extensão do upload)
+WARPED_QUALITY = int(os.getenv("WARPED_QUALITY", "85"))  # WebP/JPEG
+PNG_COMPRESSION = int(os.getenv("PNG_COMPRESSION", "6"))  # 0-9, sem perdas
+PREVIEW_MAX_PX = int(os.getenv("PREVIEW_MAX_PX", "1600"))
+TILE_SIZE = int(os.getenv("TILE_SIZE", "256"))
+TILE_FORMAT = os.getenv("TILE_FORMAT", "jpg").lower()
+TILE_QUALITY = int(os.getenv("TILE_QUALITY", "80"))
+TILES_PREGENERATE = os.getenv("TILES_PREGENERATE", "1") == "1"  # 0: gerados sob demanda
+TILE_DIR = Path(os.getenv("TILE_DIR", str(blob_store.STORAGE_ROOT / "tiles")))
+
+_EXTENSIONS = {"webp": ".webp", "jpg": ".jpg", "jpeg": ".jpg", "png": ".png"}
+
+
+def extension_for(fmt: str, source_ext: str = ".png") -> str:
+    if fmt == "source":
+        return (source_ext or ".png").lower()
+    if fmt not in _EXTENSIONS:
+        raise ValueError(f"Formato de imagem desconhecido: {fmt!r}")
+    return _EXTENSIONS[fmt]
+
+
+def encode(img, ext: str, quality: int = WARPED_QUALITY, progressive: bool = True) -> bytes:
+    """`progressive` só vale para JPEG: a imagem aparece por inteiro e vai ganhando nitidez."""
+    import cv2
+
+    ext = ext.lower()
+    if ext == ".webp":
+        params = [cv2.IMWRITE_WEBP_QUALITY, quality]
+    elif ext in (".jpg", ".jpeg"):
+        params = [cv2.IMWRITE_JPEG_QUALITY, quality, cv2.IMWRITE_JPEG_OPTIMIZE, 1,
+                  cv2.IMWRITE_JPEG_PROGRESSIVE, int(progressive)]
+    elif ext == ".png":
+        params = [cv2.IMWRITE_PNG_COMPRESSION, PNG_COMPRESSION]
+    else:
+        params = []
+    ok, buf = cv2.imencode(ext, img, params)
+    if not ok:
+        raise ValueError(f"Falha ao codificar a imagem ({ext})")
+    return buf.tobytes()
+
+
+def decode(image_bytes: bytes):
+    import cv2
+    import numpy as np
+
+    img = cv2.imdecode(np.frombuffer(image_bytes, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if img is None:
+        raise ValueError("Falha ao decodificar a imagem retificada")
+    return img
+
+
+def reencode(image_bytes: bytes, ext: str, target_ext: str) -> bytes:
+    """Converte bytes já codificados (ex.: entrada do detection_cache) para outro formato."""
+    if ext.lower() == target_ext.lower():
+        return image_bytes
+    return encode(decode(image_bytes), target_ext)
+
+
+def downscale(img, max_px: int):
+    """Reduz para caber em max_px x max_px (INTER_AREA); nunca amplia."""
+    import cv2
+
+    h, w = img.shape[:2]
+    scale = max_px / max(h, w)
+    if scale >= 1:
+        return img
+    return cv2.resize(img, (max(1, round(w * scale)), max(1, round(h * scale))), interpolation=cv2.INTER_AREA)
+
+
+# -- pirâmide de tiles ---------------------------------------------------------------
+
+def pyramid_info(width: int, height: int, tile_size: Optional[int] = None, fmt: Optional[str] = None) -> Dict[str, Any]:
+    tile_size, fmt = tile_size or TILE_SIZE, fmt or TILE_FORMAT
+    max_level = max(0, math.ceil(math.log2(max(width, height) / tile_size)))
+    levels = []
+    for z in range(max_level + 1):
+        scale = 2.0 ** (z - max_level)
+        w, h = max(1, math.ceil(width * scale)), max(1, math.ceil(height * scale))
+        levels.append({"z": z, "width": w, "height": h,
+                       "cols": math.ceil(w / tile_size), "rows": math.ceil(h / tile_size)})
+    return {"width": width, "height": height, "tile_size": tile_size, "max_level": max_level,
+            "format": fmt, "extension": extension_for(fmt), "levels": levels}
+
+
+def tile_dir(warped_sha256: str) -> Path:
+    return TILE_DIR / warped_sha256
+
+
+def level_image(img, info: Dict[str, Any], z: int):
+    import cv2
+
+    level = info["levels"][z]
+    if (level["width"], level["height"]) == (img.shape[1], img.shape[0]):
+        return img
+    return cv2.resize(img, (level["width"], level["height"]), interpolation=cv2.INTER_AREA)
+
+
+def write_pyramid(img, warped_sha256: str, tile_size: Optional[int] = None, fmt: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Gera todos os níveis num diretório temporário e o publica com um rename,
+    então leitores nunca veem uma pirâmide incompleta. Idempotente: se outro
+    worker já publicou a mesma pirâmide, a cópia local é descartada.
+    """
+    final = tile_dir(warped_sha256)
+    meta_path = final / "meta.json"
+    if meta_path.is_file():
+        return json.loads(meta_path.read_text())
+
+    info = pyramid_info(img.shape[1], img.shape[0], tile_size, fmt)
+    tile_size = info["tile_size"]
+    TILE_DIR.mkdir(parents=True, exist_ok=True)
+    tmp = Path(tempfile.mkdtemp(dir=TILE_DIR, prefix=f".{warped_sha256[:12]}-"))
+    try:
+        level = img
+        for z in range(info["max_level"], -1, -1):
+            # Cada nível sai do anterior (metade do tamanho): bem mais barato que partir sempre da resolução total
+            level = level_image(level, info, z)
+            (tmp / str(z)).mkdir()
+            for y in range(info["levels"][z]["rows"]):
+                for x in range(info["levels"][z]["cols"]):
+                    tile = level[y * tile_size:(y + 1) * tile_size, x * tile_size:(x + 1) * tile_size]
+                    data = encode(tile, info["extension"], TILE_QUALITY, progressive=False)
+                    (tmp / str(z) / f"{x}_{y}{info['extension']}").write_bytes(data)
+        (tmp / "meta.json").write_text(json.dumps(info))
+        try:
+            os.rename(tmp, final)
+        except OSError:
+            shutil.rmtree(tmp, ignore_errors=True)  # publicada por outro processo
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+    return info
+
+
+# -- leitura (endpoint de tiles) ----------------------------------------------------------
+
+_pyramid_locks: Dict[str, threading.Lock] = {}
+_pyramid_locks_guard = threading.Lock()
+
+
+@functools.lru_cache(maxsize=512)
+def _read_meta(warped_sha256: str) -> Dict[str, Any]:
+    # Pirâmides são imutáveis: o meta.json pode ficar em memória (FileNotFoundError não é cacheado)
+    return json.loads((tile_dir(warped_sha256) / "meta.json").read_text())
+
+
+def _load_meta(warped_sha256: str) -> Dict[str, Any]:
+    if not tile_dir(warped_sha256).is_dir():
+        _read_meta.cache_clear()  # removida pelo gc
+        raise FileNotFoundError(warped_sha256)
+    return _read_meta(warped_sha256)
+
+
+def file_sha256(path) -> str:
+    """Hash de retificadas antigas, gravadas antes do blob store (memorizado por mtime)."""
+    st = os.stat(path)
+    return _file_sha256(str(path), st.st_mtime_ns, st.st_size)
+
+
+@functools.lru_cache(maxsize=256)
+def _file_sha256(path: str, mtime_ns: int, size: int) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def ensure_pyramid(warped_sha256: str, warped_path) -> Dict[str, Any]:
+    """
+    Metadados da pirâmide, gerando-a na primeira requisição quando o worker
+    não a pré-gerou (TILES_PREGENERATE=0 ou casos antigos). Requisições
+    simultâneas do mesmo processo esperam uma única geração.
+    """
+    try:
+        return _load_meta(warped_sha256)
+    except FileNotFoundError:
+        pass
+    with _pyramid_locks_guard:
+        lock = _pyramid_locks.setdefault(warped_sha256, threading.Lock())
+    with lock:
+        try:
+            return _load_meta(warped_sha256)
+        except FileNotFoundError:
+            print(f"[RENDITIONS] Gerando pirâmide sob demanda (sha256 {warped_sha256[:12]})")
+            write_pyramid(decode(Path(warped_path).read_bytes()), warped_sha256)
+            return _load_meta(warped_sha256)
+        finally:
+            with _pyramid_locks_guard:
+                _pyramid_locks.pop(warped_sha256, None)
+
+
+def tile_path(warped_sha256: str, info: Dict[str, Any], z: int, x: int, y: int) -> Optional[Path]:
+    """Arquivo do tile, ou None fora dos limites da pirâmide."""
+    if not 0 <= z <= info["max_level"]:
+        return None
+    level = info["levels"][z]
+    if not (0 <= x < level["cols"] and 0 <= y < level["rows"]):
+        return None
+    return tile_dir(warped_sha256) / str(z) / f"{x}_{y}{info['extension']}"
+
+
+# -- etapa de armazenamento do worker ------------------------------------------------
+
+def store_renditions(db, warped_bytes: bytes, warped_ext: str, source_ext: str,
+                     warped_img=None, previous: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Grava retificada (formato compacto), prévia e pirâmide de tiles; libera as
+    referências da execução anterior (`previous` = processed_images_urls antigo).
+    Retorna o novo processed_images_urls. Não faz commit.
+    """
+    target_ext = extension_for(WARPED_FORMAT, source_ext)
+    data = reencode(warped_bytes, warped_ext, target_ext)
+    warped_sha, warped_path = blob_store.put_bytes(db, data, target_ext)
+
+    img = warped_img if warped_img is not None else decode(data)
+    preview_sha, preview_path = blob_store.put_bytes(db, encode(downscale(img, PREVIEW_MAX_PX), target_ext), target_ext)
+    if TILES_PREGENERATE:
+        write_pyramid(img, warped_sha)
+
+    previous = previous or {}
+    blob_store.release(db, previous.get("warped_sha256"))
+    blob_store.release(db, previous.get("preview_sha256"))
+    print(f"[RENDITIONS] Retificada {target_ext} {len(data) / 2**20:.1f} MB (sha256 {warped_sha[:12]})")
+    return {
+        "warped": str(warped_path),
+        "warped_sha256": warped_sha,
+        "preview": str(preview_path),
+        "preview_sha256": preview_sha,
+    }
@@ -0,0 +1,179 @@
+"""
+Camada de acesso a dados compartilhada pelos endpoints e pelo worker.
+
+Listagem de casos com paginação por chave (keyset): a ordem é
+(created_at DESC, id DESC) e o cursor guarda a última chave da página, então
+cada página custa um range scan no índice, sem OFFSET.
+"""
+
+import base64
+import json
+from datetime import datetime
+from typing import List, NamedTuple, Optional, Sequence, Tuple
+
+from sqlalchemy import and_, func, or_, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import aliased
+
+import models
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(created_at: datetime, case_id: int) -> str:
+    raw = json.dumps([created_at.isoformat(), case_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, case_id = json.loads(raw)
+        return datetime.fromisoformat(created_at), int(case_id)
+    except (ValueError, TypeError) as e:
+        raise InvalidCursor(f"Cursor inválido: {cursor!r}") from e
+
+
+class CasePage:
+    __slots__ = ("items", "next_cursor", "total")
+
+    def __init__(self, items: List[models.Case], next_cursor: Optional[str], total: Optional[int]):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.total = total
+
+
+def list_cases(db, *, limit: Optional[int] = 50, cursor: Optional[str] = None,
+               statuses: Optional[Sequence[models.CaseStatus]] = None,
+               created_by: Optional[int] = None,
+               created_from: Optional[datetime] = None,
+               created_to: Optional[datetime] = None,
+               patient_code_prefix: Optional[str] = None,
+               batch_id: Optional[int] = None,
+               with_total: Optional[bool] = None) -> CasePage:
+    """
+    Uma página de casos, do mais recente para o mais antigo.
+
+    `total` (casos que batem com os filtros) só é contado na primeira página
+    por padrão: nas seguintes o cliente já tem o número, e evitar o COUNT
+    mantém cada página em O(limit). `limit=None` devolve todos os casos, sem
+    próxima página.
+    """
+    Case = models.Case
+    query = db.query(Case)
+    if statuses:
+        query = query.filter(Case.status.in_(list(statuses)))
+    if created_by is not None:
+        query = query.filter(Case.created_by == created_by)
+    if created_from is not None:
+        query = query.filter(Case.created_at >= created_from)
+    if created_to is not None:
+        query = query.filter(Case.created_at < created_to)
+    if patient_code_prefix:
+        query = query.filter(Case.patient_code.startswith(patient_code_prefix, autoescape=True))
+    if batch_id is not None:
+        query = query.filter(Case.batch_id == batch_id)
+
+    total = None
+    if with_total if with_total is not None else cursor is None:
+        total = query.with_entities(func.count(Case.id)).scalar()
+
+    if cursor:
+        after_created, after_id = decode_cursor(cursor)
+        query = query.filter(or_(Case.created_at < after_created,
+                                 and_(Case.created_at == after_created, Case.id < after_id)))
+
+    query = query.order_by(Case.created_at.desc(), Case.id.desc())
+    if limit is None:
+        return CasePage(query.all(), None, total)
+    rows = query.limit(limit + 1).all()
+    items = rows[:limit]
+    next_cursor = encode_cursor(items[-1].created_at, items[-1].id) if len(rows) > limit else None
+    return CasePage(items, next_cursor, total)
+
+
+# -- "mais recente por caso" -----------------------------------------------------------
+# CaseFile e Job podem ter várias linhas por caso (índices (case_id, created_at));
+# Detection e Metric têm no máximo uma (índice único em case_id, ver upsert_for_case).
+
+def _latest_id(model):
+    inner = aliased(model)  # a tabela externa também está no FROM: correlacionar só com Case
+    return (select(inner.id).where(inner.case_id == models.Case.id)
+            .order_by(inner.created_at.desc(), inner.id.desc()).limit(1)
+            .correlate(models.Case).scalar_subquery())
+
+
+def latest_file(db, case_id: int) -> Optional[models.CaseFile]:
+    return (db.query(models.CaseFile).filter(models.CaseFile.case_id == case_id)
+            .order_by(models.CaseFile.created_at.desc(), models.CaseFile.id.desc()).first())
+
+
+def latest_job(db, case_id: int) -> Optional[models.Job]:
+    return (db.query(models.Job).filter(models.Job.case_id == case_id)
+            .order_by(models.Job.created_at.desc(), models.Job.id.desc()).first())
+
+
+class CaseBundle(NamedTuple):
+    case: models.Case
+    file: Optional[models.CaseFile]
+    detection: Optional[models.Detection]
+    metric: Optional[models.Metric]
+    job: Optional[models.Job]
+
+
+def get_case_bundle(db, case_id: int) -> Optional[CaseBundle]:
+    """Caso + arquivo mais recente + detecção + métrica + job mais recente numa única consulta."""
+    Case = models.Case
+    row = (db.query(Case, models.CaseFile, models.Detection, models.Metric, models.Job)
+           .select_from(Case)
+           .outerjoin(models.CaseFile, models.CaseFile.id == _latest_id(models.CaseFile))
+           .outerjoin(models.Detection, models.Detection.case_id == Case.id)
+           .outerjoin(models.Metric, models.Metric.case_id == Case.id)
+           .outerjoin(models.Job, models.Job.id == _latest_id(models.Job))
+           .filter(Case.id == case_id)
+           .first())
+    return CaseBundle(*row) if row else None
+
+
+def batch_progress(db, batch_id: int) -> dict:
+    """
+    Progresso agregado de um lote de importação: jobs (o mais recente de cada
+    caso) por status e a média do progresso, numa consulta agrupada.
+    """
+    Job = models.Job
+    latest = (db.query(Job.status, func.count(Job.id), func.coalesce(func.sum(Job.progress), 0))
+              .join(models.Case, models.Case.id == Job.case_id)
+              .filter(models.Case.batch_id == batch_id, Job.id == _latest_id(Job))
+              .group_by(Job.status).all())
+    counts = {s.value: 0 for s in models.JobStatus}
+    total = progress_sum = 0
+    for status, count, progress in latest:
+        counts[models.JobStatus(status).value] = count
+        total += count
+        # Jobs com falha contam como concluídos para a barra do lote
+        progress_sum += 100 * count if status == models.JobStatus.FAILED else progress
+    counts["total"] = total
+    counts["percent"] = round(progress_sum / total) if total else 0
+    return counts
+
+
+def upsert_for_case(db, model, case_id: int, **values):
+    """
+    Detection/Metric: uma linha por caso. Atualiza a existente ou cria; se
+    outro processo criar a linha ao mesmo tempo, o índice único rejeita o
+    INSERT e a linha dele é atualizada. Não faz commit.
+    """
+    row = db.query(model).filter(model.case_id == case_id).first()
+    if row is None:
+        try:
+            with db.begin_nested():
+                row = model(case_id=case_id, **values)
+                db.add(row)
+            return row
+        except IntegrityError:
+            row = db.query(model).filter(model.case_id == case_id).one()
+    for key, value in values.items():
+        setattr(row, key, value)
+    return row
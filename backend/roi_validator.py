@@ -6,6 +6,11 @@ para garantir máxima confiabilidade e adaptabilidade a diferentes scans.
 import cv2
 import numpy as np
 
+import cv_resources
+
+STRUCTURE_STROKE_LEN = 20  # abertura 1x20 do recorte da ROI (marcos no topo)
+DENSITY_STROKE_LEN = 25  # abertura 1x25 do recorte da ROI (traços por intervalo)
+
 class ROIValidator:
     def __init__(self):
         self.validation_log = []
@@ -16,18 +21,16 @@ class ROIValidator:
         próximos ao topo da ROI detectada.
         """
         x, y, w, h = roi
-        roi_img = img[y:y+h, x:x+w]
         
         # Busca por linhas horizontais no topo da ROI
-        v_kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (1, 20))
-        v_mask = cv2.morphologyEx(roi_img, cv2.MORPH_OPEN, v_kernel)
-        row_sums = np.sum(v_mask, axis=1)
+        row_sums = self._opened_row_sums(img, roi, STRUCTURE_STROKE_LEN)
         
         # Se há densidade significativa nos primeiros 5% da ROI, é um bom sinal
-        top_region = row_sums[:int(h*0.05)]
-        has_structure = np.max(top_region) > (w * 255 * 0.02)
+        top_region = row_sums[:max(1, int(h*0.05))]
+        top_value = np.max(top_region) if top_region.size else 0
+        has_structure = bool(top_value > (w * 255 * 0.02))
         
-        return has_structure, np.max(top_region)
+        return has_structure, top_value
     
     def validate_roi_by_density(self, img, roi):
         """
@@ -35,11 +38,8 @@ class ROIValidator:
         verticais ao longo da altura da ROI.
         """
         x, y, w, h = roi
-        roi_img = img[y:y+h, x:x+w]
         
-        v_kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (1, 25))
-        v_mask = cv2.morphologyEx(roi_img, cv2.MORPH_OPEN, v_kernel)
-        row_sums = np.sum(v_mask, axis=1)
+        row_sums = self._opened_row_sums(img, roi, DENSITY_STROKE_LEN)
         
         # Dividir em 5 intervalos (conforme manual: 5 tempos)
         interval_height = h // 5
@@ -48,15 +48,24 @@ class ROIValidator:
         for i in range(5):
             start = i * interval_height
             end = (i + 1) * interval_height if i < 4 else h
-            interval_density = np.mean(row_sums[start:end])
+            interval_density = np.mean(row_sums[start:end]) if end > start else 0.0
             interval_densities.append(interval_density)
         
         # Verificar se há traços em todos os intervalos (não deve estar vazio)
-        has_content_in_all = all(d > (w * 255 * 0.01) for d in interval_densities)
+        has_content_in_all = bool(all(d > (w * 255 * 0.01) for d in interval_densities))
         avg_density = np.mean(interval_densities)
         
         return has_content_in_all, interval_densities, avg_density
     
+    @staticmethod
+    def _opened_row_sums(img, roi, stroke_len):
+        """Soma por linha da abertura 1x`stroke_len` do recorte da ROI."""
+        x, y, w, h = roi
+        roi_img = img[y:y+h, x:x+w]
+        if roi_img.size:
+            roi_img = cv2.morphologyEx(roi_img, cv2.MORPH_OPEN, cv_resources.structuring_element((1, stroke_len)))
+        return np.sum(roi_img, axis=1)
+    
     def validate_roi_by_margins(self, img, roi):
         """
         Valida a ROI verificando se as margens laterais estão livres de traços
@@ -65,7 +74,7 @@ class ROIValidator:
         x, y, w, h = roi
         
         # Verificar margens laterais (primeiros e últimos 5% da largura)
-        margin_width = int(w * 0.05)
+        margin_width = max(1, int(w * 0.05))
         
         left_margin = img[y:y+h, x:x+margin_width]
         right_margin = img[y:y+h, x+w-margin_width:x+w]
@@ -74,7 +83,7 @@ class ROIValidator:
         right_density = np.sum(right_margin) / (h * margin_width * 255)
         
         # Margens devem ter baixa densidade (< 5%)
-        margins_clean = left_density < 0.05 and right_density < 0.05
+        margins_clean = bool(left_density < 0.05 and right_density < 0.05)
         
         return margins_clean, left_density, right_density
     
@@ -111,7 +120,7 @@ class ROIValidator:
             "avg_density": float(avg_density),
             "left_margin_density": float(left_margin),
             "right_margin_density": float(right_margin),
-            "validation_log": self.validation_log
+            "validation_log": list(self.validation_log)
         }
         
         return validation_result
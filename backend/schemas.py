@@ -1,5 +1,5 @@
 from datetime import datetime
-from typing import List, Optional, Any, Dict
+from typing import List, Optional, Any, Dict, Literal, Union
 from pydantic import BaseModel, EmailStr, ConfigDict
 from models import UserRole, CaseStatus
 
@@ -42,12 +42,14 @@ class CaseResponse(CaseBase):
     status: CaseStatus
     created_by: int
     created_at: datetime
+    batch_id: Optional[int] = None
     model_config = ConfigDict(from_attributes=True)
 
 class CaseFileResponse(BaseModel):
     id: int
     case_id: int
     original_file_url: str
+    content_hash: Optional[str] = None
     created_at: datetime
     model_config = ConfigDict(from_attributes=True)
 
@@ -65,6 +67,24 @@ class MetricResponse(BaseModel):
     confidence_level: str
     model_config = ConfigDict(from_attributes=True)
 
+# Correções manuais em lote
+class DetectionEditOp(BaseModel):
+    op: Literal["add", "remove", "move"]
+    type: Literal["palo", "mark"]
+    id: Optional[Union[str, int]] = None # remove/move
+    item: Optional[Dict[str, Any]] = None # add
+    center: Optional[List[float]] = None # move
+    bbox: Optional[List[int]] = None # move (opcional)
+
+class DetectionBatchRequest(BaseModel):
+    operations: List[DetectionEditOp]
+
+class DetectionBatchResponse(BaseModel):
+    status: str
+    applied: int
+    skipped: List[int] # índices das operações sem efeito (ID inexistente / duplicado)
+    metrics: Optional[Dict[str, Any]]
+
 # Report Schemas
 class ReportResponse(BaseModel):
     draft_text: str
@@ -156,6 +176,33 @@ class JobResponse(BaseModel):
     updated_at: datetime
     model_config = ConfigDict(from_attributes=True)
 
+# Caso + dados atuais numa única resposta (repository.get_case_bundle)
+class CaseBundleResponse(BaseModel):
+    case: CaseResponse
+    file: Optional[CaseFileResponse] = None
+    detection: Optional[DetectionResponse] = None
+    metric: Optional[MetricResponse] = None
+    job: Optional[JobResponse] = None
+
+# Importação em lote (batch_import)
+class ImportProgress(BaseModel):
+    queued: int
+    processing: int
+    done: int
+    failed: int
+    total: int
+    percent: int
+
+class ImportBatchResponse(BaseModel):
+    id: int
+    source_name: Optional[str] = None
+    source_type: str
+    total_items: int
+    skipped: List[Dict[str, str]] = []
+    created_at: datetime
+    progress: ImportProgress
+    case_ids: List[int] = []
+
 # Phase 2: Audit Trail
 class MetricsHistoryCreate(BaseModel):
     field_name: str
@@ -0,0 +1,122 @@
+"""
+Recebimento de arquivos enviados: streaming em blocos para um arquivo
+temporário, SHA-256 calculado durante a cópia, limite de tamanho e
+verificação da assinatura (magic bytes) antes de o arquivo chegar aos workers.
+O arquivo só aparece no destino final via os.replace (atômico).
+"""
+
+import hashlib
+import os
+import tempfile
+import uuid
+from pathlib import Path
+from typing import BinaryIO, Callable, Optional
+
+UPLOAD_MAX_MB = float(os.getenv("UPLOAD_MAX_MB", "25"))
+UPLOAD_CHUNK_BYTES = int(os.getenv("UPLOAD_CHUNK_BYTES", str(1024 * 1024)))
+
+# Formatos que o cv2.imread dos workers decodifica
+_SIGNATURES = (
+    (b"\xff\xd8\xff", ".jpg"),
+    (b"\x89PNG\r\n\x1a\n", ".png"),
+    (b"II*\x00", ".tif"),
+    (b"MM\x00*", ".tif"),
+    (b"BM", ".bmp"),
+)
+
+
+class UploadError(Exception):
+    status_code = 400
+
+
+class UploadTooLarge(UploadError):
+    status_code = 413
+
+
+class UnsupportedFileType(UploadError):
+    status_code = 415
+
+
+def sniff_image_type(header: bytes) -> Optional[str]:
+    """Extensão canônica a partir dos primeiros bytes, ou None se não for imagem suportada."""
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return ".webp"
+    for magic, ext in _SIGNATURES:
+        if header.startswith(magic):
+            return ext
+    return None
+
+
+_HEADER_BYTES = 16  # suficiente para todas as assinaturas acima
+
+
+def _require_image(header: bytes) -> str:
+    extension = sniff_image_type(header)
+    if extension is None:
+        raise UnsupportedFileType("Arquivo não é uma imagem suportada (JPEG, PNG, TIFF, BMP ou WebP)")
+    return extension
+
+
+def require_archive(header: bytes) -> str:
+    """Lotes (batch_import): ZIP de imagens ou PDF de várias páginas."""
+    if header.startswith(b"PK\x03\x04"):
+        return ".zip"
+    if header.startswith(b"%PDF-"):
+        return ".pdf"
+    raise UnsupportedFileType("Arquivo não é um ZIP ou PDF")
+
+
+class StoredUpload:
+    __slots__ = ("path", "sha256", "size", "extension")
+
+    def __init__(self, path: Path, sha256: str, size: int, extension: str):
+        self.path = path
+        self.sha256 = sha256
+        self.size = size
+        self.extension = extension
+
+
+def receive_upload(src: BinaryIO, dest_dir: Path, max_bytes: Optional[int] = None,
+                   chunk_size: int = UPLOAD_CHUNK_BYTES,
+                   require: Callable[[bytes], str] = _require_image) -> StoredUpload:
+    """
+    Copia `src` em blocos de `chunk_size` para `dest_dir`/<uuid><ext>.
+    A extensão vem do conteúdo (via `require`), não do nome enviado pelo cliente.
+    Levanta UploadTooLarge / UnsupportedFileType; nesses casos nada fica no disco.
+    """
+    max_bytes = int(UPLOAD_MAX_MB * 1024 * 1024) if max_bytes is None else max_bytes
+    dest_dir = Path(dest_dir)
+    dest_dir.mkdir(parents=True, exist_ok=True)
+
+    digest = hashlib.sha256()
+    size = 0
+    header = b""
+    extension = None
+    # Temporário no mesmo diretório: os.replace no final é atômico
+    fd, tmp_name = tempfile.mkstemp(dir=dest_dir, prefix=".upload-", suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while True:
+                chunk = src.read(chunk_size)
+                if not chunk:
+                    break
+                if extension is None and len(header) < _HEADER_BYTES:
+                    header += chunk[:_HEADER_BYTES - len(header)]
+                    if len(header) == _HEADER_BYTES:
+                        extension = require(header)
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadTooLarge(f"Arquivo excede o limite de {max_bytes / 2**20:.0f} MB")
+                digest.update(chunk)
+                out.write(chunk)
+        if extension is None:
+            if not header:
+                raise UnsupportedFileType("Arquivo vazio")
+            extension = require(header)
+
+        final_path = dest_dir / f"{uuid.uuid4()}{extension}"
+        os.replace(tmp_name, final_path)
+    except BaseException:
+        Path(tmp_name).unlink(missing_ok=True)
+        raise
+    return StoredUpload(final_path, digest.hexdigest(), size, extension)
@@ -0,0 +1,21 @@
+import numpy as np
+
+def jsonify_dict(obj):
+    """
+    Recursively converts NumPy types to standard Python types for JSON serialization.
+    """
+    if isinstance(obj, dict):
+        return {k: jsonify_dict(v) for k, v in obj.items()}
+    elif isinstance(obj, list):
+        return [jsonify_dict(v) for v in obj]
+    elif isinstance(obj, (np.int64, np.int32, np.int16, np.int8)):
+        return int(obj)
+    elif isinstance(obj, (np.float64, np.float32, np.float16)):
+        return float(obj)
+    elif isinstance(obj, np.ndarray):
+        return jsonify_dict(obj.tolist())
+    elif hasattr(obj, "to_dicts"):
+        # vision.PaloSet: vira a lista de dicts apenas aqui, na borda da API
+        return obj.to_dicts()
+    else:
+        return obj
@@ -1,237 +1,473 @@
+import threading
+import time
+from contextlib import contextmanager
 import cv2
 import numpy as np
-from typing import List, Dict, Any
+from typing import List, Dict, Any, NamedTuple, Optional
 from roi_validator import ROIValidator
+from analysis_context import AnalysisContext
+from progress import NULL_PROGRESS
+import cv_resources
+
+# Pontos do perfil de densidade guardado em last_run_meta["density_profile"]
+# (config "density_profile_max_points"; None = uma entrada por linha da imagem)
+DENSITY_PROFILE_MAX_POINTS = 512
+
+# Versão da saída do pipeline. Incrementar sempre que uma mudança altera
+# palos/ROI/métricas ou o run_meta gravado para a mesma imagem (invalida o
+# detection_cache).
+PIPELINE_VERSION = "5"
+
+@contextmanager
+def _stage(timings: Dict[str, float], name: str):
+    """Acumula o tempo (ms) de um estágio do pipeline em `timings`."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] = round(timings.get(name, 0.0) + (time.perf_counter() - start) * 1000, 2)
+
+class PaloSet:
+    """
+    Conjunto de palos em colunas NumPy (structure-of-arrays).
+
+    É o formato que detect_palos devolve e que cluster_lines, segment_intervals
+    e calculate_metrics percorrem; a lista de dicts ({"id", "center", "bbox",
+    ..., "hooks"}) só é montada na borda da API via to_dicts().
+    IDs inteiros são renderizados como "palo_N"; IDs vindos de dicts (edições
+    manuais) são mantidos como estão.
+    """
+    __slots__ = ("ids", "center", "bbox", "height", "width", "angle",
+                 "tortuosity", "pressure", "hook_top", "hook_bottom")
+
+    HOOKS = ("none", "left", "right")
+
+    def __init__(self, ids, center, bbox, height, width, angle, tortuosity, pressure, hook_top, hook_bottom):
+        self.ids = ids                # (n,) int ou object
+        self.center = center          # (n, 2) float64
+        self.bbox = bbox              # (n, 4) int32
+        self.height = height          # (n,) float64
+        self.width = width
+        self.angle = angle
+        self.tortuosity = tortuosity
+        self.pressure = pressure
+        self.hook_top = hook_top      # (n,) int8, índice em HOOKS
+        self.hook_bottom = hook_bottom
+
+    @classmethod
+    def empty(cls, n=0):
+        f = lambda: np.zeros(n, dtype=np.float64)
+        return cls(np.arange(1, n + 1), np.zeros((n, 2)), np.zeros((n, 4), dtype=np.int32),
+                   f(), f(), f(), f(), f(), np.zeros(n, dtype=np.int8), np.zeros(n, dtype=np.int8))
+
+    @classmethod
+    def from_dicts(cls, palos):
+        """Converte a lista de dicts persistida (campos ausentes recebem defaults)."""
+        n = len(palos)
+        s = cls.empty(n)
+        s.ids = np.empty(n, dtype=object)
+        hook_code = {name: code for code, name in enumerate(cls.HOOKS)}
+        for i, p in enumerate(palos):
+            s.ids[i] = p.get("id", f"palo_{i+1}")
+            s.center[i] = p["center"]
+            bbox = p.get("bbox")
+            if bbox is not None:
+                s.bbox[i] = bbox
+            s.height[i] = p.get("height", 30)
+            s.width[i] = p.get("width", 0)
+            s.angle[i] = p.get("angle", 0)
+            s.tortuosity[i] = p.get("tortuosity", 1.0)
+            s.pressure[i] = p.get("pressure", 0)
+            hooks = p.get("hooks") or {}
+            s.hook_top[i] = hook_code.get(hooks.get("top"), 0)
+            s.hook_bottom[i] = hook_code.get(hooks.get("bottom"), 0)
+        return s
+
+    @classmethod
+    def coerce(cls, palos):
+        return palos if isinstance(palos, cls) else cls.from_dicts(palos or [])
+
+    @classmethod
+    def concat(cls, sets):
+        sets = [cls.coerce(s) for s in sets]
+        if not sets:
+            return cls.empty()
+        ids = [s.ids for s in sets]
+        if len({i.dtype.kind for i in ids}) > 1:
+            ids = [s.ids.astype(object) if s.ids.dtype == object else np.array(s.id_labels(), dtype=object) for s in sets]
+        return cls(np.concatenate(ids), *(np.concatenate([getattr(s, k) for s in sets]) for k in cls.__slots__[1:]))
+
+    def take(self, idx):
+        """Subconjunto por índices, máscara booleana ou slice (arrays copiados/fatiados, sem dicts)."""
+        return PaloSet(*(getattr(self, k)[idx] for k in self.__slots__))
+
+    def __len__(self):
+        return len(self.height)
+
+    def __iter__(self):
+        # Conveniência para scripts de diagnóstico; o pipeline não itera por palo
+        return iter(self.to_dicts())
+
+    def id_labels(self):
+        if self.ids.dtype.kind in "iu":
+            return [f"palo_{i}" for i in self.ids.tolist()]
+        return list(self.ids)
+
+    def to_dicts(self):
+        """Formato JSON histórico dos palos (usado na borda da API / persistência)."""
+        hooks = self.HOOKS
+        return [
+            {
+                "id": pid,
+                "center": center,
+                "bbox": bbox,
+                "height": h,
+                "width": w,
+                "angle": angle,
+                "tortuosity": tort,
+                "pressure": pressure,
+                "hooks": {"top": hooks[top], "bottom": hooks[bottom]}
+            }
+            for pid, center, bbox, h, w, angle, tort, pressure, top, bottom in zip(
+                self.id_labels(), self.center.tolist(), self.bbox.tolist(), self.height.tolist(),
+                self.width.tolist(), self.angle.tolist(), self.tortuosity.tolist(), self.pressure.tolist(),
+                self.hook_top.tolist(), self.hook_bottom.tolist())
+        ]
+
+class DetectionRun:
+    """
+    Estado de uma execução do pipeline: metadados (ROI, contagens de
+    descarte, tempos), marcas de intervalo e destino do progresso.
+
+    Os estágios do PaloDetector recebem o run explicitamente, então um mesmo
+    detector pode atender várias imagens ao mesmo tempo (threads). Sem `run`,
+    os estágios usam o run legado do próprio detector, exposto como
+    `last_run_meta` / `last_marks` / `progress` (uso sequencial apenas).
+    """
+
+    def __init__(self, progress=None, meta: Optional[Dict[str, Any]] = None, marks: Optional[List[Dict]] = None):
+        self.progress = progress if progress is not None else NULL_PROGRESS
+        self.meta = {} if meta is None else meta
+        self.marks = [] if marks is None else marks
+
+
+class DetectionResult(NamedTuple):
+    """Saída de PaloDetector.detect (analyze devolve o mesmo conteúdo como dict)."""
+    image: np.ndarray
+    roi: List[int]
+    palos: PaloSet
+    marks: List[Dict[str, Any]]
+    intervals: List[PaloSet]
+    metrics: Dict[str, Any]
+    run_meta: Dict[str, Any]
+    image_dims: List[int]
+
 
 class PaloDetector:
+    """
+    Detector de palos. A instância guarda só a configuração e objetos
+    somente-leitura; o estado de cada imagem vive num DetectionRun. `detect`
+    é seguro para uso concorrente com um único detector por processo.
+    """
+
     def __init__(self, config: Dict[str, Any] = None):
         self.config = config or {
             "min_height": 10,
             "max_width_ratio": 0.3, # Width / Height
             "min_area": 20,
             "angle_threshold": 20, # Max degrees from vertical
-            "top_cutoff_fixed_pct": 0.15 # 15% fixed top cutoff
+            "top_cutoff_fixed_pct": 0.15, # 15% fixed top cutoff
+            "paper_detect_max_side": None, # Localização do papel em resolução reduzida, opcional (ex.: 1200; None = resolução total)
+            "separator_detector": "hough", # Linha separadora do formulário: "hough" ou "projection"
+            "validate_roi": False # Diagnóstico ROIValidator em run_meta["roi_validation"] (custo extra por imagem)
         }
-        self.last_run_meta = {}
         self.roi_validator = ROIValidator()
+        self._legacy_run = DetectionRun()
+
+    # Estado do run legado (chamadas de estágio sem `run`). Não usar com o
+    # detector compartilhado entre threads: passe um DetectionRun próprio.
+    @property
+    def last_run_meta(self) -> Dict[str, Any]:
+        return self._legacy_run.meta
+
+    @last_run_meta.setter
+    def last_run_meta(self, meta: Dict[str, Any]):
+        self._legacy_run.meta = meta
 
-    def find_paper_and_warp(self, img):
+    @property
+    def last_marks(self) -> List[Dict[str, Any]]:
+        return self._legacy_run.marks
+
+    @last_marks.setter
+    def last_marks(self, marks: List[Dict[str, Any]]):
+        self._legacy_run.marks = marks
+
+    @property
+    def progress(self):
+        """Recebe o progresso das subetapas do run legado (progress.ProgressReporter)."""
+        return self._legacy_run.progress
+
+    @progress.setter
+    def progress(self, progress):
+        self._legacy_run.progress = progress
+
+    def _run_or_legacy(self, run: Optional[DetectionRun]) -> DetectionRun:
+        return run if run is not None else self._legacy_run
+
+    @staticmethod
+    def _order_corners(pts):
+        rect = np.zeros((4, 2), dtype="float32")
+
+        # top-left has smallest sum, bottom-right has largest sum
+        s = pts.sum(axis=1)
+        rect[0] = pts[np.argmin(s)]
+        rect[2] = pts[np.argmax(s)]
+
+        # top-right smallest diff, bottom-left largest diff
+        diff = np.diff(pts, axis=1)
+        rect[1] = pts[np.argmin(diff)]
+        rect[3] = pts[np.argmax(diff)]
+        return rect
+
+    @staticmethod
+    def _warp_quad(img, rect):
+        (tl, tr, br, bl) = rect
+        widthA = np.sqrt(((br[0] - bl[0]) ** 2) + ((br[1] - bl[1]) ** 2))
+        widthB = np.sqrt(((tr[0] - tl[0]) ** 2) + ((tr[1] - tl[1]) ** 2))
+        maxWidth = max(int(widthA), int(widthB))
+
+        heightA = np.sqrt(((tr[0] - br[0]) ** 2) + ((tr[1] - br[1]) ** 2))
+        heightB = np.sqrt(((tl[0] - bl[0]) ** 2) + ((tl[1] - bl[1]) ** 2))
+        maxHeight = max(int(heightA), int(heightB))
+
+        dst = np.array([
+            [0, 0],
+            [maxWidth - 1, 0],
+            [maxWidth - 1, maxHeight - 1],
+            [0, maxHeight - 1]], dtype="float32")
+
+        M = cv2.getPerspectiveTransform(rect, dst)
+        return cv2.warpPerspective(img, M, (maxWidth, maxHeight))
+
+    def find_paper_and_warp(self, img, gray=None, timings=None):
+        """
+        Localiza a folha e corrige a perspectiva.
+        `gray` pode ser passado já calculado pelo preprocess para evitar uma
+        segunda conversão BGR->GRAY da imagem em resolução total.
+        """
+        timings = {} if timings is None else timings
+        rect = self.locate_paper(img, gray=gray, timings=timings)
+        if rect is None:
+            return img # Fallback
+
+        with _stage(timings, "warp"):
+            return self._warp_quad(img, rect)
+
+    def locate_paper(self, img, gray=None, timings=None):
+        """
+        Retorna os 4 cantos ordenados (tl, tr, br, bl) da folha, ou None.
+
+        Com config["paper_detect_max_side"], a busca do quadrilátero roda no
+        primeiro nível da pirâmide gaussiana que cabe nesse tamanho e os cantos
+        são refinados localmente (cornerSubPix) nível a nível até a resolução
+        total; o warp continua sendo um só, sobre a imagem original.
+        """
+        timings = {} if timings is None else timings
         height, width = img.shape[:2]
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        
-        # Enhanced contrast for tricky backgrounds (more aggressive CLAHE)
-        clahe = cv2.createCLAHE(clipLimit=3.0, tileGridSize=(10,10))
-        gray = clahe.apply(gray)
-        
-        # Apply a median blur to reduce noise while preserving edges
-        blurred = cv2.medianBlur(gray, 5)
-        
-        # Canny edge detection with adaptive thresholds
-        sigma = 0.33
-        v = np.median(blurred)
-        lower = int(max(0, (1.0 - sigma) * v))
-        upper = int(min(255, (1.0 + sigma) * v))
-        edged = cv2.Canny(blurred, lower, upper)
-        
-        contours, _ = cv2.findContours(edged, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-        contours = sorted(contours, key=cv2.contourArea, reverse=True)
-        
-        for c in contours:
-            area = cv2.contourArea(c)
-            if area < (width * height * 0.10): continue # Reduzir limite mínimo para capturar mais contornos
-                
-            peri = cv2.arcLength(c, True)
-            approx = cv2.approxPolyDP(c, 0.02 * peri, True)
-            
-            if len(approx) == 4:
-                pts = approx.reshape(4, 2)
-                rect = np.zeros((4, 2), dtype="float32")
-                
-                s = pts.sum(axis=1)
-                rect[0] = pts[np.argmin(s)]
-                rect[2] = pts[np.argmax(s)]
-                
-                diff = np.diff(pts, axis=1)
-                rect[1] = pts[np.argmin(diff)]
-                rect[3] = pts[np.argmax(diff)]
-                
-                (tl, tr, br, bl) = rect
-                widthA = np.sqrt(((br[0] - bl[0]) ** 2) + ((br[1] - bl[1]) ** 2))
-                widthB = np.sqrt(((tr[0] - tl[0]) ** 2) + ((tr[1] - tl[1]) ** 2))
-                maxWidth = max(int(widthA), int(widthB))
-                
-                heightA = np.sqrt(((tr[0] - br[0]) ** 2) + ((tr[1] - br[1]) ** 2))
-                heightB = np.sqrt(((tl[0] - bl[0]) ** 2) + ((tl[1] - bl[1]) ** 2))
-                maxHeight = max(int(heightA), int(heightB))
-                
-                dst = np.array([
-                    [0, 0],
-                    [maxWidth - 1, 0],
-                    [maxWidth - 1, maxHeight - 1],
-                    [0, maxHeight - 1]], dtype="float32")
-                
-                M = cv2.getPerspectiveTransform(rect, dst)
-                warped = cv2.warpPerspective(img, M, (maxWidth, maxHeight))
-                return warped
-        
-        # Fallback to simple thresholding
-        _, isolator = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
-        kernel = np.ones((5,5), np.uint8)
-        isolator = cv2.dilate(isolator, kernel, iterations=2)
-        contours, _ = cv2.findContours(isolator, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-        contours = sorted(contours, key=cv2.contourArea, reverse=True)
-        
-        for c in contours:
-            area = cv2.contourArea(c)
-            # Area must be at least 20% of the image to be the paper
-            if area < (width * height * 0.15): continue # Reduzir limite mínimo para capturar mais contornos
-                
+        if gray is None:
+            gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+
+        pyramid = [gray]
+        max_side = self.config.get("paper_detect_max_side")
+        if max_side:
+            with _stage(timings, "paper_downscale"):
+                # Pirâmide gaussiana: cada nível reduz pela metade (pixel i -> 2i)
+                while max(pyramid[-1].shape[:2]) > max_side:
+                    pyramid.append(cv2.pyrDown(pyramid[-1]))
+        work = pyramid[-1]
+        work_h, work_w = work.shape[:2]
+
+        with _stage(timings, "paper_equalize"):
+            # Enhanced contrast for tricky backgrounds (more aggressive CLAHE)
+            clahe = cv_resources.clahe(3.0, (10, 10))
+            equalized = clahe.apply(work)
+
+        with _stage(timings, "paper_edges"):
+            # Apply a median blur to reduce noise while preserving edges
+            blurred = cv2.medianBlur(equalized, 5)
+
+            # Canny edge detection with adaptive thresholds
+            sigma = 0.33
+            v = np.median(blurred)
+            lower = int(max(0, (1.0 - sigma) * v))
+            upper = int(min(255, (1.0 + sigma) * v))
+            edged = cv2.Canny(blurred, lower, upper)
+            del blurred
+
+        with _stage(timings, "paper_contours"):
+            quad = self._find_quad(edged, work_w * work_h * 0.10, lambda n: n == 4)
+            del edged
+
+        if quad is None:
+            # Fallback to simple thresholding. Otsu + dilatação dependem da
+            # escala, então este caminho (raro) roda sempre em resolução total.
+            with _stage(timings, "paper_fallback"):
+                if len(pyramid) > 1:
+                    equalized = clahe.apply(gray)
+                _, isolator = cv2.threshold(equalized, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+                kernel = cv_resources.structuring_element((5, 5))
+                isolator = cv2.dilate(isolator, kernel, iterations=2)
+                # Area must be at least 15% of the image to be the paper.
+                # Permitir mais vértices para formas ligeiramente irregulares
+                quad = self._find_quad(isolator, width * height * 0.15, lambda n: 4 <= n <= 8)
+            return None if quad is None else self._order_corners(quad)
+
+        rect = self._order_corners(quad)
+        if len(pyramid) > 1:
+            with _stage(timings, "paper_refine"):
+                # Coarse-to-fine: o erro em cada nível é de poucos pixels
+                for level in reversed(pyramid[:-1]):
+                    rect = self._refine_corners(level, rect * 2.0)
+        return rect
+
+    @staticmethod
+    def _refine_corners(gray, rect, half=6):
+        """
+        Refina cantos vindos do nível anterior da pirâmide com cornerSubPix.
+        Cantos que escapam da janela mantêm a estimativa inicial.
+        """
+        corners = rect.reshape(-1, 1, 2).astype(np.float32)
+        criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 40, 0.01)
+        cv2.cornerSubPix(gray, corners, (half, half), (-1, -1), criteria)
+        refined = corners.reshape(4, 2)
+        drift = np.linalg.norm(refined - rect, axis=1)
+        refined[drift > half] = rect[drift > half]
+        return refined
+
+    @staticmethod
+    def _find_quad(binary, min_area, accept_vertices):
+        contours, _ = cv2.findContours(binary, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        areas = [cv2.contourArea(c) for c in contours]
+        for idx in sorted(range(len(contours)), key=areas.__getitem__, reverse=True):
+            # Ordenado por área decrescente: nenhum contorno seguinte atinge o mínimo
+            if areas[idx] < min_area: break
+
+            c = contours[idx]
             peri = cv2.arcLength(c, True)
             approx = cv2.approxPolyDP(c, 0.02 * peri, True)
-            
-            # If we found a quadrilateral-ish shape
-            if 4 <= len(approx) <= 8: # Permitir mais vértices para formas ligeiramente irregulares
-                # Get the bounding box points and sort them
-                pts = approx.reshape(-1, 2)
-                rect = np.zeros((4, 2), dtype="float32")
-                
-                # top-left has smallest sum, bottom-right has largest sum
-                s = pts.sum(axis=1)
-                rect[0] = pts[np.argmin(s)]
-                rect[2] = pts[np.argmax(s)]
-                
-                # top-right smallest diff, bottom-left largest diff
-                diff = np.diff(pts, axis=1)
-                rect[1] = pts[np.argmin(diff)]
-                rect[3] = pts[np.argmax(diff)]
-                
-                (tl, tr, br, bl) = rect
-                widthA = np.sqrt(((br[0] - bl[0]) ** 2) + ((br[1] - bl[1]) ** 2))
-                widthB = np.sqrt(((tr[0] - tl[0]) ** 2) + ((tr[1] - tl[1]) ** 2))
-                maxWidth = max(int(widthA), int(widthB))
-                
-                heightA = np.sqrt(((tr[0] - br[0]) ** 2) + ((tr[1] - br[1]) ** 2))
-                heightB = np.sqrt(((tl[0] - bl[0]) ** 2) + ((tl[1] - bl[1]) ** 2))
-                maxHeight = max(int(heightA), int(heightB))
-                
-                dst = np.array([
-                    [0, 0],
-                    [maxWidth - 1, 0],
-                    [maxWidth - 1, maxHeight - 1],
-                    [0, maxHeight - 1]], dtype="float32")
-                
-                M = cv2.getPerspectiveTransform(rect, dst)
-                warped = cv2.warpPerspective(img, M, (maxWidth, maxHeight))
-                return warped
-                
-        return img # Fallback
-
-    def preprocess(self, image_path: str):
-        # Load image
-        img = cv2.imread(image_path)
+            if accept_vertices(len(approx)):
+                return approx.reshape(-1, 2)
+        return None
+
+    def preprocess(self, image_path: str, run: Optional[DetectionRun] = None):
+        run = self._run_or_legacy(run)
+        timings = {}
+        # Load image (single decode for the whole pipeline)
+        with _stage(timings, "decode"):
+            img = cv2.imread(image_path)
         if img is None:
             raise ValueError("Não foi possível carregar a imagem.")
-            
-        # 1. Perspective Correction & Background Removal
-        # Convert to HLS to isolate the "white" paper better against RGB backgrounds
-        hls = cv2.cvtColor(img, cv2.COLOR_BGR2HLS)
-        l_channel = hls[:, :, 1]
-        
-        # Adaptive thresholding on Luminance to find the paper (more robust parameters)
-        paper_mask = cv2.adaptiveThreshold(l_channel, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 31, 15) # Aumentar block size e C para maior adaptabilidade
-        
+        run.progress.update("preprocess", 0.15)
+        return self.preprocess_image(img, timings=timings, run=run)
+
+    def preprocess_image(self, img, timings=None, run: Optional[DetectionRun] = None):
+        """
+        Pipeline em estágios sobre uma imagem BGR já decodificada.
+        Cada intermediário (gray, gray equalizado, mapa de bordas) é calculado
+        uma única vez; o tempo de cada estágio fica em
+        run.meta["preprocess_timings_ms"] (last_run_meta sem `run`).
+        """
+        run = self._run_or_legacy(run)
+        timings = {} if timings is None else timings
+
+        # 1. Gray em resolução total, compartilhado com a localização do papel
+        with _stage(timings, "gray"):
+            gray_full = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+
+        run.progress.update("preprocess", 0.2)
+
         # 2. Warp Paper
-        warped = self.find_paper_and_warp(img)
-        if warped is None: warped = img
-        
+        warped = self.find_paper_and_warp(img, gray=gray_full, timings=timings)
+        run.progress.update("preprocess", 0.5)
+
         # 3. Focus on dark strokes (the palos)
-        gray = cv2.cvtColor(warped, cv2.COLOR_BGR2GRAY)
-        
-        # Balance lighting with CLAHE
-        clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8,8))
-        gray_balanced = clahe.apply(gray)
-        
-        # Use a very sharp adaptive threshold for thin lines (ajustado para melhor isolamento)
-        thresh = cv2.adaptiveThreshold(
-            gray_balanced, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, 
-            cv2.THRESH_BINARY_INV, 21, 8 # Aumentar block size e C para capturar traços mais finos e lidar com variações
-        )
-        
-        # Filter out small salt-and-pepper noise com morphological operations mais sofisticadas
-        kernel = np.ones((2,2), np.uint8)
-        opening = cv2.morphologyEx(thresh, cv2.MORPH_OPEN, kernel, iterations=1)
-        
-        # Aplicar closing para preencher pequenos buracos nos traços
-        kernel_close = np.ones((3,3), np.uint8)
-        opening = cv2.morphologyEx(opening, cv2.MORPH_CLOSE, kernel_close, iterations=1)
-        
-        # Bridge vertical fragments (mais agressivo para lidar com ruído)
-        v_kernel = np.array([[0, 1, 0], [0, 1, 0], [0, 1, 0]], dtype=np.uint8)
-        opening = cv2.dilate(opening, v_kernel, iterations=2)
-        
+        with _stage(timings, "warped_gray"):
+            # Sem warp (fallback) a imagem é a mesma: reaproveita o gray
+            gray = gray_full if warped is img else cv2.cvtColor(warped, cv2.COLOR_BGR2GRAY)
+            del gray_full
+
+        with _stage(timings, "clahe"):
+            # Balance lighting with CLAHE
+            clahe = cv_resources.clahe(2.0, (8, 8))
+            gray_balanced = clahe.apply(gray)
+        run.progress.update("preprocess", 0.65)
+
+        with _stage(timings, "threshold"):
+            # Use a very sharp adaptive threshold for thin lines (ajustado para melhor isolamento)
+            thresh = cv2.adaptiveThreshold(
+                gray_balanced, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+                cv2.THRESH_BINARY_INV, 21, 8 # Aumentar block size e C para capturar traços mais finos e lidar com variações
+            )
+            del gray_balanced
+        run.progress.update("preprocess", 0.8)
+
+        with _stage(timings, "morphology"):
+            # Filter out small salt-and-pepper noise com morphological operations mais sofisticadas
+            kernel = cv_resources.structuring_element((2, 2))
+            opening = cv2.morphologyEx(thresh, cv2.MORPH_OPEN, kernel, iterations=1)
+
+            # Aplicar closing para preencher pequenos buracos nos traços
+            kernel_close = cv_resources.structuring_element((3, 3))
+            cv2.morphologyEx(opening, cv2.MORPH_CLOSE, kernel_close, dst=opening, iterations=1)
+
+            # Bridge vertical fragments (mais agressivo para lidar com ruído)
+            # Coluna 1x3: mesmo efeito do 3x3 só com a coluna central
+            v_kernel = cv_resources.structuring_element((1, 3))
+            opening = cv2.dilate(opening, v_kernel, iterations=2)
+
+        run.meta["preprocess_timings_ms"] = dict(timings)
+        run.progress.update("preprocess", 1.0)
         return warped, gray, opening
 
-    def detect_test_area(self, img):
+    def detect_test_area(self, img, ctx=None, run: Optional[DetectionRun] = None):
         """
         Detecta a área útil (ROI) baseada na estrutura do formulário oficial.
         Implementa TOP_CUTOFF rigoroso e detecção de marcos estruturais.
+        `ctx` (AnalysisContext da mesma imagem) reaproveita a máscara vertical
+        e a faixa do cabeçalho já calculadas. Os metadados da ROI vão para
+        `run.meta`.
         """
+        run = self._run_or_legacy(run)
+        ctx = ctx if ctx is not None else AnalysisContext(img)
         height, width = img.shape
         separator_found = False
         
         # 1. Localização de Marcos Estruturais (Linhas Horizontais do Formulário)
         # O formulário oficial possui linhas que delimitam o cabeçalho e zona de treino.
         # Em scans reais, a linha separadora pode estar entre 20% e 50% da altura total.
-        scan_start_y = int(height * 0.10)
-        search_region_end = int(height * 0.60) 
-        search_roi = img[scan_start_y:search_region_end, :]
-        
-        # Pré-processamento agressivo para encontrar linhas retas
-        clahe = cv2.createCLAHE(clipLimit=4.0, tileGridSize=(8,8))
-        enhanced_roi = clahe.apply(search_roi)
-        thresh = cv2.adaptiveThreshold(enhanced_roi, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, 
-                                       cv2.THRESH_BINARY_INV, 21, 15)
-        
-        # Busca por linhas horizontais longas (mínimo 40% da largura do papel para ser mais inclusivo)
-        # Reduzimos o threshold para 100 para capturar linhas mais finas em scans reais
-        lines = cv2.HoughLinesP(thresh, 1, np.pi/180, threshold=100, 
-                                minLineLength=width*0.4, maxLineGap=150)
+        # Pré-processamento agressivo para encontrar linhas retas (CLAHE + threshold, no contexto)
+        scan_start_y, thresh = ctx.header_region
         
+        # Linha horizontal longa mais baixa da faixa (config "separator_detector")
+        separator_detector = self.config.get("separator_detector", "hough")
+        if separator_detector == "projection":
+            line_y = self.find_separator_projection(thresh)
+        else:
+            line_y = self.find_separator_hough(thresh)
+        run.progress.update("roi", 0.5)
+
         best_line_y = -1
-        if lines is not None:
-            horizontal_lines_y = []
-            for line in lines:
-                x1, y1, x2, y2 = line[0]
-                # Filtro para linhas horizontais (inclinação < 3 graus para lidar com scans levemente tortos)
-                angle = np.abs(np.arctan2(y2 - y1, x2 - x1) * 180 / np.pi)
-                if angle < 3.0:
-                    horizontal_lines_y.append((y1 + y2) // 2)
-            
-            if horizontal_lines_y:
-                # Em scans reais, podem aparecer múltiplas linhas no cabeçalho (bordas de campos).
-                # A linha separadora oficial é tipicamente a linha horizontal mais longa
-                # que está situada abaixo do cabeçalho de identificação.
-                horizontal_lines_y.sort(reverse=True)
-                
-                # Filtramos para pegar a linha que está mais próxima do meio da região de busca,
-                # que geralmente é a divisória oficial.
-                best_line_y = horizontal_lines_y[0] + scan_start_y
-                separator_found = True
+        if line_y >= 0:
+            best_line_y = line_y + scan_start_y
+            separator_found = True
 
         # 2. TOP_CUTOFF_ADAPTATIVO: Densidade de traços verticais
         # Útil caso a linha separadora esteja falha ou apagada.
-        v_kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (1, 25))
-        v_mask = cv2.morphologyEx(img, cv2.MORPH_OPEN, v_kernel)
-        row_sums = np.sum(v_mask, axis=1)
+        row_sums = ctx.row_profile
         
-        adaptive_y = -1
         # Busca por onde os traços verticais começam a aparecer de forma consistente
         threshold_density = width * 255 * 0.04 
-        for y in range(int(height * 0.15), int(height * 0.50)):
-            if row_sums[y] > threshold_density:
-                if np.mean(row_sums[y:y+40]) > threshold_density:
-                    adaptive_y = y
-                    break
+        adaptive_y = self.adaptive_cutoff(row_sums, int(height * 0.15), int(height * 0.50), threshold_density)
         
         # 3. TOP_CUTOFF_FIXO (Segurança absoluta de 20% baseada no modelo oficial)
         fixed_y = int(height * 0.20)
@@ -263,190 +499,380 @@ class PaloDetector:
         # Penalidade se a área útil for muito pequena
         if roi[3] < height * 0.3: roi_confidence -= 0.3
 
-        self.last_run_meta.update({
+        run.meta.update({
             "roi_source": "form_structure" if separator_found else "adaptive_density",
             "roi_confidence": round(max(0.0, min(1.0, roi_confidence)), 2),
             "separator_found": separator_found,
             "top_cutoff_applied": split_y,
-            "roi_rect": roi
+            "roi_rect": roi,
+            "separator_detector": separator_detector,
+            "adaptive_cutoff_y": adaptive_y,
+            "density_profile": self.density_profile(
+                row_sums, width, self.config.get("density_profile_max_points", DENSITY_PROFILE_MAX_POINTS)),
         })
+        run.progress.update("roi", 1.0)
         
         return roi
 
-        return [0, split_y, width, roi_height], separator_found
+    @staticmethod
+    def find_separator_hough(thresh):
+        """
+        y (na faixa `thresh`) da linha horizontal longa mais baixa, via
+        HoughLinesP; -1 se nenhuma.
+        """
+        width = thresh.shape[1]
+        # Busca por linhas horizontais longas (mínimo 40% da largura do papel para ser mais inclusivo)
+        # Reduzimos o threshold para 100 para capturar linhas mais finas em scans reais
+        lines = cv2.HoughLinesP(thresh, 1, np.pi/180, threshold=100, 
+                                minLineLength=width*0.4, maxLineGap=150)
+        if lines is None:
+            return -1
+        horizontal_lines_y = []
+        for line in lines:
+            x1, y1, x2, y2 = line[0]
+            # Filtro para linhas horizontais (inclinação < 3 graus para lidar com scans levemente tortos)
+            angle = np.abs(np.arctan2(y2 - y1, x2 - x1) * 180 / np.pi)
+            if angle < 3.0:
+                horizontal_lines_y.append((y1 + y2) // 2)
+        # Em scans reais, podem aparecer múltiplas linhas no cabeçalho (bordas de campos).
+        # A linha separadora oficial é tipicamente a mais baixa da região de busca.
+        return max(horizontal_lines_y) if horizontal_lines_y else -1
+
+    # Inclinações testadas pelo detector por projeção (graus; mesma tolerância do Hough)
+    SEPARATOR_ANGLES = np.arange(-3.0, 3.01, 0.5)
+    SEPARATOR_STRIPS = 32
+
+    @classmethod
+    def find_separator_projection(cls, thresh, min_coverage=0.4):
+        """
+        Mesma regra do find_separator_hough (linha mais baixa cobrindo >= 40% da
+        largura, inclinação até 3 graus) sem Hough, em tempo linear:
+        1. abertura horizontal mantém só trechos horizontais longos;
+        2. somas por linha em SEPARATOR_STRIPS faixas verticais;
+        3. para cada inclinação, as faixas são deslocadas (Radon discreto) e
+           somadas; a cobertura de cada y é a melhor entre as inclinações.
+        Cada sequência de linhas acima do limiar é uma linha; vale o pico da
+        mais baixa. Devolve -1 se nenhuma.
+        """
+        height, width = thresh.shape
+        if height == 0 or width == 0:
+            return -1
+        kernel = cv_resources.structuring_element((max(15, width // 50), 1))
+        horizontal = cv2.morphologyEx(thresh, cv2.MORPH_OPEN, kernel)
+
+        strips = min(cls.SEPARATOR_STRIPS, width)
+        edges = np.linspace(0, width, strips + 1).astype(np.intp)
+        # (faixas, altura): pixels ligados de cada linha dentro de cada faixa
+        per_strip = np.add.reduceat(horizontal, edges[:-1], axis=1, dtype=np.int64).T // 255
+        offsets = (edges[:-1] + edges[1:]) / 2 - width / 2
+
+        coverage = np.zeros(height, dtype=np.int64)
+        pad = int(np.ceil(width / 2 * np.tan(np.radians(np.abs(cls.SEPARATOR_ANGLES).max())))) + 1
+        padded = np.zeros((strips, height + 2 * pad), dtype=np.int64)
+        padded[:, pad:pad + height] = per_strip
+        rows = np.arange(height)
+        for angle in cls.SEPARATOR_ANGLES:
+            # y no centro da imagem; a faixa s está em y + offset_s * tan(ângulo)
+            shifts = np.rint(offsets * np.tan(np.radians(angle))).astype(np.intp)
+            profile = padded[np.arange(strips)[:, None], rows[None, :] + pad + shifts[:, None]].sum(axis=0)
+            np.maximum(coverage, profile, out=coverage)
+
+        hits = coverage >= min_coverage * width
+        if not hits.any():
+            return -1
+        # Última sequência de linhas acima do limiar (a linha mais baixa) e o seu pico
+        last = height - 1 - int(np.argmax(hits[::-1]))
+        first = last
+        while first > 0 and hits[first - 1]:
+            first -= 1
+        return first + int(np.argmax(coverage[first:last + 1]))
+
+    @staticmethod
+    def adaptive_cutoff(row_sums, start, end, threshold, window=40):
+        """
+        Primeira linha y em [start, end) com row_sums[y] > threshold e média de
+        row_sums[y:y+window] > threshold (janela truncada no fim da imagem);
+        -1 se nenhuma. As médias de todas as janelas saem de uma soma
+        acumulada, numa única passada vetorizada.
+        """
+        n = len(row_sums)
+        end = min(end, n)
+        if end <= start:
+            return -1
+        csum = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(row_sums, dtype=np.int64, out=csum[1:])
+        ys = np.arange(start, end)
+        stops = np.minimum(ys + window, n)
+        window_mean = (csum[stops] - csum[ys]) / (stops - ys)
+        hits = (row_sums[start:end] > threshold) & (window_mean > threshold)
+        return int(np.argmax(hits)) + start if hits.any() else -1
+
+    @staticmethod
+    def density_profile(row_sums, width, max_points=DENSITY_PROFILE_MAX_POINTS):
+        """
+        Diagnóstico do TOP_CUTOFF_ADAPTATIVO: fração de cada linha coberta por
+        traços verticais (0..1), em faixas de `row_step` linhas (média) para
+        caber em no máximo `max_points` valores.
+        """
+        density = np.asarray(row_sums, dtype=np.float64) / max(1, width * 255)
+        step = 1 if not max_points else max(1, -(-len(density) // max_points))
+        if step > 1:
+            bins = np.arange(0, len(density), step)
+            density = np.add.reduceat(density, bins) / np.diff(np.append(bins, len(density)))
+        return {"row_step": step, "values": np.round(density, 4).tolist()}
 
-    def detect_palos(self, processed_img, gray_img, roi=None, relaxed=False):
+    @staticmethod
+    def contour_features(contours):
+        """
+        Extrai bounding boxes e áreas de todos os contornos de uma vez.
+        Os pontos são concatenados e reduzidos por segmento (reduceat), o que
+        reproduz exatamente cv2.boundingRect e cv2.contourArea (shoelace em
+        coordenadas inteiras) sem uma chamada Python por contorno.
+        Retorna (x, y, w, h, area) como arrays NumPy.
+        """
+        n = len(contours)
+        if n == 0:
+            empty = np.zeros(0, dtype=np.int64)
+            return empty, empty, empty, empty, np.zeros(0, dtype=np.float64)
+
+        lengths = np.fromiter((len(c) for c in contours), dtype=np.intp, count=n)
+        starts = np.zeros(n, dtype=np.intp)
+        np.cumsum(lengths[:-1], out=starts[1:])
+        pts = np.concatenate(contours).reshape(-1, 2).astype(np.int64)
+        xs, ys = pts[:, 0], pts[:, 1]
+
+        x = np.minimum.reduceat(xs, starts)
+        y = np.minimum.reduceat(ys, starts)
+        w = np.maximum.reduceat(xs, starts) - x + 1
+        h = np.maximum.reduceat(ys, starts) - y + 1
+
+        # Shoelace: cada ponto com o seguinte do mesmo contorno (fechando o polígono)
+        nxt = np.arange(1, len(pts) + 1)
+        nxt[starts + lengths - 1] = starts
+        cross = xs[nxt] * ys - xs * ys[nxt]
+        area = np.abs(np.add.reduceat(cross, starts)) / 2.0
+        return x, y, w, h, area
+
+    @staticmethod
+    def _hook_side(region, rw):
+        if region.size == 0: return "none"
+        M = cv2.moments((255 - region).astype(np.uint8))
+        if M["m00"] > 0:
+            local_cx = M["m10"] / M["m00"]
+            palo_center_x = rw / 2
+            thr = max(3.0, rw * 0.35)
+            if local_cx < palo_center_x - thr: return "left"
+            if local_cx > palo_center_x + thr: return "right"
+        return "none"
+
+    def detect_palos(self, processed_img, gray_img, roi=None, relaxed=False, run: Optional[DetectionRun] = None):
         """
         Identifies vertical strokes (palos) ONLY within ROI.
         Strictly discards anything outside.
+
+        Os filtros (ROI, área, largura, aspecto, marcas) são aplicados como
+        máscaras vetorizadas sobre as features de todos os contornos; apenas os
+        candidatos sobreviventes passam pela geometria por contorno
+        (minAreaRect, arcLength, ganchos, pressão). As marcas de intervalo e
+        as contagens de descarte vão para `run.marks` / `run.meta`.
         """
+        run = self._run_or_legacy(run)
         height, width = processed_img.shape
         x_roi, y_roi, w_roi, h_roi = roi if roi else [0, 0, width, height]
-        
+
         # Apply strict ROI mask
-        mask = np.zeros_like(processed_img)
-        mask[y_roi:y_roi+h_roi, x_roi:x_roi+w_roi] = 255
-        roi_processed_working = cv2.bitwise_and(processed_img, mask)
-        
+        roi_processed_working = np.zeros_like(processed_img)
+        roi_slice = (slice(y_roi, y_roi + h_roi), slice(x_roi, x_roi + w_roi))
+        roi_processed_working[roi_slice] = processed_img[roi_slice]
+
         contours, _ = cv2.findContours(roi_processed_working, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-        
-        temp_palos = []
-        temp_marks = []
-        discarded_outside = 0
+        x, y, w, h, area = self.contour_features(contours)
+        run.progress.update("detect", 0.2)
+        center_x = x + w / 2
+        center_y = y + h / 2
+
+        # STRICT VALIDATION: Is the center within the ROI?
+        inside = (y_roi <= center_y) & (center_y <= y_roi + h_roi) & (x_roi <= center_x) & (center_x <= x_roi + w_roi)
+
+        # Filtro mais rigoroso para descartar ruido: minimo 15 pixels.
+        # Reject very wide shapes
+        candidate = inside & (area >= 15) & (w <= width * 0.20)
+        aspect_ratio = np.where(w > 0, h / np.maximum(w, 1), 0.0)
+
+        # Identify Interval Marks
+        is_mark = candidate & (0.05 < aspect_ratio) & (aspect_ratio < 0.3) & (15 < w) & (w < width * 0.12) & (h >= 4)
+        # Marks must be well within the ROI height (not touching the split line)
+        mark_kept = is_mark & ((y_roi + h_roi * 0.05) < center_y) & (center_y < (y_roi + h_roi * 0.95))
+
+        # Identify Palos
+        min_aspect = 1.1 if relaxed else 1.8
+        palo_shape = candidate & ~is_mark & (min_aspect < aspect_ratio) & (aspect_ratio < 70.0) \
+            & ((height * 0.005) < h) & (h < (height * 0.4))
+        # Extra safety: discard if too close to the top of ROI (likely a fragment of header)
+        top_zone = palo_shape & (y < y_roi + (h_roi * 0.02))
+        palo_kept = palo_shape & ~top_zone
+
+        # Motivos de descarte, na ordem em que aparecem nos contornos
+        topzone_hits = (~inside & (center_y < y_roi)) | top_zone
+        other_hits = ~inside & (center_y >= y_roi)
         discarded_reason = {}
+        for first, reason, hits in sorted(
+            (int(np.argmax(m)), r, int(m.sum()))
+            for r, m in (("OUTSIDE_ROI_TOPZONE", topzone_hits), ("OUTSIDE_ROI_OTHER", other_hits)) if m.any()
+        ):
+            discarded_reason[reason] = hits
+        discarded_outside = int((~inside).sum() + top_zone.sum())
 
-        for cnt in contours:
-            x, y, w, h = cv2.boundingRect(cnt)
-            center_y = y + h/2
-            center_x = x + w/2
-            
-            # STRICT VALIDATION: Is the center within the ROI?
-            if not (y_roi <= center_y <= y_roi + h_roi and x_roi <= center_x <= x_roi + w_roi):
-                discarded_outside += 1
-                reason = "OUTSIDE_ROI_TOPZONE" if center_y < y_roi else "OUTSIDE_ROI_OTHER"
-                discarded_reason[reason] = discarded_reason.get(reason, 0) + 1
-                continue
-
-            area = cv2.contourArea(cnt)
-            # Filtro mais rigoroso para descartar ruido: minimo 15 pixels
-            if area < 15: continue 
-            
-            aspect_ratio = h / float(w) if w > 0 else 0
-            
-            # Reject very wide shapes
-            if w > (width * 0.20): continue
-            
-            # Identify Interval Marks
-            if 0.05 < aspect_ratio < 0.3 and 15 < w < (width * 0.12) and h >= 4:
-                # Marks must be well within the ROI height (not touching the split line)
-                if (y_roi + h_roi * 0.05) < center_y < (y_roi + h_roi * 0.95):
-                    temp_marks.append({
-                        "id": f"mark_{len(temp_marks)+1}",
-                        "center": [float(x + w/2), float(y + h/2)],
-                        "bbox": [int(x), int(y), int(w), int(h)],
-                        "type": "interval_mark"
-                    })
-                continue
-
-            # Identify Palos
-            min_aspect = 1.1 if relaxed else 1.8
-            if min_aspect < aspect_ratio < 70.0 and (height * 0.005) < h < (height * 0.4):
-                # Extra safety: discard if too close to the top of ROI (likely a fragment of header)
-                if y < y_roi + (h_roi * 0.02):
-                    discarded_outside += 1
-                    discarded_reason["OUTSIDE_ROI_TOPZONE"] = discarded_reason.get("OUTSIDE_ROI_TOPZONE", 0) + 1
-                    continue
-                
-                rect = cv2.minAreaRect(cnt)
-                raw_angle = rect[2]
-                rect_w, rect_h = rect[1]
-                normalized_angle = (90 + raw_angle) if rect_w > rect_h else (90 - abs(raw_angle))
-                
-                arc_len = cv2.arcLength(cnt, False)
-                dist_ends = np.sqrt(w**2 + h**2)
-                tortuosity = (arc_len / (2 * dist_ends)) if dist_ends > 0 else 1.0
-                
-                # Hook detection
-                hook_top = "none"
-                hook_bottom = "none"
-                palo_roi = gray_img[y:y+h, x:x+w]
-                if h > 20 and palo_roi.size > 0:
-                    top_part = palo_roi[:max(1, h//5), :]
-                    bottom_part = palo_roi[-max(1, h//5):, :]
-                    
-                    def detect_hook_side(region, rw):
-                        if region.size == 0: return "none"
-                        M = cv2.moments((255 - region).astype(np.uint8))
-                        if M["m00"] > 0:
-                            local_cx = M["m10"] / M["m00"]
-                            palo_center_x = rw / 2
-                            thr = max(3.0, rw * 0.35)
-                            if local_cx < palo_center_x - thr: return "left"
-                            if local_cx > palo_center_x + thr: return "right"
-                        return "none"
-                    
-                    hook_top = detect_hook_side(top_part, w)
-                    hook_bottom = detect_hook_side(bottom_part, w)
-
-                temp_palos.append({
-                    "id": f"palo_{len(temp_palos)+1}",
-                    "center": [float(x + w/2), float(y + h/2)],
-                    "bbox": [int(x), int(y), int(w), int(h)],
-                    "height": float(h),
-                    "width": float(w),
-                    "angle": float(normalized_angle),
-                    "tortuosity": float(tortuosity),
-                    "pressure": float(255 - np.mean(gray_img[y:y+h, x:x+w])),
-                    "hooks": {"top": hook_top, "bottom": hook_bottom}
-                })
-
-        self.last_marks = temp_marks
-        self.last_run_meta["total_detected_raw"] = len(temp_palos) + discarded_outside
-        self.last_run_meta["total_kept_in_roi"] = len(temp_palos)
-        self.last_run_meta["total_discarded_outside_roi"] = discarded_outside
-        self.last_run_meta["discard_reasons"] = discarded_reason
-        
-        return temp_palos
+        temp_marks = []
+        for i in np.flatnonzero(mark_kept):
+            mx, my, mw, mh = int(x[i]), int(y[i]), int(w[i]), int(h[i])
+            temp_marks.append({
+                "id": f"mark_{len(temp_marks)+1}",
+                "center": [float(mx + mw/2), float(my + mh/2)],
+                "bbox": [mx, my, mw, mh],
+                "type": "interval_mark"
+            })
+
+        kept = np.flatnonzero(palo_kept)
+        palos = PaloSet.empty(len(kept))
+        px, py, pw, ph = x[kept], y[kept], w[kept], h[kept]
+        palos.bbox[:] = np.stack([px, py, pw, ph], axis=1)
+        palos.center[:, 0] = px + pw / 2
+        palos.center[:, 1] = py + ph / 2
+        palos.height[:] = ph
+        palos.width[:] = pw
+        dist_ends = np.sqrt(pw.astype(np.float64)**2 + ph**2)
+
+        step = max(1, len(kept) // 20)
+        for j, i in enumerate(kept.tolist()):
+            if j % step == 0:
+                run.progress.update("detect", 0.2 + 0.8 * j / len(kept))
+            cnt = contours[i]
+            bx, by, bw, bh = int(px[j]), int(py[j]), int(pw[j]), int(ph[j])
+
+            rect = cv2.minAreaRect(cnt)
+            raw_angle = rect[2]
+            rect_w, rect_h = rect[1]
+            palos.angle[j] = (90 + raw_angle) if rect_w > rect_h else (90 - abs(raw_angle))
+
+            arc_len = cv2.arcLength(cnt, False)
+            palos.tortuosity[j] = (arc_len / (2 * dist_ends[j])) if dist_ends[j] > 0 else 1.0
+
+            # Hook detection + pressure over the same gray ROI
+            palo_roi = gray_img[by:by+bh, bx:bx+bw]
+            if bh > 20 and palo_roi.size > 0:
+                palos.hook_top[j] = PaloSet.HOOKS.index(self._hook_side(palo_roi[:max(1, bh//5), :], bw))
+                palos.hook_bottom[j] = PaloSet.HOOKS.index(self._hook_side(palo_roi[-max(1, bh//5):, :], bw))
+            palos.pressure[j] = 255 - np.mean(palo_roi)
+
+        run.marks = temp_marks
+        run.meta["total_detected_raw"] = len(palos) + discarded_outside
+        run.meta["total_kept_in_roi"] = len(palos)
+        run.meta["total_discarded_outside_roi"] = discarded_outside
+        run.meta["discard_reasons"] = discarded_reason
+        run.progress.update("detect", 1.0)
+
+        return palos
 
     def cluster_lines(self, palos, img_height):
-        if not palos: return []
-        sorted_palos = sorted(palos, key=lambda p: p["center"][1])
-        avg_h = sum(p["height"] for p in palos) / len(palos)
+        """
+        Agrupa os palos em linhas pela coordenada y do centro.
+        Aceita PaloSet ou lista de dicts; retorna uma lista de PaloSet (uma por
+        linha, ordenada por x).
+        """
+        palos = PaloSet.coerce(palos)
+        if not len(palos): return []
+        cx, cy = palos.center[:, 0], palos.center[:, 1]
+        order = np.argsort(cy, kind="stable")
+        avg_h = sum(palos.height.tolist()) / len(palos)
         y_tolerance = avg_h * 0.6
-        
-        lines = []
-        current_line = [sorted_palos[0]]
-        for p in sorted_palos[1:]:
-            y_dist = abs(p["center"][1] - np.mean([x["center"][1] for x in current_line]))
-            if y_dist < y_tolerance:
-                current_line.append(p)
+
+        # Média corrente da linha via soma acumulada (O(1) por palo). Centros
+        # são meio-inteiros, então soma/contagem é exatamente a média anterior.
+        sorted_y = cy[order].tolist()
+        breaks = []
+        line_sum, line_n = sorted_y[0], 1
+        for k in range(1, len(sorted_y)):
+            y = sorted_y[k]
+            if abs(y - line_sum / line_n) < y_tolerance:
+                line_sum += y
+                line_n += 1
             else:
-                current_line.sort(key=lambda x: x["center"][0])
-                lines.append(current_line)
-                current_line = [p]
-        if current_line:
-            current_line.sort(key=lambda x: x["center"][0])
-            lines.append(current_line)
-        return lines
-
-    def segment_intervals(self, lines, total_intervals=5):
-        if not lines: return [[] for _ in range(total_intervals)]
-        palos_ordered = [p for line in lines for p in line]
-        marks = getattr(self, 'last_marks', [])
-        
+                breaks.append(k)
+                line_sum, line_n = y, 1
+
+        # Ordena por (linha, x) de uma vez; lexsort é estável como o sort anterior
+        line_of = np.zeros(len(order), dtype=np.intp)
+        line_of[breaks] = 1
+        np.cumsum(line_of, out=line_of)
+        order = order[np.lexsort((cx[order], line_of))]
+        return [palos.take(idx) for idx in np.split(order, breaks)]
+
+    def segment_intervals(self, lines, total_intervals=5, marks=None):
+        """Divide as linhas nos intervalos pelas `marks` (padrão: last_marks)."""
+        if not lines: return [PaloSet.empty() for _ in range(total_intervals)]
+        palos_ordered = PaloSet.concat(lines)
+        if marks is None:
+            marks = self.last_marks
+
         if not marks or len(marks) < 1:
             chunk_size = max(1, len(palos_ordered) // total_intervals)
-            return [palos_ordered[i*chunk_size:(i+1)*chunk_size if i<4 else None] for i in range(total_intervals)]
+            return [palos_ordered.take(slice(i*chunk_size, (i+1)*chunk_size if i<4 else None)) for i in range(total_intervals)]
+
+        assignment = self.assign_intervals(palos_ordered.center, palos_ordered.height, marks, total_intervals)
+        return [palos_ordered.take(assignment == k) for k in range(total_intervals)]
 
+    @staticmethod
+    def assign_intervals(centers, heights, marks, total_intervals=5):
+        """
+        Índice do intervalo de cada palo dado pelas marcas delimitadoras (só as 4
+        primeiras contam). Depende apenas do próprio palo e das marcas, o que
+        permite atualizar contagens palo a palo (ver corrections.IntervalIndex).
+        """
+        centers = np.asarray(centers, dtype=np.float64).reshape(-1, 2)
+        heights = np.asarray(heights, dtype=np.float64).reshape(-1)
         delimiters = sorted(marks[:4], key=lambda m: (m["center"][1], m["center"][0]))
-        intervals = [[] for _ in range(total_intervals)]
-        
-        for palo in palos_ordered:
-            p_x, p_y = palo["center"]
-            interval_idx = 0
-            for i, mark in enumerate(delimiters):
-                m_x, m_y = mark["center"]
-                line_tol = palo.get("height", 30) * 0.6
-                if p_y < m_y - line_tol or (abs(p_y - m_y) <= line_tol and p_x < m_x):
-                    interval_idx = i
-                    break
-                else:
-                    interval_idx = i + 1
-            intervals[min(interval_idx, total_intervals - 1)].append(palo)
-        return intervals
-
-    def calculate_metrics(self, intervals, mm_per_px=None, img_dims=None):
+        m_x = np.array([m["center"][0] for m in delimiters], dtype=np.float64)
+        m_y = np.array([m["center"][1] for m in delimiters], dtype=np.float64)
+
+        # Matriz palos x marcas (k <= 4): o palo pertence ao intervalo da primeira
+        # marca que ele precede (linha acima, ou mesma linha e à esquerda).
+        p_x = centers[:, :1]
+        p_y = centers[:, 1:]
+        line_tol = heights[:, None] * 0.6
+        before = (p_y < m_y - line_tol) | ((np.abs(p_y - m_y) <= line_tol) & (p_x < m_x))
+        assignment = np.where(before.any(axis=1), before.argmax(axis=1), len(delimiters))
+        np.minimum(assignment, total_intervals - 1, out=assignment)
+        return assignment
+
+    @staticmethod
+    def chunk_counts(n, total_intervals=5):
+        """Contagens do fallback sem marcas (fatias iguais na ordem de leitura)."""
+        if n == 0: return [0] * total_intervals
+        chunk_size = max(1, n // total_intervals)
+        return [len(range(n)[i*chunk_size:(i+1)*chunk_size if i<4 else None]) for i in range(total_intervals)]
+
+    def calculate_metrics(self, intervals, mm_per_px=None, img_dims=None, run_meta=None):
         """
         Calcula métricas oficiais conforme manual.
         Bloqueia resultados se a ROI for incerta (needs_review).
+        `run_meta`: metadados da ROI do run (padrão: last_run_meta).
         """
-        # Recupera metadados da ROI
-        roi_confidence = self.last_run_meta.get("roi_confidence", 0)
-        roi_source = self.last_run_meta.get("roi_source", "unknown")
-        
         # Validação de integridade dos intervalos
-        valid_intervals = len(intervals) == 5 and all(isinstance(i, list) for i in intervals)
-        
+        valid_intervals = len(intervals) == 5 and all(isinstance(i, (list, PaloSet)) for i in intervals)
+        return self.metrics_from_counts([len(i) for i in intervals] if valid_intervals else None, run_meta=run_meta)
+
+    def metrics_from_counts(self, counts, run_meta=None):
+        """
+        Métricas a partir das contagens por intervalo (None = segmentação inválida).
+        Usado tanto pelo pipeline quanto pelas correções manuais incrementais.
+        """
+        # Recupera metadados da ROI
+        meta = self.last_run_meta if run_meta is None else run_meta
+        roi_confidence = meta.get("roi_confidence", 0)
+        roi_source = meta.get("roi_source", "unknown")
+        valid_intervals = counts is not None
+
         # ROI_GUARD: Se confiança < 0.7 ou intervalos inválidos -> needs_review
         needs_review = roi_confidence < 0.7 or not valid_intervals
         
@@ -458,9 +884,9 @@ class PaloDetector:
                 "reason_code": reason,
                 "confidence_score": int(roi_confidence * 100),
                 "roi_source": roi_source,
-                "total_detected_raw": self.last_run_meta.get("total_detected_raw", 0),
-                "total_discarded_outside_roi": self.last_run_meta.get("total_discarded_outside_roi", 0),
-                "discard_reasons": self.last_run_meta.get("discard_reasons", {}),
+                "total_detected_raw": meta.get("total_detected_raw", 0),
+                "total_discarded_outside_roi": meta.get("total_discarded_outside_roi", 0),
+                "discard_reasons": meta.get("discard_reasons", {}),
                 "intervals": ["N/A"] * 5,
                 "nor": "N/A",
                 "mean": "N/A",
@@ -468,8 +894,7 @@ class PaloDetector:
                 "trend": "N/A"
             }
 
-        all_palos = [p for interval in intervals for p in interval]
-        counts = [len(inter) for inter in intervals]
+        counts = [int(c) for c in counts]
         total = sum(counts)
         
         # NOR conforme manual: (Soma das diferenças absolutas * 100) / Total
@@ -494,52 +919,86 @@ class PaloDetector:
             "trend": trend,
             "confidence_score": int(roi_confidence * 100),
             "roi_source": roi_source,
-            "total_detected_raw": self.last_run_meta.get("total_detected_raw"),
-            "total_kept_in_roi": self.last_run_meta.get("total_kept_in_roi"),
-            "total_discarded_outside_roi": self.last_run_meta.get("total_discarded_outside_roi"),
-            "discard_reasons": self.last_run_meta.get("discard_reasons")
-        }
-
-        counts = [len(inter) for inter in intervals]
-        mean_productivity = np.mean(counts) if counts else 0
-        std_dev = np.std(counts) if counts else 0
-        cv = (std_dev / mean_productivity * 100) if mean_productivity > 0 else 0
-        nor = (max(counts) - min(counts)) if counts else 0
-        
-        # Trend
-        if len(counts) >= 2:
-            trend_val = "Ascendente" if counts[-1] > counts[0] else "Descendente"
-            if abs(counts[-1] - counts[0]) < (total * 0.05): trend_val = "Estável"
-        else:
-            trend_val = "N/A"
-
-        avg_pressure = np.mean([p["pressure"] for p in all_palos]) if all_palos else 0
-        avg_slant = np.mean([p["angle"] for p in all_palos]) if all_palos else 0
-        
-        # Physical metrics
-        avg_height_mm = np.mean([p["height"] for p in all_palos]) * mm_per_px if mm_per_px and all_palos else None
-        
-        # Track metadata for output
-        meta = self.last_run_meta
-        
-        return {
-            "total": total,
-            "intervals": counts,
-            "nor": round(nor, 2),
-            "cv": round(cv, 2),
-            "mean": round(mean_productivity, 2),
-            "trend": trend_val,
-            "avg_pressure": round(avg_pressure, 2),
-            "avg_height_mm": round(avg_height_mm, 2) if avg_height_mm else "N/A",
-            "slant": round(avg_slant, 1),
-            "confidence_score": int(roi_confidence * 100),
-            "roi_source": meta.get("roi_source"),
-            "roi_confidence": meta.get("roi_confidence"),
             "total_detected_raw": meta.get("total_detected_raw"),
             "total_kept_in_roi": meta.get("total_kept_in_roi"),
             "total_discarded_outside_roi": meta.get("total_discarded_outside_roi"),
-            "discard_reasons": meta.get("discard_reasons"),
-            "regional_confidence": {
-                "needs_review": needs_review
-            }
+            "discard_reasons": meta.get("discard_reasons")
         }
+
+    def detect(self, image_path: str, mm_per_px: float = 25.4 / 300, progress=None) -> DetectionResult:
+        """
+        Cadeia completa sobre um arquivo: preprocess -> detect_test_area ->
+        detect_palos -> cluster_lines -> segment_intervals -> calculate_metrics.
+        Todo o estado da imagem fica num DetectionRun local e volta no
+        DetectionResult: o detector não é alterado, então a mesma instância
+        pode ser usada por várias threads. O tempo de cada etapa fica em
+        run_meta["stage_timings_ms"]; `progress` recebe as subetapas.
+        """
+        run = DetectionRun(progress)
+        timings = {}
+        with _stage(timings, "preprocess"):
+            warped, gray_img, processed_img = self.preprocess(image_path, run=run)
+
+        # Detect Test Area (ROI) - Ignore header/footer
+        with _stage(timings, "detect_test_area"):
+            roi = self.detect_test_area(processed_img, run=run)
+
+        # Validação independente da ROI (diagnóstico opcional, config "validate_roi")
+        if self.config.get("validate_roi", False):
+            with _stage(timings, "validate_roi"):
+                run.meta["roi_validation"] = self.roi_validator.validate_roi_comprehensive(processed_img, roi)
+
+        # Passed ROI to confinement detection to official test area
+        with _stage(timings, "detect_palos"):
+            palos = self.detect_palos(processed_img, gray_img, roi=roi, run=run)
+
+        # Logical Segmentation (Lines -> Intervals)
+        # Use gray_img for consistent height reference
+        run.progress.update("segment", 0.0)
+        with _stage(timings, "segment"):
+            lines = self.cluster_lines(palos, img_height=gray_img.shape[0])
+            intervals = self.segment_intervals(lines, marks=run.marks)
+
+        run.progress.update("metrics", 0.0)
+        image_dims = (gray_img.shape[1], gray_img.shape[0])
+        with _stage(timings, "metrics"):
+            metrics = self.calculate_metrics(intervals, mm_per_px=mm_per_px, img_dims=image_dims, run_meta=run.meta)
+
+        run.meta["stage_timings_ms"] = timings
+        return DetectionResult(
+            image=warped,
+            roi=roi,
+            palos=palos,
+            marks=run.marks,
+            intervals=intervals,
+            metrics=metrics,
+            run_meta=run.meta,
+            image_dims=list(image_dims),
+        )
+
+    def analyze(self, image_path: str, mm_per_px: float = 25.4 / 300):
+        """
+        Igual a `detect`, devolvendo dict e guardando o run em
+        last_run_meta / last_marks (compatibilidade; uso sequencial).
+        """
+        result = self.detect(image_path, mm_per_px=mm_per_px, progress=self.progress)
+        self._legacy_run = DetectionRun(self.progress, result.run_meta, result.marks)
+        return result._asdict()
+
+
+_default_detector: Optional[PaloDetector] = None
+_default_detector_lock = threading.Lock()
+
+
+def get_detector() -> PaloDetector:
+    """
+    Detector do processo com a configuração padrão, criado uma vez e
+    compartilhado (worker, correções manuais). Use `detect`, que não altera
+    a instância; os estágios legados sem `run` não são seguros entre threads.
+    """
+    global _default_detector
+    if _default_detector is None:
+        with _default_detector_lock:
+            if _default_detector is None:
+                _default_detector = PaloDetector()
+    return _default_detector
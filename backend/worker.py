@@ -0,0 +1,416 @@
+"""
+Vision Worker: executa o pipeline de visão computacional fora do processo da API.
+
+A API apenas cria registros `Job` com status QUEUED. Este módulo reivindica
+esses jobs no banco (QUEUED -> PROCESSING) e os executa num pool limitado de
+processos, de modo que a latência da API não dependa da carga de OpenCV.
+
+Uso standalone:
+    python worker.py --concurrency 4
+"""
+
+import os
+import signal
+import threading
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+from sqlalchemy import update
+
+import models
+import database
+import progress
+import renditions
+import repository
+from utils import jsonify_dict
+
+# Configuração via ambiente (mesmo padrão de database.py / auth.py)
+VISION_WORKERS = int(os.getenv("VISION_WORKERS", max(1, (os.cpu_count() or 2) - 1)))
+VISION_POLL_INTERVAL_S = float(os.getenv("VISION_POLL_INTERVAL_S", "1.0"))
+VISION_JOB_TIMEOUT_S = int(os.getenv("VISION_JOB_TIMEOUT_S", "600"))
+VISION_JOB_MAX_ATTEMPTS = int(os.getenv("VISION_JOB_MAX_ATTEMPTS", "3"))
+
+def claim_next_job(db) -> Optional[int]:
+    """
+    Reivindica atomicamente o job QUEUED mais antigo.
+    O UPDATE condicional garante que dois workers nunca peguem o mesmo job,
+    tanto em SQLite quanto em Postgres.
+    """
+    candidates = db.query(models.Job.id).filter(
+        models.Job.status == models.JobStatus.QUEUED
+    ).order_by(models.Job.created_at.asc(), models.Job.id.asc()).limit(5).all()
+
+    for (job_id,) in candidates:
+        claimed = db.query(models.Job).filter(
+            models.Job.id == job_id,
+            models.Job.status == models.JobStatus.QUEUED
+        ).update({
+            models.Job.status: models.JobStatus.PROCESSING,
+            models.Job.attempts: models.Job.attempts + 1,
+            models.Job.current_step: "na fila do worker",
+            models.Job.updated_at: datetime.utcnow()
+        }, synchronize_session=False)
+        db.commit()
+        if claimed == 1:
+            return job_id
+    return None
+
+
+def requeue_jobs(db, job_ids: List[int], reason: str) -> None:
+    """
+    Devolve jobs interrompidos para a fila, ou marca como FAILED quando o
+    limite de tentativas foi atingido (evita loop infinito com imagens que
+    derrubam o processo).
+    """
+    if not job_ids:
+        return
+    # Só jobs ainda em PROCESSING: um filho pode ter concluído (DONE/FAILED) o
+    # job antes de o pool quebrar, e esse resultado não pode ser desfeito
+    jobs = db.query(models.Job).filter(
+        models.Job.id.in_(job_ids),
+        models.Job.status == models.JobStatus.PROCESSING
+    ).all()
+    for job in jobs:
+        if (job.attempts or 0) >= VISION_JOB_MAX_ATTEMPTS:
+            job.status = models.JobStatus.FAILED
+            job.error_message = f"{reason} (tentativas esgotadas: {job.attempts})"
+            case = db.query(models.Case).filter(models.Case.id == job.case_id).first()
+            if case:
+                case.status = models.CaseStatus.FAILED
+            print(f"[VISION-WORKER] Job {job.id} falhou definitivamente: {reason}")
+        else:
+            job.status = models.JobStatus.QUEUED
+            job.progress = 0
+            job.current_step = "reenfileirado"
+            print(f"[VISION-WORKER] Job {job.id} reenfileirado: {reason}")
+        job.updated_at = datetime.utcnow()
+    db.commit()
+
+
+def recover_stale_jobs(db, stale_after_s: int = VISION_JOB_TIMEOUT_S, exclude: Optional[List[int]] = None) -> int:
+    """
+    Recuperação de falhas: jobs presos em PROCESSING sem atualização há mais
+    de `stale_after_s` segundos pertencem a um worker que morreu.
+    """
+    cutoff = datetime.utcnow() - timedelta(seconds=stale_after_s)
+    query = db.query(models.Job.id).filter(
+        models.Job.status == models.JobStatus.PROCESSING,
+        models.Job.updated_at < cutoff
+    )
+    if exclude:
+        query = query.filter(models.Job.id.notin_(exclude))
+    stale_ids = [job_id for (job_id,) in query.all()]
+    requeue_jobs(db, stale_ids, "worker interrompido durante o processamento")
+    return len(stale_ids)
+
+
+def job_progress_writer(job_id: int):
+    """
+    Grava progresso/passo direto na linha do job, numa conexão própria: não
+    expira os objetos da sessão do job nem mistura com a transação dela.
+    Também renova updated_at, que recover_stale_jobs usa como heartbeat.
+    """
+    def write(value: int, step: str) -> None:
+        with database.engine.begin() as conn:
+            conn.execute(update(models.Job).where(models.Job.id == job_id).values(
+                progress=value, current_step=step, updated_at=datetime.utcnow()))
+    return write
+
+
+def run_pipeline(detector, dest_path: Path, reporter=progress.NULL_PROGRESS) -> Dict:
+    """
+    Roda o pipeline de visão e devolve tudo o que o job persiste (mesmo formato
+    de uma entrada do detection_cache). O progresso das subetapas vai para
+    `reporter`; o detector não guarda estado do job (pode ser o do processo).
+    """
+    # Calibration (300DPI fallback)
+    analysis = detector.detect(str(dest_path), mm_per_px=25.4 / 300, progress=reporter)
+    raw_img = analysis.image
+
+    # Formato compacto configurável (renditions.WARPED_FORMAT); o original continua sem perdas no blob store
+    warped_ext = renditions.extension_for(renditions.WARPED_FORMAT, dest_path.suffix)
+    warped_bytes = renditions.encode(raw_img, warped_ext)
+    reporter.update("metrics", 1.0)
+
+    return {
+        "warped_bytes": warped_bytes,
+        "warped_ext": warped_ext,
+        "warped_img": raw_img,  # evita decodificar de novo para prévia/tiles (não vai para o cache)
+        "roi": analysis.roi,
+        "palos": analysis.palos,
+        "marks": analysis.marks,
+        "metrics": analysis.metrics,
+        "run_meta": analysis.run_meta,
+        "image_dims": analysis.image_dims,
+    }
+
+
+def process_vision_task(job_id: int):
+    """Executa o pipeline completo para um job já reivindicado (status PROCESSING)."""
+    db_gen = database.get_db()
+    db = next(db_gen)
+    db_case = None
+    db_job = None
+    try:
+        db_job = db.query(models.Job).filter(models.Job.id == job_id).first()
+        if not db_job: return
+        db_case = db.query(models.Case).filter(models.Case.id == db_job.case_id).first()
+        db_file = db.query(models.CaseFile).filter(models.CaseFile.id == db_job.file_id).first()
+        if not db_case or not db_file: return
+
+        case_id = db_case.id
+        dest_path = Path(db_file.original_file_url)
+
+        db_job.status = models.JobStatus.PROCESSING
+        db_job.progress = 10
+        db_job.current_step = "preprocess"
+        db.commit()
+
+        import vision
+        import detection_cache
+        # Um detector por processo, reaproveitado entre jobs (o estado do job
+        # fica no DetectionRun de cada chamada)
+        detector = vision.get_detector()
+        # Subetapas do detector atualizam o job em memória; o banco recebe no
+        # máximo uma escrita a cada JOB_PROGRESS_FLUSH_MS
+        reporter = progress.ProgressReporter(job_progress_writer(job_id), progress=10, step="preprocess")
+
+        print(f"[VISION-JOB] Iniciando: {case_id} (job {job_id}, pid {os.getpid()})")
+        cache = detection_cache.get_cache()
+        cache_key = cache.key_for_file(dest_path, detector.config) if cache.enabled else None
+        result = cache.get(cache_key) if cache_key else None
+        warped_img = None
+        if result is not None:
+            print(f"[VISION-JOB] Cache hit: {case_id} (job {job_id}, chave {cache_key[:12]})")
+            db_job.current_step = "cache"
+        else:
+            result = run_pipeline(detector, dest_path, reporter)
+            warped_img = result.pop("warped_img")
+            if cache_key:
+                try:
+                    cache.put(cache_key, **result)
+                except Exception as e:
+                    # O cache é só otimização: falha ao gravar não derruba o job
+                    print(f"[DETECTION-CACHE] Falha ao gravar {cache_key[:12]}: {e}")
+
+        # Última escrita pela conexão própria antes de a sessão começar a gravar
+        # (no SQLite ela passa a segurar o lock de escrita até o commit final)
+        reporter.update("renditions", 0.0)
+        reporter.flush()
+
+        roi = result["roi"]
+        palos = result["palos"]
+        metrics_data = result["metrics"]
+
+        # Save Detections / Metrics (Including Phase 2 Clinical Metrics): uma linha por caso,
+        # reanalisar sobrescreve em vez de acumular linhas que os endpoints não leem
+        repository.upsert_for_case(
+            db, models.Detection, case_id,
+            palo_objects=jsonify_dict({
+                "palos": palos,
+                "marks": result["marks"]
+            }),
+            # run_meta (confiança/origem da ROI) é necessário para recalcular
+            # métricas nas correções manuais sem rodar o detector de novo
+            roi_config=jsonify_dict({"roi": roi, "run_meta": result["run_meta"]})
+        )
+
+        is_na = metrics_data.get("total") == "N/A"
+        repository.upsert_for_case(
+            db, models.Metric, case_id,
+            total_count=-1 if is_na else int(metrics_data["total"]),
+            by_interval=jsonify_dict({"counts": metrics_data["intervals"]}),
+            stats=jsonify_dict({k: v for k, v in metrics_data.items() if k not in ["total", "intervals"]}),
+            confidence_level="High" if metrics_data.get("confidence_score", 0) > 75 and not is_na else "Low",
+            confidence_reasons=jsonify_dict({
+                "score": metrics_data.get("confidence_score", 0),
+                "alerts": metrics_data.get("confidence_reasons", [])
+            })
+        )
+
+        # Save Warped Image: retificada compacta + prévia + tiles, no blob store
+        # (reprocessar com o mesmo resultado reaproveita os mesmos blobs)
+        db_file.processed_images_urls = renditions.store_renditions(
+            db, result["warped_bytes"], result["warped_ext"], dest_path.suffix,
+            warped_img=warped_img, previous=db_file.processed_images_urls)
+        db_file.width, db_file.height = result["image_dims"]
+
+        db_job.progress = 100
+        db_job.status = models.JobStatus.DONE
+        db_job.current_step = "concluido"
+
+        # Check if needs review
+        if metrics_data.get("regional_confidence", {}).get("needs_review", False):
+             # You might want a specific status for this
+             # For now, let's keep it DONE but the frontend will show the warnings
+             db_case.status = models.CaseStatus.DONE
+        else:
+             db_case.status = models.CaseStatus.DONE
+
+        db.commit()
+    except Exception as e:
+        print(f"[VISION-JOB-ERROR]: {e}")
+        db.rollback()
+        if db_job is not None:
+            db_job.status = models.JobStatus.FAILED
+            db_job.error_message = str(e)
+        if db_case is not None:
+            db_case.status = models.CaseStatus.FAILED
+        db.commit()
+    finally:
+        db.close()
+
+
+def _init_worker_process(processes: int = 1):
+    # O processo pai coordena o shutdown; os filhos terminam o job em andamento.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # Threads do OpenCV divididas entre os processos do pool (CV_THREADS sobrepõe)
+    import cv_resources
+    cv_resources.configure_process(processes)
+
+
+class VisionWorkerPool:
+    """
+    Pool limitado de processos que consome a tabela `jobs`.
+
+    - `concurrency`: número máximo de jobs simultâneos (um processo por job).
+    - `stop()`: shutdown gracioso, para de reivindicar e aguarda os jobs em andamento.
+    - Jobs presos em PROCESSING (worker morto) são reenfileirados periodicamente.
+    """
+
+    def __init__(self, concurrency: int = VISION_WORKERS, poll_interval: float = VISION_POLL_INTERVAL_S):
+        self.concurrency = max(1, concurrency)
+        self.poll_interval = poll_interval
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._inflight: Dict = {}
+
+    def _new_executor(self) -> ProcessPoolExecutor:
+        # "spawn" evita herdar conexões do banco e threads do processo da API.
+        return ProcessPoolExecutor(
+            max_workers=self.concurrency,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker_process,
+            initargs=(self.concurrency,)
+        )
+
+    def start(self):
+        """Inicia o despachante numa thread (modo embutido na API)."""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self.run, name="vision-dispatcher", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: Optional[float] = None):
+        self.request_stop()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def request_stop(self):
+        """Sinaliza o shutdown sem bloquear (seguro para handlers de sinal)."""
+        self._stop_event.set()
+
+    def _reset_executor(self, reason: str, extra: Sequence[int] = ()):
+        # Um processo filho morreu (ex.: segfault do OpenCV): todos os futures
+        # pendentes são perdidos. Reenfileira os jobs (mais `extra`, reivindicados
+        # sem future) e recria o pool.
+        lost = list(self._inflight.values()) + list(extra)
+        self._inflight.clear()
+        db = database.SessionLocal()
+        try:
+            requeue_jobs(db, lost, reason)
+        finally:
+            db.close()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._executor = self._new_executor()
+
+    def _dispatch(self, db):
+        while len(self._inflight) < self.concurrency and not self._stop_event.is_set():
+            job_id = claim_next_job(db)
+            if job_id is None:
+                return
+            try:
+                future = self._executor.submit(process_vision_task, job_id)
+            except BrokenProcessPool:
+                # Liquida os futures já concluídos; voltam à fila só o job
+                # reivindicado e os realmente perdidos
+                done, _ = wait(list(self._inflight), timeout=0)
+                self._collect_finished(done, claimed=job_id)
+                return
+            self._inflight[future] = job_id
+
+    def _collect_finished(self, done, claimed: Optional[int] = None):
+        # Liquida todos os futures concluídos antes de tratar um pool quebrado:
+        # só os jobs realmente perdidos continuam em _inflight para o requeue.
+        # `claimed`: job reivindicado cujo submit encontrou o pool quebrado.
+        broken = claimed is not None
+        for future in done:
+            job_id = self._inflight.pop(future)
+            try:
+                future.result()
+            except BrokenProcessPool:
+                self._inflight[future] = job_id
+                broken = True
+            except Exception as e:
+                print(f"[VISION-WORKER] Job {job_id} terminou com erro não tratado: {e}")
+        if broken:
+            reason = "pool de processos indisponível" if claimed is not None else "processo do worker encerrado inesperadamente"
+            self._reset_executor(reason, extra=[claimed] if claimed is not None else [])
+
+    def run(self):
+        print(f"[VISION-WORKER] Iniciando pool com {self.concurrency} processo(s)")
+        self._executor = self._new_executor()
+        last_recovery = None
+        try:
+            while not self._stop_event.is_set():
+                db = database.SessionLocal()
+                try:
+                    if last_recovery is None or time.monotonic() - last_recovery > max(self.poll_interval, 30):
+                        recover_stale_jobs(db, exclude=list(self._inflight.values()))
+                        last_recovery = time.monotonic()
+                    self._dispatch(db)
+                except Exception as e:
+                    print(f"[VISION-WORKER-ERROR] Falha ao despachar jobs: {e}")
+                finally:
+                    db.close()
+
+                if not self._inflight:
+                    self._stop_event.wait(self.poll_interval)
+                    continue
+
+                done, _ = wait(list(self._inflight), timeout=self.poll_interval, return_when=FIRST_COMPLETED)
+                self._collect_finished(done)
+        finally:
+            if self._inflight:
+                print(f"[VISION-WORKER] Aguardando {len(self._inflight)} job(s) em andamento...")
+            self._executor.shutdown(wait=True)
+            self._inflight.clear()
+            print("[VISION-WORKER] Pool encerrado")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="PaloCheck vision worker")
+    parser.add_argument("--concurrency", type=int, default=VISION_WORKERS,
+                        help="Número máximo de jobs processados em paralelo")
+    parser.add_argument("--poll-interval", type=float, default=VISION_POLL_INTERVAL_S)
+    args = parser.parse_args()
+
+    models.init_db(database.engine)
+    pool = VisionWorkerPool(concurrency=args.concurrency, poll_interval=args.poll_interval)
+
+    def _handle_signal(signum, frame):
+        print(f"[VISION-WORKER] Sinal {signum} recebido, encerrando após os jobs atuais...")
+        pool.request_stop()
+
+    signal.signal(signal.SIGTERM, _handle_signal)
+    signal.signal(signal.SIGINT, _handle_signal)
+    pool.run()
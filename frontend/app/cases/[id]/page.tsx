@@ -15,26 +15,30 @@ export default function CaseDetailPage() {
     const [loading, setLoading] = useState(true);
     const [error, setError] = useState('');
 
-    const fetchJobStatus = async () => {
+    const fetchJobStatus = async (etag?: string) => {
         try {
             const token = localStorage.getItem('pc_token');
-            const res = await fetch(`${API_BASE_URL}/cases/${caseId}/jobs/latest`, {
-                headers: { 'Authorization': `Bearer ${token}` }
+            // Long-poll: com If-None-Match o servidor só responde quando o progresso muda (ou 304 após 25s)
+            const res = await fetch(`${API_BASE_URL}/cases/${caseId}/jobs/latest?wait=25`, {
+                headers: { 'Authorization': `Bearer ${token}`, ...(etag ? { 'If-None-Match': etag } : {}) }
             });
 
-            if (res.ok) {
+            if (res.status === 304) {
+                fetchJobStatus(etag);
+            } else if (res.ok) {
                 const data = await res.json();
                 setJob(data);
 
                 // Keep polling if not done or failed
                 if (data.status !== 'done' && data.status !== 'failed') {
-                    setTimeout(fetchJobStatus, 2000);
+                    fetchJobStatus(res.headers.get('ETag') || undefined);
                 }
             } else if (res.status === 404) {
                 setError('Nenhum processo de análise encontrado.');
             }
         } catch (err) {
             console.error("Erro ao buscar status do job:", err);
+            setTimeout(() => fetchJobStatus(etag), 2000);
         } finally {
             setLoading(false);
         }
@@ -0,0 +1,95 @@
+"""
+Micro-benchmark do cluster_lines: soma acumulada vs. a versão anterior, que
+recalculava np.mean da linha corrente a cada palo (quadrático no tamanho da
+linha). Confere que as linhas são idênticas.
+
+    python tests/benchmark_cluster_lines.py [--sizes 1000 10000 50000] [--per-line 40]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend"))
+from vision import PaloDetector, PaloSet
+
+
+def legacy_cluster_lines(palos):
+    """Cópia congelada do cluster_lines anterior (referência do benchmark)."""
+    if not len(palos): return []
+    cx, cy = palos.center[:, 0], palos.center[:, 1]
+    order = np.argsort(cy, kind="stable")
+    avg_h = sum(palos.height.tolist()) / len(palos)
+    y_tolerance = avg_h * 0.6
+    groups = []
+    current_line = [order[0]]
+    for i in order[1:]:
+        y_dist = abs(cy[i] - np.mean(cy[current_line]))
+        if y_dist < y_tolerance:
+            current_line.append(i)
+        else:
+            groups.append(current_line)
+            current_line = [i]
+    if current_line:
+        groups.append(current_line)
+    lines = []
+    for idx in groups:
+        idx = np.asarray(idx)
+        lines.append(palos.take(idx[np.argsort(cx[idx], kind="stable")]))
+    return lines
+
+
+def synthetic_palos(n, per_line, seed=0):
+    rng = np.random.default_rng(seed)
+    rows, cols = np.divmod(np.arange(n), per_line)
+    h = rng.integers(30, 60, n)
+    y = rows * 120 + rng.integers(-12, 12, n)
+    x = cols * 25 + rng.integers(-3, 3, n)
+    w = rng.integers(2, 8, n)
+    palos = PaloSet.empty(n)
+    palos.bbox[:] = np.stack([x, y, w, h], axis=1)
+    palos.center[:] = np.stack([x + w / 2, y + h / 2], axis=1)
+    palos.height[:] = h
+    palos.width[:] = w
+    return palos.take(rng.permutation(n))
+
+
+def best_of(fn, runs):
+    times = []
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - t0)
+    return result, min(times) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 50000])
+    parser.add_argument("--per-line", type=int, default=40)
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    detector = PaloDetector()
+    ok = True
+    print(f"{'palos':>8}{'por linha':>11}{'anterior ms':>13}{'novo ms':>10}{'speedup':>9}  idênticas")
+    for n in args.sizes:
+        # Linhas típicas e o pior caso (uma linha só; a versão anterior é
+        # quadrática, então só até 10k palos)
+        for per_line in (args.per_line, n) if n <= 10000 else (args.per_line,):
+            palos = synthetic_palos(n, per_line)
+            if per_line == n:
+                palos.center[:, 1] = 500.5  # todos na mesma linha
+            old, old_ms = best_of(lambda: legacy_cluster_lines(palos), args.runs)
+            new, new_ms = best_of(lambda: detector.cluster_lines(palos, img_height=0), args.runs)
+            same = [l.ids.tolist() for l in old] == [l.ids.tolist() for l in new]
+            ok &= same
+            print(f"{n:8}{per_line:11}{old_ms:13.1f}{new_ms:10.2f}{old_ms / new_ms:8.1f}x  {same}")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,74 @@
+"""
+Benchmark da localização multi-resolução do papel (find_paper_and_warp).
+
+Compara, para várias resoluções de entrada, a busca em resolução total
+(paper_detect_max_side=None) com a busca no nível reduzido + refinamento
+local dos cantos: speedup, desvio entre as duas versões (cantos e tamanho
+do warp) e erro de cada uma em relação aos cantos reais da folha sintética.
+
+    python tests/benchmark_paper_warp.py [--runs 3]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend"))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from vision import PaloDetector
+from benchmark_preprocess import create_a4_photo
+
+
+def timed(fn, runs):
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = fn()
+        samples.append(time.perf_counter() - start)
+    return result, np.median(samples) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--dpis", type=int, nargs="+", default=[150, 300, 450, 600])
+    args = parser.parse_args()
+
+    full = PaloDetector()
+    multi = PaloDetector(dict(full.config, paper_detect_max_side=1200))
+
+    print(f"{'DPI':>5}{'entrada':>13}{'total ms':>10}{'multi ms':>10}{'speedup':>9}"
+          f"{'Δ canto':>9}{'Δ warp':>8}{'erro total':>12}{'erro multi':>12}")
+    worst = 0.0
+    for dpi in args.dpis:
+        img, truth = create_a4_photo(dpi, return_corners=True)
+        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+
+        rect_full, t_full = timed(lambda: full.locate_paper(img, gray=gray), args.runs)
+        rect_multi, t_multi = timed(lambda: multi.locate_paper(img, gray=gray), args.runs)
+        if rect_full is None or rect_multi is None:
+            print(f"{dpi:5} papel não encontrado (total={rect_full is not None}, multi={rect_multi is not None})")
+            worst = float("inf")
+            continue
+
+        max_dist = lambda a, b: float(np.max(np.linalg.norm(a - b, axis=1)))
+        corner_delta = max_dist(rect_full, rect_multi)
+        err_full, err_multi = max_dist(rect_full, truth), max_dist(rect_multi, truth)
+        warp_full = full._warp_quad(img, rect_full)
+        warp_multi = multi._warp_quad(img, rect_multi)
+        size_delta = max(abs(a - b) for a, b in zip(warp_full.shape[:2], warp_multi.shape[:2]))
+        worst = max(worst, err_multi)
+
+        print(f"{dpi:5}{img.shape[1]:>7}x{img.shape[0]:<5}{t_full:10.1f}{t_multi:10.1f}{t_full / t_multi:8.1f}x"
+              f"{corner_delta:9.2f}{size_delta:8d}{err_full:12.2f}{err_multi:12.2f}")
+
+    print(f"\nErro máximo de canto (multi-resolução vs. cantos reais): {worst:.2f} px")
+    return 0 if worst <= 2.0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,134 @@
+"""
+Benchmark do preprocess em estágios vs. a implementação anterior.
+
+Gera uma "foto" sintética de uma folha A4 a 300 DPI sobre um fundo escuro,
+mede tempo de parede, tempo de CPU e pico de memória (tracemalloc) das
+versões, confere que as saídas do modo exato (localização do papel em
+resolução total) são idênticas às anteriores e imprime o breakdown por estágio.
+
+    python tests/benchmark_preprocess.py [--dpi 300] [--runs 5]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend"))
+from vision import PaloDetector
+
+
+def create_a4_photo(dpi=300, return_corners=False):
+    """
+    Folha A4 com palos, levemente em perspectiva, sobre uma mesa escura.
+    Com return_corners=True devolve também os cantos reais (tl, tr, br, bl).
+    """
+    page_w, page_h = int(8.27 * dpi), int(11.69 * dpi)
+    page = np.full((page_h, page_w, 3), 245, dtype=np.uint8)
+    scale = dpi / 100.0
+    cv2.line(page, (int(50 * scale), int(300 * scale)), (page_w - int(50 * scale), int(300 * scale)), (0, 0, 0), max(2, int(scale)))
+    for row in range(5):
+        y_base = int((400 + row * 150) * scale)
+        for col in range(20):
+            x = int((100 + col * 35) * scale)
+            cv2.line(page, (x, y_base), (x, y_base + int(60 * scale)), (20, 20, 20), max(2, int(scale)))
+
+    canvas_h, canvas_w = int(page_h * 1.12), int(page_w * 1.12)
+    src = np.float32([[0, 0], [page_w, 0], [page_w, page_h], [0, page_h]])
+    off_x, off_y = (canvas_w - page_w) / 2, (canvas_h - page_h) / 2
+    dst = np.float32([
+        [off_x + 0.01 * page_w, off_y],
+        [off_x + page_w, off_y + 0.015 * page_h],
+        [off_x + 0.99 * page_w, off_y + page_h],
+        [off_x, off_y + 0.99 * page_h]])
+    M = cv2.getPerspectiveTransform(src, dst)
+    photo = cv2.warpPerspective(page, M, (canvas_w, canvas_h), borderValue=(60, 50, 40))
+    return (photo, dst) if return_corners else photo
+
+
+def legacy_preprocess(image_path):
+    """Cópia congelada do preprocess anterior (referência do benchmark)."""
+    img = cv2.imread(image_path)
+    hls = cv2.cvtColor(img, cv2.COLOR_BGR2HLS)
+    l_channel = hls[:, :, 1]
+    paper_mask = cv2.adaptiveThreshold(l_channel, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 31, 15)
+
+    height, width = img.shape[:2]
+    g = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    g = cv2.createCLAHE(clipLimit=3.0, tileGridSize=(10, 10)).apply(g)
+    blurred = cv2.medianBlur(g, 5)
+    v = np.median(blurred)
+    edged = cv2.Canny(blurred, int(max(0, 0.67 * v)), int(min(255, 1.33 * v)))
+    contours, _ = cv2.findContours(edged, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    contours = sorted(contours, key=cv2.contourArea, reverse=True)
+    warped = img
+    for c in contours:
+        if cv2.contourArea(c) < (width * height * 0.10): continue
+        approx = cv2.approxPolyDP(c, 0.02 * cv2.arcLength(c, True), True)
+        if len(approx) == 4:
+            rect = PaloDetector._order_corners(approx.reshape(4, 2))
+            warped = PaloDetector._warp_quad(img, rect)
+            break
+
+    gray = cv2.cvtColor(warped, cv2.COLOR_BGR2GRAY)
+    gray_balanced = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8)).apply(gray)
+    thresh = cv2.adaptiveThreshold(gray_balanced, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY_INV, 21, 8)
+    opening = cv2.morphologyEx(thresh, cv2.MORPH_OPEN, np.ones((2, 2), np.uint8), iterations=1)
+    opening = cv2.morphologyEx(opening, cv2.MORPH_CLOSE, np.ones((3, 3), np.uint8), iterations=1)
+    v_kernel = np.array([[0, 1, 0], [0, 1, 0], [0, 1, 0]], dtype=np.uint8)
+    opening = cv2.dilate(opening, v_kernel, iterations=2)
+    return warped, gray, opening
+
+
+def measure(fn, runs):
+    walls, cpus = [], []
+    for _ in range(runs):
+        w0, c0 = time.perf_counter(), time.process_time()
+        result = fn()
+        walls.append(time.perf_counter() - w0)
+        cpus.append(time.process_time() - c0)
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, np.median(walls) * 1000, np.median(cpus) * 1000, peak / 2**20
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dpi", type=int, default=300)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    cv2.setNumThreads(1)  # CPU time comparável entre as versões
+    img = create_a4_photo(args.dpi)
+    path = os.path.join(tempfile.mkdtemp(), "a4_scan.png")
+    cv2.imwrite(path, img)
+    print(f"Imagem sintética: {img.shape[1]}x{img.shape[0]} ({args.dpi} DPI)")
+
+    exact = PaloDetector()
+    detector = PaloDetector(dict(exact.config, paper_detect_max_side=1200))
+    old, old_wall, old_cpu, old_peak = measure(lambda: legacy_preprocess(path), args.runs)
+    new, new_wall, new_cpu, new_peak = measure(lambda: exact.preprocess(path), args.runs)
+    _, multi_wall, multi_cpu, multi_peak = measure(lambda: detector.preprocess(path), args.runs)
+
+    identical = all(np.array_equal(a, b) for a, b in zip(old, new))
+    print(f"Saídas idênticas (modo exato): {identical}")
+    print(f"{'':14}{'wall ms':>10}{'cpu ms':>10}{'peak MiB':>10}")
+    print(f"{'anterior':14}{old_wall:10.1f}{old_cpu:10.1f}{old_peak:10.1f}")
+    print(f"{'estágios':14}{new_wall:10.1f}{new_cpu:10.1f}{new_peak:10.1f}")
+    print(f"{'+ multi-res':14}{multi_wall:10.1f}{multi_cpu:10.1f}{multi_peak:10.1f}")
+    print(f"Economia (estágios): CPU {100 * (1 - new_cpu / old_cpu):.1f}%, pico de memória {100 * (1 - new_peak / old_peak):.1f}%")
+    print("\nBreakdown por estágio (última execução):")
+    for stage, ms in detector.last_run_meta["preprocess_timings_ms"].items():
+        print(f"  {stage:16}{ms:8.1f} ms")
+    return 0 if identical else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,99 @@
+"""
+Benchmark dos detectores da linha separadora (config "separator_detector").
+
+Compara HoughLinesP ("hough") com abertura horizontal + projeção por
+inclinação ("projection") nas folhas sintéticas de
+backend/tests_adaptive_robustness.py, em várias escalas. Para cada condição
+mede o tempo mediano da busca na faixa do cabeçalho e o erro em relação à
+linha desenhada (y=300 na folha base), sobre a imagem binária do preprocess,
+que é o que detect_test_area recebe no pipeline.
+
+    python tests/benchmark_separator.py [--runs 5] [--scales 1 2 3]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend")
+sys.path.append(BACKEND_DIR)
+from vision import PaloDetector
+from analysis_context import AnalysisContext
+from tests_adaptive_robustness import create_realistic_test_sheet
+
+CONDITIONS = ["normal", "low_contrast", "high_contrast", "shadows", "noisy", "rotated"]
+SEPARATOR_Y = 300  # create_realistic_test_sheet: linha de (50, 300) a (950, 300)
+TOLERANCE_PX = 15  # por unidade de escala
+
+
+def true_separator_y(condition, height, width, scale):
+    """y da linha no centro da imagem (a rotação de 5 graus é em torno do centro)."""
+    if condition != "rotated":
+        return SEPARATOR_Y * scale
+    base_h = height / scale
+    angle = np.radians(5)
+    return (base_h / 2 + (SEPARATOR_Y - base_h / 2) * np.cos(angle)) * scale
+
+
+def timed(fn, runs):
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = fn()
+        samples.append(time.perf_counter() - start)
+    return result, float(np.median(samples)) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--scales", type=int, nargs="+", default=[1, 2, 3])
+    args = parser.parse_args()
+    np.random.seed(0)  # condição "noisy"
+
+    detectors = {
+        "hough": PaloDetector.find_separator_hough,
+        "projection": PaloDetector.find_separator_projection,
+    }
+    totals = {name: {"ms": 0.0, "hits": 0, "found": 0} for name in detectors}
+    cases = 0
+    print(f"{'condição':<14}{'escala':>6}{'verdade':>9}" + "".join(f"{n + ' y':>14}{'ms':>9}" for n in detectors))
+    for scale in args.scales:
+        for condition in CONDITIONS:
+            sheet = create_realistic_test_sheet(condition=condition)
+            if scale != 1:
+                sheet = cv2.resize(sheet, None, fx=scale, fy=scale, interpolation=cv2.INTER_CUBIC)
+            detector = PaloDetector()
+            warped, _, processed = detector.preprocess_image(sheet)
+            # Folha sobre fundo branco: o "papel" é a imagem toda (warp ~identidade, +-1 px)
+            if max(abs(a - b) for a, b in zip(warped.shape[:2], sheet.shape[:2])) > 2 * scale:
+                print(f"{condition:<14}{scale:>6}  (papel recortado pelo warp: sem verdade de referência)")
+                continue
+            start_y, thresh = AnalysisContext(processed).header_region
+            truth = true_separator_y(condition, *processed.shape, scale)
+            row = f"{condition:<14}{scale:>6}{truth:>9.0f}"
+            cases += 1
+            for name, find in detectors.items():
+                y, ms = timed(lambda: find(thresh), args.runs)
+                y = y + start_y if y >= 0 else -1
+                hit = y >= 0 and abs(y - truth) <= TOLERANCE_PX * scale
+                totals[name]["ms"] += ms
+                totals[name]["hits"] += hit
+                totals[name]["found"] += y >= 0
+                row += f"{y:>13}{'✓' if hit else '✗'}{ms:>9.2f}"
+            print(row)
+
+    print("\nResumo (faixa do cabeçalho, imagem binária do preprocess):")
+    for name, t in totals.items():
+        print(f"  {name:<11} acertos {t['hits']}/{cases}  linha encontrada {t['found']}/{cases}  "
+              f"tempo total {t['ms']:.1f} ms")
+    speedup = totals["hough"]["ms"] / totals["projection"]["ms"] if totals["projection"]["ms"] else float("nan")
+    print(f"  projection é {speedup:.1f}x mais rápido que hough")
+
+
+if __name__ == "__main__":
+    main()
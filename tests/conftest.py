@@ -0,0 +1,14 @@
+import os
+import sys
+import tempfile
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend")
+sys.path.insert(0, BACKEND_DIR)
+
+# O backend resolve "../storage" e o SQLite relativos ao diretório atual:
+# isolamos tudo num diretório temporário para não sujar o repositório.
+_sandbox = tempfile.mkdtemp(prefix="palocheck-tests-")
+os.makedirs(os.path.join(_sandbox, "backend"), exist_ok=True)
+os.chdir(os.path.join(_sandbox, "backend"))
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(_sandbox, 'palocheck_test.db')}")
+os.environ.setdefault("VISION_WORKER_MODE", "external")
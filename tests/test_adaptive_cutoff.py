@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+
+from vision import PaloDetector
+
+
+def loop_cutoff(row_sums, start, end, threshold):
+    """Implementação anterior (laço por linha), referência de equivalência."""
+    for y in range(start, end):
+        if row_sums[y] > threshold:
+            if np.mean(row_sums[y:y+40]) > threshold:
+                return y
+    return -1
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_matches_loop_on_random_profiles(seed):
+    rng = np.random.default_rng(seed)
+    height = int(rng.integers(30, 3000))
+    width = 1000
+    # Perfis esparsos com rajadas (palos começando em algum ponto) e picos isolados
+    row_sums = (rng.random(height) < rng.uniform(0.05, 0.9)).astype(np.uint64) * rng.integers(0, width * 255 // 10, height).astype(np.uint64)
+    threshold = width * 255 * 0.04
+    start, end = int(height * 0.15), int(height * rng.choice([0.5, 1.0]))
+    assert PaloDetector.adaptive_cutoff(row_sums, start, end, threshold) == loop_cutoff(row_sums, start, end, threshold)
+
+
+def test_window_truncated_at_image_end_and_no_hit():
+    row_sums = np.zeros(100, dtype=np.uint64)
+    row_sums[95:] = 1000
+    assert PaloDetector.adaptive_cutoff(row_sums, 0, 100, 500) == loop_cutoff(row_sums, 0, 100, 500) == 95
+    assert PaloDetector.adaptive_cutoff(np.zeros(100, dtype=np.uint64), 15, 50, 1) == -1
+    assert PaloDetector.adaptive_cutoff(row_sums, 60, 60, 1) == -1
+
+
+def test_density_profile_is_bounded_and_in_meta():
+    row_sums = np.full(1414, 255 * 100, dtype=np.uint64)
+    profile = PaloDetector.density_profile(row_sums, 1000, max_points=512)
+    assert profile["row_step"] == 3 and len(profile["values"]) <= 512
+    assert profile["values"][0] == pytest.approx(0.1)
+    assert len(PaloDetector.density_profile(row_sums, 1000, max_points=None)["values"]) == 1414
+
+    img = np.zeros((1414, 1000), dtype=np.uint8)
+    img[600:1200:150, 100:900:40] = 255
+    detector = PaloDetector()
+    detector.detect_test_area(img)
+    meta = detector.last_run_meta
+    assert len(meta["density_profile"]["values"]) <= 512 and "adaptive_cutoff_y" in meta
@@ -0,0 +1,95 @@
+import json
+
+import cv2
+import numpy as np
+import pytest
+
+from analysis_context import AnalysisContext
+from roi_validator import ROIValidator
+from vision import PaloDetector
+from test_detect_palos_regression import dense_sheet_with_marks
+
+
+@pytest.fixture(scope="module")
+def processed():
+    return PaloDetector().preprocess_image(dense_sheet_with_marks(seed=5))[2]
+
+
+@pytest.fixture()
+def morphology_calls(monkeypatch):
+    calls = []
+    original = cv2.morphologyEx
+
+    def counting(*args, **kwargs):
+        calls.append(args[1])
+        return original(*args, **kwargs)
+
+    monkeypatch.setattr(cv2, "morphologyEx", counting)
+    return calls
+
+
+def test_profiles_match_direct_computation(processed):
+    ctx = AnalysisContext(processed)
+    mask = cv2.morphologyEx(processed, cv2.MORPH_OPEN, cv2.getStructuringElement(cv2.MORPH_RECT, (1, 25)))
+    np.testing.assert_array_equal(ctx.row_profile, mask.sum(axis=1))
+    start, thresh = ctx.header_region
+    assert start == int(processed.shape[0] * 0.10) and thresh.shape[0] == int(processed.shape[0] * 0.60) - start
+
+
+def test_context_caches_morphology_passes(processed, morphology_calls):
+    detector = PaloDetector()
+    ctx = AnalysisContext(processed)
+    roi = detector.detect_test_area(processed, ctx=ctx)
+    assert len(morphology_calls) == 1
+    assert ctx.row_profile is ctx.row_profile and len(morphology_calls) == 1
+    # Validador: uma abertura do recorte por comprimento (1x20 e 1x25)
+    validation = ROIValidator().validate_roi_comprehensive(processed, roi)
+    assert len(morphology_calls) == 3
+    assert json.dumps(validation)
+
+    # Sem contexto o resultado da ROI é o mesmo
+    alone = PaloDetector()
+    assert alone.detect_test_area(processed) == roi
+    assert alone.last_run_meta == detector.last_run_meta
+
+
+def test_validator_handles_tiny_roi(processed):
+    result = ROIValidator().validate_roi_comprehensive(processed, [0, 0, 10, 3])
+    assert result["has_structure"] in (True, False) and json.dumps(result)
+
+
+def legacy_structure_and_density(img, roi):
+    """ROIValidator original (aberturas do recorte da ROI), referência."""
+    x, y, w, h = roi
+    roi_img = img[y:y+h, x:x+w]
+    rows = np.sum(cv2.morphologyEx(roi_img, cv2.MORPH_OPEN, cv2.getStructuringElement(cv2.MORPH_RECT, (1, 20))), axis=1)
+    top = rows[:int(h*0.05)]
+    structure = (bool(np.max(top) > (w * 255 * 0.02)), np.max(top))
+    rows = np.sum(cv2.morphologyEx(roi_img, cv2.MORPH_OPEN, cv2.getStructuringElement(cv2.MORPH_RECT, (1, 25))), axis=1)
+    step = h // 5
+    densities = [np.mean(rows[i*step:(i+1)*step if i < 4 else h]) for i in range(5)]
+    density = (bool(all(d > (w * 255 * 0.01) for d in densities)), densities, np.mean(densities))
+    return structure, density
+
+
+@pytest.mark.parametrize("roi", [(40, 300, 900, 1000), (40, 410, 900, 700), (0, 0, 1000, 1414), (100, 455, 300, 40)])
+def test_validator_keeps_crop_opening_semantics(processed, roi):
+    # ROIs que cortam traços no meio: a abertura do recorte difere da máscara da imagem inteira
+    validator = ROIValidator()
+    structure, density = legacy_structure_and_density(processed, roi)
+    assert validator.validate_roi_by_structure(processed, roi) == structure
+    has_content, densities, avg = validator.validate_roi_by_density(processed, roi)
+    assert (has_content, avg) == (density[0], density[2]) and densities == density[1]
+
+
+def test_roi_validation_is_opt_in(tmp_path):
+    path = tmp_path / "sheet.png"
+    cv2.imwrite(str(path), dense_sheet_with_marks(seed=6))
+    default = PaloDetector().analyze(str(path))
+    assert "roi_validation" not in default["run_meta"] and "validate_roi" not in default["run_meta"]["stage_timings_ms"]
+
+    detector = PaloDetector(dict(PaloDetector().config, validate_roi=True))
+    result = detector.analyze(str(path))
+    assert 0 <= result["run_meta"]["roi_validation"]["confidence_score"] <= 1
+    assert "validate_roi" in result["run_meta"]["stage_timings_ms"]
+    assert result["metrics"] == default["metrics"]
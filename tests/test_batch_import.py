@@ -0,0 +1,93 @@
+import importlib.util
+import io
+import zipfile
+
+import pytest
+
+import batch_import
+import blob_store
+import models
+import worker
+from test_corrections import client  # noqa: F401 (fixture)
+from test_uploads import png_bytes
+from test_worker_pool import create_sheet
+
+
+def zip_bytes(entries):
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w") as zf:
+        for name, data in entries.items():
+            zf.writestr(name, data)
+    return buf.getvalue()
+
+
+def test_zip_import_creates_queued_cases_in_one_request(client):
+    http, db = client
+    archive = zip_bytes({
+        "turma/cand_02.png": png_bytes(12),
+        "turma/cand_01.png": png_bytes(11),
+        "turma/leia-me.txt": b"lista de candidatos",
+        "__MACOSX/turma/._cand_01.png": b"\x00\x05\x16\x07",
+        "turma/.DS_Store": b"\x00",
+    })
+    r = http.post("/cases/import", files={"file": ("contratacao.zip", archive, "application/zip")},
+                  data={"patient_code_prefix": "RH"})
+    assert r.status_code == 201, r.text
+    body = r.json()
+    assert body["source_type"] == "zip" and body["total_items"] == 2
+    assert [s["name"] for s in body["skipped"]] == ["turma/leia-me.txt"]
+    assert body["progress"] == {"queued": 2, "processing": 0, "done": 0, "failed": 0, "total": 2, "percent": 0}
+
+    cases = db.query(models.Case).filter(models.Case.id.in_(body["case_ids"])).order_by(models.Case.id).all()
+    assert [c.patient_code for c in cases] == ["RH-cand_01", "RH-cand_02"]
+    for case in cases:
+        job = db.query(models.Job).filter(models.Job.case_id == case.id).one()
+        case_file = db.get(models.CaseFile, job.file_id)
+        assert job.status == models.JobStatus.QUEUED and case_file.case_id == case.id
+        assert case_file.content_hash and blob_store.path_of(db, case_file.content_hash).is_file()
+    assert not list(blob_store.INCOMING_DIR.glob("*.zip"))
+
+    listed = http.get("/cases", params={"batch_id": body["id"]}).json()
+    assert sorted(c["id"] for c in listed) == body["case_ids"]
+
+
+def test_batch_progress_aggregates_latest_jobs(client, tmp_path):
+    http, db = client
+    sheet = tmp_path / "sheet.png"
+    create_sheet(sheet)
+    r = http.post("/cases/import", files={"file": ("lote.zip", zip_bytes({"a.png": sheet.read_bytes(), "b.png": png_bytes(21)}), "application/zip")})
+    batch = r.json()
+    db.query(models.Job).filter(models.Job.case_id.notin_(batch["case_ids"]),
+                                models.Job.status == models.JobStatus.QUEUED).delete(synchronize_session=False)
+    db.commit()
+
+    first = worker.claim_next_job(db)
+    worker.process_vision_task(first)
+    progress = http.get(f"/imports/{batch['id']}").json()["progress"]
+    assert progress["done"] == 1 and progress["queued"] == 1 and progress["percent"] == 50
+    assert http.get("/imports/999999").status_code == 404
+
+
+@pytest.mark.parametrize("payload, code", [
+    (b"not an archive", 415),
+    (zip_bytes({"notas.txt": b"x"}), 422),
+    (b"PK\x03\x04 truncado", 400),
+])
+def test_rejected_imports(client, payload, code):
+    http, _ = client
+    r = http.post("/cases/import", files={"file": ("lote.zip", payload, "application/zip")})
+    assert r.status_code == code, r.text
+
+
+def test_item_limit(client, monkeypatch):
+    http, _ = client
+    monkeypatch.setattr(batch_import, "IMPORT_MAX_ITEMS", 2)
+    archive = zip_bytes({f"{i}.png": png_bytes(30 + i) for i in range(3)})
+    assert http.post("/cases/import", files={"file": ("lote.zip", archive, "application/zip")}).status_code == 413
+
+
+@pytest.mark.skipif(importlib.util.find_spec("pdf2image") is not None, reason="pdf2image instalado")
+def test_pdf_without_pdf2image_is_501(client):
+    http, _ = client
+    r = http.post("/cases/import", files={"file": ("lote.pdf", b"%PDF-1.7\n%%EOF", "application/pdf")})
+    assert r.status_code == 501
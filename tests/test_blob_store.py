@@ -0,0 +1,98 @@
+import json
+import os
+import time
+
+import pytest
+
+import blob_store
+import models
+from test_corrections import client, make_case  # noqa: F401 (fixture)
+from test_palo_set import synthetic_palos
+from test_uploads import png_bytes
+
+
+@pytest.fixture()
+def blobs(tmp_path, monkeypatch):
+    monkeypatch.setattr(blob_store, "BLOB_DIR", tmp_path / "blobs")
+    monkeypatch.setattr(blob_store, "INCOMING_DIR", tmp_path / "blobs" / "_incoming")
+    monkeypatch.setattr(blob_store, "DATASET_DIR", tmp_path / "dataset")
+    return tmp_path / "blobs"
+
+
+def ref_count(db, sha):
+    db.expire_all()
+    blob = db.get(models.Blob, sha)
+    return blob.ref_count if blob else None
+
+
+def test_put_bytes_dedups_and_gc_removes_unreferenced(client, blobs):
+    _, db = client
+    sha, path = blob_store.put_bytes(db, b"warped-1", ".png")
+    again, same = blob_store.put_bytes(db, b"warped-1", ".png")
+    db.commit()
+    assert (again, same) == (sha, path)
+    assert path.read_bytes() == b"warped-1" and ref_count(db, sha) == 2
+    assert [p for p in blobs.glob("**/*") if p.is_file()] == [path]
+
+    blob_store.release(db, sha)
+    db.commit()
+    blob_store.gc(db)
+    assert path.exists() and ref_count(db, sha) == 1
+
+    blob_store.release(db, sha)
+    blob_store.release(db, sha)  # não fica negativo
+    db.commit()
+    assert ref_count(db, sha) == 0
+    assert blob_store.gc(db, dry_run=True)["removed_blobs"] >= 1 and path.exists()
+    blob_store.gc(db)
+    assert not path.exists() and ref_count(db, sha) is None
+
+
+def test_gc_removes_old_orphan_files_only(client, blobs):
+    _, db = client
+    old = blob_store.blob_path("ab" * 32, ".png")
+    fresh = blob_store.blob_path("cd" * 32, ".png")
+    for p in (old, fresh):
+        p.parent.mkdir(parents=True, exist_ok=True)
+        p.write_bytes(b"orphan")
+    os.utime(old, (time.time() - 7200, time.time() - 7200))
+    result = blob_store.gc(db, grace_s=3600)
+    assert result["removed_orphans"] == 1
+    assert not old.exists() and fresh.exists()
+
+
+def test_link_to_shares_data(tmp_path):
+    src = tmp_path / "blob.png"
+    src.write_bytes(b"payload")
+    dest = tmp_path / "dataset" / "case_1_raw.png"
+    method = blob_store.link_to(src, dest)
+    assert dest.read_bytes() == b"payload"
+    assert method in ("reflink", "hardlink", "copy")
+    if method == "hardlink":
+        assert dest.stat().st_ino == src.stat().st_ino
+
+
+def test_upload_and_dataset_export_reference_one_blob(client, blobs):
+    http, db = client
+    data = png_bytes(7)
+    case_id = make_case(db, synthetic_palos(20, seed=1).to_dicts(), [])
+    other_id = make_case(db, [], [])
+    first = http.post(f"/cases/{case_id}/upload", files={"file": ("a.png", data, "image/png")}).json()
+    http.post(f"/cases/{other_id}/upload", files={"file": ("b.png", data, "image/png")})
+    sha = first["content_hash"]
+    assert ref_count(db, sha) == 2
+    assert [p.name for p in blobs.glob("*/*/*") if p.is_file()] == [f"{sha}.png"]
+    assert not list((blobs / "_incoming").iterdir())
+
+    url = http.get(f"/cases/{case_id}/file").json()["url"]
+    assert url.endswith(f"/storage/blobs/{sha[:2]}/{sha[2:4]}/{sha}.png")
+
+    for _ in range(2):  # reaprovação não conta referência duas vezes
+        assert http.post(f"/cases/{case_id}/dataset-approve").status_code == 200
+    dest = blob_store.DATASET_DIR / f"case_{case_id}_raw.png"
+    assert dest.read_bytes() == data
+    assert json.loads((blob_store.DATASET_DIR / f"case_{case_id}_meta.json").read_text())["image_sha256"] == sha
+    assert ref_count(db, sha) == 3
+
+    blob_store.recount(db)
+    assert ref_count(db, sha) == 3
@@ -0,0 +1,91 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import inspect
+
+import database
+import models
+import repository
+from test_corrections import client  # noqa: F401 (fixture)
+
+
+@pytest.fixture()
+def listing(client):
+    http, db = client
+    owner = models.User(name="l", email=f"list-{datetime.utcnow().timestamp()}@test.com", password_hash="x")
+    db.add(owner)
+    db.commit()
+    base = datetime(2025, 1, 1)
+    statuses = list(models.CaseStatus)
+    cases = []
+    for i in range(25):
+        # Pares com o mesmo created_at: o desempate por id precisa funcionar
+        cases.append(models.Case(patient_code=f"{'AB' if i % 3 else 'XY'}-{i:03d}", created_by=owner.id,
+                                 status=statuses[i % len(statuses)], created_at=base + timedelta(hours=i // 2)))
+    db.add_all(cases)
+    db.commit()
+    expected = sorted(cases, key=lambda c: (c.created_at, c.id), reverse=True)
+    return http, db, owner, expected
+
+
+def walk(http, params):
+    ids, cursor, totals = [], None, []
+    while True:
+        r = http.get("/cases", params=dict(params, **({"cursor": cursor} if cursor else {})))
+        assert r.status_code == 200, r.text
+        totals.append(r.headers.get("x-total-count"))
+        ids += [c["id"] for c in r.json()]
+        cursor = r.headers.get("x-next-cursor")
+        if not cursor:
+            return ids, totals
+
+
+def test_keyset_pages_cover_every_case_once(listing):
+    http, _, owner, expected = listing
+    ids, totals = walk(http, {"created_by": owner.id, "limit": 4})
+    assert ids == [c.id for c in expected]
+    assert totals[0] == "25" and set(totals[1:]) == {None}
+
+
+def test_filters(listing):
+    http, _, owner, expected = listing
+    ids, totals = walk(http, {"created_by": owner.id, "limit": 3, "status": ["done", "failed"], "patient_code": "AB"})
+    want = [c.id for c in expected if c.status in (models.CaseStatus.DONE, models.CaseStatus.FAILED) and c.patient_code.startswith("AB")]
+    assert ids == want and totals[0] == str(len(want))
+
+    r = http.get("/cases", params={"created_by": owner.id, "created_from": "2025-01-01T03:00:00", "created_to": "2025-01-01T05:00:00"})
+    assert [c["id"] for c in r.json()] == [c.id for c in expected if 3 <= c.created_at.hour < 5]
+    # '%' é literal no prefixo, não curinga
+    assert http.get("/cases", params={"created_by": owner.id, "patient_code": "%"}).json() == []
+
+
+def test_without_limit_or_cursor_returns_every_case(listing):
+    # Dashboard atual (frontend/app/cases) não pagina: acima de CASES_PAGE_SIZE nada pode sumir
+    http, db, owner, expected = listing
+    extra = [models.Case(patient_code=f"ZZ-{i:03d}", created_by=owner.id, created_at=datetime(2024, 1, 1))
+             for i in range(110)]
+    db.add_all(extra)
+    db.commit()
+    r = http.get("/cases", params={"created_by": owner.id})
+    assert len(r.json()) == 135 and "x-next-cursor" not in r.headers
+    assert [c["id"] for c in r.json()[:25]] == [c.id for c in expected]
+
+    # Só cursor: páginas de CASES_PAGE_SIZE
+    first = http.get("/cases", params={"created_by": owner.id, "limit": 10})
+    rest, _ = walk(http, {"created_by": owner.id, "cursor": first.headers["x-next-cursor"]})
+    assert len(rest) == 125
+
+
+def test_invalid_cursor_is_400(listing):
+    http, *_ = listing
+    assert http.get("/cases", params={"cursor": "nao-e-um-cursor"}).status_code == 400
+
+
+def test_listing_indexes_exist(client):
+    indexes = {ix["name"] for ix in inspect(database.engine).get_indexes("cases")}
+    assert {"ix_cases_created_at_id", "ix_cases_status_created_at_id", "ix_cases_created_by_created_at_id"} <= indexes
+
+
+def test_cursor_roundtrip():
+    ts = datetime(2025, 3, 4, 5, 6, 7, 123456)
+    assert repository.decode_cursor(repository.encode_cursor(ts, 42)) == (ts, 42)
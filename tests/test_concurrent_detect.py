@@ -0,0 +1,71 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import pytest
+
+import vision
+from vision import DetectionResult, PaloDetector
+from test_detect_palos_regression import dense_sheet_with_marks
+
+
+class Recorder:
+    def __init__(self):
+        self.stages = []
+
+    def update(self, stage, fraction):
+        self.stages.append(stage)
+
+    def flush(self):
+        pass
+
+
+@pytest.fixture(scope="module")
+def sheets(tmp_path_factory):
+    root = tmp_path_factory.mktemp("sheets")
+    paths = []
+    for seed in range(6):
+        path = root / f"sheet_{seed}.png"
+        cv2.imwrite(str(path), dense_sheet_with_marks(seed=seed))
+        paths.append(str(path))
+    return paths
+
+
+def comparable(result):
+    meta = {k: v for k, v in result["run_meta"].items() if k not in ("stage_timings_ms", "preprocess_timings_ms")}
+    return (result["roi"], result["palos"].to_dicts(), result["marks"], result["metrics"], meta,
+            [i.to_dicts() for i in result["intervals"]])
+
+
+def test_shared_detector_matches_sequential_runs(sheets):
+    expected = [comparable(PaloDetector().analyze(p)) for p in sheets]
+
+    shared = PaloDetector()
+    recorders = [Recorder() for _ in sheets]
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        results = list(pool.map(lambda args: shared.detect(args[0], progress=args[1]), zip(sheets, recorders)))
+
+    assert all(isinstance(r, DetectionResult) for r in results)
+    assert [comparable(r._asdict()) for r in results] == expected
+    # Cada run recebe só o próprio progresso; o detector não guarda estado
+    assert all(r.stages.count("roi") == 2 and r.stages[-1] == "metrics" for r in recorders)
+    assert shared.last_run_meta == {} and shared.last_marks == []
+
+
+def test_stages_take_explicit_run(sheets):
+    detector = PaloDetector()
+    run = vision.DetectionRun()
+    _, gray, processed = detector.preprocess(sheets[0], run=run)
+    roi = detector.detect_test_area(processed, run=run)
+    palos = detector.detect_palos(processed, gray, roi=roi, run=run)
+    intervals = detector.segment_intervals(detector.cluster_lines(palos, gray.shape[0]), marks=run.marks)
+    metrics = detector.calculate_metrics(intervals, run_meta=run.meta)
+
+    assert detector.last_run_meta == {} and "roi_confidence" in run.meta
+    assert metrics == PaloDetector().analyze(sheets[0])["metrics"]
+
+
+def test_analyze_keeps_legacy_state(sheets):
+    detector = PaloDetector()
+    result = detector.analyze(sheets[1])
+    assert detector.last_run_meta is result["run_meta"] and detector.last_marks is result["marks"]
+    assert vision.get_detector() is vision.get_detector()
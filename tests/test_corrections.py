@@ -0,0 +1,180 @@
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+import auth
+import corrections
+import database
+import main
+import models
+from vision import PaloDetector
+from test_palo_set import synthetic_palos
+
+
+def full_counts(palos, marks):
+    """Recontagem completa (caminho antigo: cluster + segment)."""
+    detector = PaloDetector()
+    detector.last_marks = marks
+    return [len(i) for i in detector.segment_intervals(detector.cluster_lines(palos, 0))]
+
+
+@pytest.mark.parametrize("n_marks", [0, 2, 4])
+def test_incremental_counts_match_full_recount(n_marks):
+    rng = np.random.default_rng(n_marks)
+    palos = synthetic_palos(600, seed=n_marks).to_dicts()
+    marks = [{"id": f"mark_{i+1}", "center": palos[j]["center"]} for i, j in enumerate(rng.choice(600, n_marks, replace=False))]
+    pool, current = palos[400:], palos[:400]
+    index = corrections.IntervalIndex.build(current, marks)
+
+    for step in range(200):
+        if rng.random() < 0.5 and pool:
+            p = pool.pop()
+            current.append(p)
+            index.add_palo(p)
+        else:
+            p = current.pop(int(rng.integers(len(current))))
+            index.remove_palo(p)
+        if step % 25 == 0:
+            assert index.counts == full_counts(current, marks)
+    assert index.counts == full_counts(current, marks)
+
+
+@pytest.fixture()
+def client():
+    models.Base.metadata.create_all(bind=database.engine)
+    db = database.SessionLocal()
+    user = db.query(models.User).filter(models.User.email == "corr@test.com").first()
+    if not user:
+        user = models.User(name="c", email="corr@test.com", password_hash="x")
+        db.add(user)
+        db.commit()
+    main.app.dependency_overrides[auth.get_current_user] = lambda: user
+    yield TestClient(main.app), db
+    main.app.dependency_overrides.clear()
+    db.close()
+
+
+def make_case(db, palos, marks, run_meta=None):
+    user = db.query(models.User).first()
+    case = models.Case(patient_code="C-1", created_by=user.id)
+    db.add(case)
+    db.commit()
+    # Arquivo inexistente: as correções não podem depender da imagem
+    db.add(models.CaseFile(case_id=case.id, original_file_url="/nao/existe.png", processed_images_urls={}, width=1000, height=1400))
+    roi_config = {"roi": [0, 0, 1000, 1400]}
+    if run_meta is not None:
+        roi_config["run_meta"] = run_meta
+    db.add(models.Detection(case_id=case.id, palo_objects={"palos": palos, "marks": marks}, roi_config=roi_config))
+    db.add(models.Metric(case_id=case.id, total_count=len(palos), by_interval={"counts": []},
+                         stats={"confidence_score": 90, "roi_source": "separator_line"},
+                         confidence_level="High", confidence_reasons={}))
+    db.commit()
+    return case.id
+
+
+def metric_of(db, case_id):
+    db.expire_all()
+    return db.query(models.Metric).filter(models.Metric.case_id == case_id).first()
+
+
+def test_delete_and_add_palo_update_metrics(client):
+    http, db = client
+    palos = synthetic_palos(200, seed=4).to_dicts()
+    marks = [{"id": "mark_1", "center": palos[50]["center"]}, {"id": "mark_2", "center": palos[120]["center"]}]
+    case_id = make_case(db, palos, marks, run_meta={"roi_confidence": 0.95, "roi_source": "separator_line"})
+
+    victim = palos[10]
+    r = http.delete(f"/cases/{case_id}/detections/items/{victim['id']}", params={"type": "palo"})
+    assert r.status_code == 200
+    metric = metric_of(db, case_id)
+    remaining = [p for p in palos if p["id"] != victim["id"]]
+    assert metric.total_count == 199
+    assert metric.by_interval["counts"] == full_counts(remaining, marks)
+    assert metric.stats["status"] == "success"
+
+    r = http.post(f"/cases/{case_id}/detections/items", params={"type": "palo"}, json=victim)
+    assert r.status_code == 200
+    assert metric_of(db, case_id).by_interval["counts"] == full_counts(palos, marks)
+
+    r = http.delete(f"/cases/{case_id}/detections/items/mark_2", params={"type": "mark"})
+    assert r.status_code == 200
+    assert metric_of(db, case_id).by_interval["counts"] == full_counts(palos, marks[:1])
+
+
+def test_legacy_detection_without_run_meta_uses_metric_stats(client):
+    http, db = client
+    palos = synthetic_palos(50, seed=5).to_dicts()
+    case_id = make_case(db, palos, [])
+    r = http.delete(f"/cases/{case_id}/detections/items/{palos[0]['id']}", params={"type": "palo"})
+    assert r.status_code == 200
+    metric = metric_of(db, case_id)
+    assert metric.total_count == 49
+    assert metric.stats["confidence_score"] == 90
+
+
+def test_batch_applies_all_operations_with_one_recompute(client):
+    http, db = client
+    palos = synthetic_palos(300, seed=6).to_dicts()
+    marks = [{"id": "mark_1", "center": palos[100]["center"]}, {"id": "mark_2", "center": palos[200]["center"]}]
+    case_id = make_case(db, palos, marks, run_meta={"roi_confidence": 0.95})
+
+    removed = {p["id"] for p in palos[:50]}
+    ops = [{"op": "remove", "type": "palo", "id": pid} for pid in removed]
+    ops.append({"op": "remove", "type": "palo", "id": "palo_inexistente"})
+    ops.append({"op": "move", "type": "palo", "id": palos[60]["id"], "center": [5.0, 5.0]})
+    ops.append({"op": "add", "type": "palo", "item": {"id": "manual_1", "center": [9999.0, 9999.0], "height": 40}})
+    r = http.post(f"/cases/{case_id}/detections/batch", json={"operations": ops})
+    assert r.status_code == 200, r.text
+    body = r.json()
+    assert body["applied"] == 52 and body["skipped"] == [50]
+
+    expected = [dict(p, center=[5.0, 5.0]) if p["id"] == palos[60]["id"] else p for p in palos if p["id"] not in removed]
+    expected.append({"id": "manual_1", "center": [9999.0, 9999.0], "height": 40})
+    assert body["metrics"]["intervals"] == full_counts(expected, marks)
+    assert metric_of(db, case_id).by_interval["counts"] == body["metrics"]["intervals"]
+    stored = db.query(models.Detection).filter(models.Detection.case_id == case_id).first().palo_objects["palos"]
+    assert [p["id"] for p in stored] == [p["id"] for p in expected]
+
+    # Marcas: mover e remover no mesmo lote, reatribuição única no final
+    ops = [{"op": "move", "type": "mark", "id": "mark_1", "center": palos[150]["center"]},
+           {"op": "remove", "type": "palo", "id": palos[299]["id"]},
+           {"op": "remove", "type": "mark", "id": "mark_2"}]
+    r = http.post(f"/cases/{case_id}/detections/batch", json={"operations": ops})
+    assert r.status_code == 200, r.text
+    final = [p for p in expected if p["id"] != palos[299]["id"]]
+    assert r.json()["metrics"]["intervals"] == full_counts(final, [{"id": "mark_1", "center": palos[150]["center"]}])
+
+
+def test_move_without_bbox_translates_it(client):
+    http, db = client
+    palos = synthetic_palos(40, seed=8).to_dicts()
+    marks = [{"id": "mark_1", "center": [100.0, 200.0], "bbox": [90, 190, 20, 20]}]
+    case_id = make_case(db, palos, marks, run_meta={"roi_confidence": 0.95})
+    target = palos[3]
+    (x, y, w, h), (cx, cy) = target["bbox"], target["center"]
+    ops = [{"op": "move", "type": "palo", "id": target["id"], "center": [cx + 7, cy - 4]},
+           {"op": "move", "type": "mark", "id": "mark_1", "center": [110.0, 195.0]},
+           {"op": "move", "type": "palo", "id": palos[4]["id"], "center": [1.0, 2.0], "bbox": [0, 0, 3, 5]}]
+    r = http.post(f"/cases/{case_id}/detections/batch", json={"operations": ops})
+    assert r.status_code == 200, r.text
+
+    db.expire_all()
+    objects = db.query(models.Detection).filter(models.Detection.case_id == case_id).first().palo_objects
+    stored = {p["id"]: p for p in objects["palos"]}
+    assert stored[target["id"]]["bbox"] == [x + 7, y - 4, w, h]
+    assert stored[palos[4]["id"]]["bbox"] == [0, 0, 3, 5]
+    assert objects["marks"][0]["bbox"] == [100.0, 185.0, 20, 20]
+
+
+def test_batch_is_atomic(client):
+    http, db = client
+    palos = synthetic_palos(40, seed=7).to_dicts()
+    case_id = make_case(db, palos, [], run_meta={"roi_confidence": 0.95})
+    ops = [{"op": "remove", "type": "palo", "id": palos[0]["id"]},
+           {"op": "move", "type": "palo", "id": "nao_existe", "center": [1, 2]}]
+    r = http.post(f"/cases/{case_id}/detections/batch", json={"operations": ops})
+    assert r.status_code == 400
+    db.expire_all()
+    detection = db.query(models.Detection).filter(models.Detection.case_id == case_id).first()
+    assert len(detection.palo_objects["palos"]) == 40
+    assert metric_of(db, case_id).total_count == 40
@@ -0,0 +1,59 @@
+import threading
+
+import cv2
+import numpy as np
+import pytest
+
+import cv_resources
+
+
+@pytest.fixture()
+def binary():
+    rng = np.random.default_rng(0)
+    return ((rng.random((120, 160)) > 0.6) * 255).astype(np.uint8)
+
+
+def test_kernels_are_shared_read_only_and_match_literals(binary):
+    kernel = cv_resources.structuring_element((2, 2))
+    assert kernel is cv_resources.structuring_element((2, 2))
+    assert not kernel.flags.writeable
+    np.testing.assert_array_equal(kernel, np.ones((2, 2), np.uint8))
+    # Coluna 1x3 equivale ao kernel 3x3 antigo com só a coluna central
+    v_literal = np.array([[0, 1, 0], [0, 1, 0], [0, 1, 0]], dtype=np.uint8)
+    np.testing.assert_array_equal(cv2.dilate(binary, cv_resources.structuring_element((1, 3)), iterations=2),
+                                  cv2.dilate(binary, v_literal, iterations=2))
+
+
+def test_clahe_is_reused_per_thread(binary):
+    clahe = cv_resources.clahe(2.0, (8, 8))
+    assert clahe is cv_resources.clahe(2, [8, 8])
+    assert clahe is not cv_resources.clahe(3.0, (10, 10))
+    np.testing.assert_array_equal(clahe.apply(binary), cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8)).apply(binary))
+
+    other = []
+    thread = threading.Thread(target=lambda: other.append(cv_resources.clahe(2.0, (8, 8))))
+    thread.start()
+    thread.join()
+    assert other[0] is not clahe
+
+
+@pytest.fixture()
+def restore_cv_threads():
+    threads, optimized = cv2.getNumThreads(), cv2.useOptimized()
+    yield
+    cv2.setNumThreads(threads)
+    cv2.setUseOptimized(optimized)
+
+
+def test_configure_process(monkeypatch, restore_cv_threads):
+    monkeypatch.setattr(cv_resources.os, "cpu_count", lambda: 8)
+    monkeypatch.setattr(cv_resources, "CV_THREADS", "")
+    assert cv_resources.threads_per_process(3) == 2 and cv_resources.threads_per_process(16) == 1
+
+    cv_resources.configure_process(4)
+    assert cv2.getNumThreads() == 2 and cv2.useOptimized()
+
+    monkeypatch.setattr(cv_resources, "CV_THREADS", "1")
+    monkeypatch.setattr(cv_resources, "CV_USE_OPTIMIZED", False)
+    cv_resources.configure_process(2)
+    assert cv2.getNumThreads() == 1 and not cv2.useOptimized()
@@ -0,0 +1,139 @@
+"""
+Regressão do detect_palos vetorizado: as features em lote devem produzir
+exatamente os mesmos dicts de palos, marcas e metadados que o loop por
+contorno anterior (copiado abaixo como referência).
+"""
+
+import cv2
+import numpy as np
+import pytest
+
+from vision import PaloDetector
+from tests_adaptive_robustness import create_realistic_test_sheet
+
+
+def legacy_detect_palos(detector, processed_img, gray_img, roi=None, relaxed=False):
+    height, width = processed_img.shape
+    x_roi, y_roi, w_roi, h_roi = roi if roi else [0, 0, width, height]
+    mask = np.zeros_like(processed_img)
+    mask[y_roi:y_roi+h_roi, x_roi:x_roi+w_roi] = 255
+    roi_processed_working = cv2.bitwise_and(processed_img, mask)
+    contours, _ = cv2.findContours(roi_processed_working, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+    temp_palos, temp_marks = [], []
+    discarded_outside = 0
+    discarded_reason = {}
+    for cnt in contours:
+        x, y, w, h = cv2.boundingRect(cnt)
+        center_y = y + h/2
+        center_x = x + w/2
+        if not (y_roi <= center_y <= y_roi + h_roi and x_roi <= center_x <= x_roi + w_roi):
+            discarded_outside += 1
+            reason = "OUTSIDE_ROI_TOPZONE" if center_y < y_roi else "OUTSIDE_ROI_OTHER"
+            discarded_reason[reason] = discarded_reason.get(reason, 0) + 1
+            continue
+        area = cv2.contourArea(cnt)
+        if area < 15: continue
+        aspect_ratio = h / float(w) if w > 0 else 0
+        if w > (width * 0.20): continue
+        if 0.05 < aspect_ratio < 0.3 and 15 < w < (width * 0.12) and h >= 4:
+            if (y_roi + h_roi * 0.05) < center_y < (y_roi + h_roi * 0.95):
+                temp_marks.append({
+                    "id": f"mark_{len(temp_marks)+1}",
+                    "center": [float(x + w/2), float(y + h/2)],
+                    "bbox": [int(x), int(y), int(w), int(h)],
+                    "type": "interval_mark"
+                })
+            continue
+        min_aspect = 1.1 if relaxed else 1.8
+        if min_aspect < aspect_ratio < 70.0 and (height * 0.005) < h < (height * 0.4):
+            if y < y_roi + (h_roi * 0.02):
+                discarded_outside += 1
+                discarded_reason["OUTSIDE_ROI_TOPZONE"] = discarded_reason.get("OUTSIDE_ROI_TOPZONE", 0) + 1
+                continue
+            rect = cv2.minAreaRect(cnt)
+            raw_angle = rect[2]
+            rect_w, rect_h = rect[1]
+            normalized_angle = (90 + raw_angle) if rect_w > rect_h else (90 - abs(raw_angle))
+            arc_len = cv2.arcLength(cnt, False)
+            dist_ends = np.sqrt(w**2 + h**2)
+            tortuosity = (arc_len / (2 * dist_ends)) if dist_ends > 0 else 1.0
+            hook_top = hook_bottom = "none"
+            palo_roi = gray_img[y:y+h, x:x+w]
+            if h > 20 and palo_roi.size > 0:
+                hook_top = PaloDetector._hook_side(palo_roi[:max(1, h//5), :], w)
+                hook_bottom = PaloDetector._hook_side(palo_roi[-max(1, h//5):, :], w)
+            temp_palos.append({
+                "id": f"palo_{len(temp_palos)+1}",
+                "center": [float(x + w/2), float(y + h/2)],
+                "bbox": [int(x), int(y), int(w), int(h)],
+                "height": float(h),
+                "width": float(w),
+                "angle": float(normalized_angle),
+                "tortuosity": float(tortuosity),
+                "pressure": float(255 - np.mean(gray_img[y:y+h, x:x+w])),
+                "hooks": {"top": hook_top, "bottom": hook_bottom}
+            })
+    meta = {
+        "total_detected_raw": len(temp_palos) + discarded_outside,
+        "total_kept_in_roi": len(temp_palos),
+        "total_discarded_outside_roi": discarded_outside,
+        "discard_reasons": discarded_reason,
+    }
+    return temp_palos, temp_marks, meta
+
+
+def dense_sheet_with_marks(seed=7):
+    """Folha densa com palos tortos, ganchos, marcas de intervalo e ruído no cabeçalho."""
+    rng = np.random.default_rng(seed)
+    img = np.full((1414, 1000, 3), 250, dtype=np.uint8)
+    cv2.line(img, (50, 300), (950, 300), (0, 0, 0), 2)
+    for _ in range(40):
+        x1, y1 = rng.integers(50, 950), rng.integers(40, 280)
+        cv2.line(img, (int(x1), int(y1)), (int(x1 + rng.integers(-20, 20)), int(y1 + rng.integers(5, 40))), (40, 40, 40), 2)
+    for row in range(7):
+        y_base = 340 + row * 140
+        for col in range(38):
+            x = 60 + col * 23 + int(rng.integers(-3, 4))
+            top = (x + int(rng.integers(-4, 5)), y_base + int(rng.integers(-6, 6)))
+            bottom = (x + int(rng.integers(-4, 5)), y_base + 45 + int(rng.integers(-8, 8)))
+            cv2.line(img, top, bottom, (10, 10, 10), int(rng.integers(1, 4)))
+            if rng.random() < 0.2:
+                cv2.line(img, bottom, (bottom[0] + 8, bottom[1] - 4), (10, 10, 10), 2)
+        cv2.line(img, (120 + row * 90, y_base + 90), (160 + row * 90, y_base + 90), (0, 0, 0), 1)
+    noise = rng.normal(0, 6, img.shape)
+    return np.clip(img.astype(float) + noise, 0, 255).astype(np.uint8)
+
+
+SHEETS = {
+    "normal": lambda: create_realistic_test_sheet(condition="normal"),
+    "shadows": lambda: create_realistic_test_sheet(condition="shadows"),
+    "rotated": lambda: create_realistic_test_sheet(condition="rotated"),
+    "dense": dense_sheet_with_marks,
+}
+
+
+@pytest.mark.parametrize("sheet", sorted(SHEETS))
+@pytest.mark.parametrize("relaxed", [False, True])
+@pytest.mark.parametrize("use_roi", [True, False])
+def test_vectorised_detect_palos_matches_legacy(sheet, relaxed, use_roi):
+    detector = PaloDetector()
+    _, gray, processed = detector.preprocess_image(SHEETS[sheet]())
+    roi = detector.detect_test_area(processed) if use_roi else None
+
+    palos = detector.detect_palos(processed, gray, roi=roi, relaxed=relaxed)
+    legacy_palos, legacy_marks, legacy_meta = legacy_detect_palos(detector, processed, gray, roi=roi, relaxed=relaxed)
+
+    assert palos.to_dicts() == legacy_palos
+    assert detector.last_marks == legacy_marks
+    for key, value in legacy_meta.items():
+        assert detector.last_run_meta[key] == value
+    assert list(detector.last_run_meta["discard_reasons"]) == list(legacy_meta["discard_reasons"])
+
+
+def test_contour_features_match_opencv():
+    _, _, processed = PaloDetector().preprocess_image(dense_sheet_with_marks(seed=3))
+    contours, _ = cv2.findContours(processed, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    x, y, w, h, area = PaloDetector.contour_features(contours)
+    assert [tuple(r) for r in np.stack([x, y, w, h], axis=1).tolist()] == [cv2.boundingRect(c) for c in contours]
+    assert area.tolist() == [cv2.contourArea(c) for c in contours]
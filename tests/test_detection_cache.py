@@ -0,0 +1,136 @@
+import os
+import time
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+import database
+import detection_cache
+import models
+import worker
+from detection_cache import DetectionCache
+from vision import PaloDetector, PaloSet
+from test_worker_pool import create_sheet, db, make_job  # noqa: F401 (fixture)
+
+
+def entry(palos=None):
+    palos = palos if palos is not None else PaloSet.from_dicts([{"id": "palo_1", "center": [1.5, 2.5]}])
+    return dict(warped_bytes=os.urandom(2048), warped_ext=".png", roi=[0, 10, 100, 200], palos=palos,
+                marks=[{"id": "mark_1", "center": [5.0, 6.0]}], metrics={"total": 1, "nor": np.float64(2.5)},
+                run_meta={"roi_confidence": 0.9}, image_dims=[100, 200])
+
+
+def test_key_depends_on_bytes_and_config(tmp_path):
+    a, b = tmp_path / "a.png", tmp_path / "b.png"
+    a.write_bytes(b"same")
+    b.write_bytes(b"same")
+    config = PaloDetector().config
+    assert DetectionCache.key_for_file(a, config) == DetectionCache.key_for_file(b, config)
+    assert DetectionCache.key_for_file(a, dict(config, min_area=21)) != DetectionCache.key_for_file(a, config)
+    b.write_bytes(b"other")
+    assert DetectionCache.key_for_file(a, config) != DetectionCache.key_for_file(b, config)
+
+
+# Campos do run_meta que o cache guarda, por versão do pipeline. Se este teste
+# falhar, a saída mudou: incremente vision.PIPELINE_VERSION e atualize aqui
+# (entradas antigas do cache não teriam os campos novos).
+CACHED_RUN_META = ("5", {
+    "roi_source", "roi_confidence", "separator_found", "top_cutoff_applied", "roi_rect", "separator_detector",
+    "adaptive_cutoff_y", "density_profile", "preprocess_timings_ms", "total_detected_raw", "total_kept_in_roi",
+    "total_discarded_outside_roi", "discard_reasons", "stage_timings_ms",
+})
+
+
+def test_run_meta_fields_match_pipeline_version(tmp_path):
+    import vision
+    path = tmp_path / "sheet.png"
+    create_sheet(path)
+    assert (vision.PIPELINE_VERSION, set(PaloDetector().analyze(str(path))["run_meta"])) == CACHED_RUN_META
+
+
+def test_roundtrip_and_stats(tmp_path):
+    cache = DetectionCache(tmp_path, max_mb=1)
+    assert cache.get("ab" * 32) is None
+    data = entry()
+    cache.put("ab" * 32, **data)
+    hit = cache.get("ab" * 32)
+    assert hit["warped_bytes"] == data["warped_bytes"]
+    assert hit["palos"].to_dicts() == data["palos"].to_dicts()
+    assert hit["metrics"] == {"total": 1, "nor": 2.5}
+    assert hit["roi"] == data["roi"] and hit["marks"] == data["marks"]
+
+    # Outro processo (outra instância) soma nas mesmas estatísticas
+    stats = DetectionCache(tmp_path, max_mb=1).stats()
+    assert (stats["hits"], stats["misses"], stats["entries"]) == (1, 1, 1)
+    assert stats["hit_ratio"] == 0.5
+
+
+def count_hits(root, n):
+    cache = DetectionCache(root, max_mb=1)
+    for _ in range(n):
+        cache._count("hits")
+
+
+def test_stats_single_file_shared_by_processes(tmp_path):
+    import multiprocessing
+    ctx = multiprocessing.get_context("fork")
+    procs = [ctx.Process(target=count_hits, args=(tmp_path, 50)) for _ in range(4)]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join()
+    # Totais exatos com escritas concorrentes; processos novos continuam a soma
+    assert DetectionCache(tmp_path, max_mb=1).stats()["hits"] == 200
+    count_hits(tmp_path, 1)
+    assert DetectionCache(tmp_path, max_mb=1).stats()["hits"] == 201
+    assert [f.name for f in tmp_path.glob("_stats*.json")] == ["_stats.json"]
+
+
+def test_lru_eviction_by_size(tmp_path):
+    cache = DetectionCache(tmp_path, max_mb=0.02)  # ~20 KB: cabem 3 entradas de ~5.4 KB
+    keys = [f"{i:02d}" * 32 for i in range(6)]
+    past = time.time() - 100
+    for i, key in enumerate(keys):
+        cache.put(key, **entry())
+        os.utime(cache._entry_path(key), (past + i, past + i))
+        if i == 2:
+            assert cache.get(keys[0]) is not None  # hit: keys[0] vira a mais recente
+    remaining = {p.stem for p in tmp_path.glob("*/*.npz")}
+    assert sum(p.stat().st_size for p in tmp_path.glob("*/*.npz")) <= cache.max_bytes
+    assert remaining == {keys[0], keys[4], keys[5]}
+    assert cache.stats()["evictions"] == 3
+
+
+def test_corrupt_entry_is_a_miss(tmp_path):
+    cache = DetectionCache(tmp_path, max_mb=1)
+    path = cache._entry_path("cd" * 32)
+    path.parent.mkdir(parents=True)
+    path.write_bytes(b"not a npz")
+    assert cache.get("cd" * 32) is None
+    assert not path.exists()
+
+
+def test_reprocess_hits_cache(db, tmp_path, monkeypatch):
+    monkeypatch.setattr(detection_cache, "_default_cache", DetectionCache(tmp_path / "cache", max_mb=64))
+    image = tmp_path / "sheet.png"
+    create_sheet(image)
+
+    results = []
+    for _ in range(2):
+        job_id = make_job(db, image)
+        assert worker.claim_next_job(db) == job_id
+        worker.process_vision_task(job_id)
+        db.expire_all()
+        job = db.get(models.Job, job_id)
+        assert job.status == models.JobStatus.DONE, job.error_message
+        detection = db.query(models.Detection).filter(models.Detection.case_id == job.case_id).first()
+        metric = db.query(models.Metric).filter(models.Metric.case_id == job.case_id).first()
+        case_file = db.get(models.CaseFile, job.file_id)
+        warped = Path(case_file.processed_images_urls["warped"]).read_bytes()
+        results.append((job.current_step, detection.palo_objects, detection.roi_config, metric.by_interval, metric.stats, warped))
+
+    assert results[0][1:] == results[1][1:]
+    assert results[1][0] == "concluido"
+    stats = detection_cache.get_cache().stats()
+    assert (stats["hits"], stats["misses"], stats["stores"]) == (1, 1, 1)
@@ -0,0 +1,94 @@
+import json
+import threading
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+import auth
+import database
+import job_events
+import main
+import models
+
+
+@pytest.fixture()
+def job_setup(monkeypatch):
+    models.Base.metadata.create_all(bind=database.engine)
+    monkeypatch.setattr(job_events.hub, "poll_interval", 0.05)
+    db = database.SessionLocal()
+    user = db.query(models.User).filter(models.User.email == "events@test.com").first()
+    if not user:
+        user = models.User(name="e", email="events@test.com", password_hash="x")
+        db.add(user)
+        db.commit()
+    case = models.Case(patient_code="E-1", created_by=user.id)
+    db.add(case)
+    db.commit()
+    job = models.Job(case_id=case.id, status=models.JobStatus.PROCESSING, progress=10, current_step="preprocess")
+    db.add(job)
+    db.commit()
+    token = auth.create_access_token({"sub": user.email})
+    yield TestClient(main.app), {"Authorization": f"Bearer {token}"}, token, case.id, job.id
+    db.close()
+
+
+def update_job_later(job_id, steps, delay=0.2):
+    def run():
+        for values in steps:
+            time.sleep(delay)
+            db = database.SessionLocal()
+            db.query(models.Job).filter(models.Job.id == job_id).update(values)
+            db.commit()
+            db.close()
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread
+
+
+def test_long_poll_returns_304_until_progress_changes(job_setup):
+    http, headers, _, case_id, job_id = job_setup
+    url = f"/cases/{case_id}/jobs/latest"
+    assert http.get(url).status_code == 401
+
+    first = http.get(url, headers=headers)
+    assert first.status_code == 200 and first.json()["progress"] == 10
+    etag = first.headers["etag"]
+    assert http.get(url, headers={**headers, "If-None-Match": etag}).status_code == 304
+    assert http.get(url, params={"wait": 0.3}, headers={**headers, "If-None-Match": etag}).status_code == 304
+
+    thread = update_job_later(job_id, [{"progress": 40, "current_step": "detect"}])
+    start = time.monotonic()
+    r = http.get(url, params={"wait": 10}, headers={**headers, "If-None-Match": etag})
+    thread.join()
+    assert r.status_code == 200 and time.monotonic() - start < 5
+    assert r.json()["progress"] == 40 and r.headers["etag"] != etag
+
+
+def test_sse_streams_until_done(job_setup):
+    http, _, token, case_id, job_id = job_setup
+    thread = update_job_later(job_id, [
+        {"progress": 60, "current_step": "metrics"},
+        {"progress": 100, "status": models.JobStatus.DONE, "current_step": "concluido"},
+    ])
+    events = []
+    with http.stream("GET", f"/cases/{case_id}/jobs/latest/events", params={"access_token": token}) as r:
+        assert r.headers["content-type"].startswith("text/event-stream")
+        for line in r.iter_lines():
+            if line.startswith("data: "):
+                events.append(json.loads(line[6:]))
+    thread.join()
+    progress = [e["progress"] for e in events]
+    assert progress[0] == 10 and progress[-1] == 100 and 60 in progress
+    assert events[-1]["status"] == "done"
+
+
+def test_fetch_latest_picks_newest_job_per_case(job_setup):
+    _, _, _, case_id, job_id = job_setup
+    db = database.SessionLocal()
+    newer = models.Job(case_id=case_id, status=models.JobStatus.QUEUED)
+    db.add(newer)
+    db.commit()
+    latest = job_events.fetch_latest([case_id, 999999])
+    assert list(latest) == [case_id] and latest[case_id][1]["id"] == newer.id
+    db.close()
@@ -0,0 +1,63 @@
+import json
+
+import pytest
+
+import palo_batch
+from test_worker_pool import create_sheet
+
+
+@pytest.fixture()
+def scans(tmp_path):
+    root = tmp_path / "scans"
+    (root / "2023").mkdir(parents=True)
+    for name in ("a.png", "2023/b.png", "2023/c.png"):
+        create_sheet(root / name)
+    (root / "2023" / "corrompido.png").write_bytes(b"nao e imagem")
+    (root / "notas.txt").write_text("x")
+    return root
+
+
+def test_collect_inputs_dirs_globs_and_files(scans):
+    from_dir = palo_batch.collect_inputs([str(scans)])
+    assert [p.name for p in from_dir] == ["b.png", "c.png", "corrompido.png", "a.png"]
+    mixed = palo_batch.collect_inputs([str(scans / "**" / "[bc].png"), str(scans / "a.png"), str(scans / "a.png"), "nao/existe"])
+    assert [p.name for p in mixed] == ["b.png", "c.png", "a.png"]
+
+
+def read_jsonl(path):
+    return {r["path"].rsplit("/", 1)[-1]: r for r in map(json.loads, path.read_text().splitlines())}
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_run_batch_streams_records_and_summary(scans, tmp_path, workers):
+    out = tmp_path / f"out-{workers}.jsonl"
+    writer = palo_batch.JsonlWriter(str(out))
+    summary = palo_batch.run_batch(palo_batch.collect_inputs([str(scans)]), writer, workers=workers, progress_every=0)
+    writer.close()
+
+    records = read_jsonl(out)
+    assert set(records) == {"a.png", "b.png", "c.png", "corrompido.png"}
+    assert records["corrompido.png"]["status"] == "error"
+    ok = records["a.png"]
+    assert ok["status"] == "ok" and ok["total"] == sum(ok["intervals"]) == ok["n_palos"] > 0
+    assert {"preprocess", "detect_test_area", "detect_palos", "segment", "metrics"} <= set(ok["timings_ms"])
+    assert (summary["images"], summary["ok"], summary["errors"]) == (4, 3, 1)
+    assert summary["images_per_s"] > 0 and set(summary["stage_mean_ms"]) == {"preprocess", "detect_test_area", "detect_palos", "segment", "metrics"}
+
+
+def test_main_cli(scans, tmp_path, capsys):
+    out = tmp_path / "cli.jsonl"
+    assert palo_batch.main([str(scans / "a.png"), "-o", str(out), "--workers", "1"]) == 0
+    assert len(out.read_text().splitlines()) == 1
+    assert "img/s" in capsys.readouterr().err
+    assert palo_batch.main([str(scans), "-o", str(out), "--workers", "1"]) == 2  # uma imagem com erro
+
+
+def test_parquet_output(scans, tmp_path):
+    pq = pytest.importorskip("pyarrow.parquet")
+    out = tmp_path / "out.parquet"
+    writer = palo_batch.ParquetWriter(str(out), row_group=2)
+    palo_batch.run_batch(palo_batch.collect_inputs([str(scans)]), writer, workers=1, progress_every=0)
+    writer.close()
+    table = pq.read_table(out)
+    assert table.num_rows == 4 and "timings_ms" in table.column_names
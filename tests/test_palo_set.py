@@ -0,0 +1,154 @@
+"""
+PaloSet (structure-of-arrays) vs. o pipeline antigo em listas de dicts:
+cluster_lines / segment_intervals / calculate_metrics devem agrupar os mesmos
+palos, e to_dicts() deve reproduzir o JSON persistido.
+"""
+
+import numpy as np
+import pytest
+
+from utils import jsonify_dict
+from vision import PaloDetector, PaloSet
+from test_detect_palos_regression import SHEETS
+
+
+def legacy_cluster_lines(palos):
+    if not palos: return []
+    sorted_palos = sorted(palos, key=lambda p: p["center"][1])
+    avg_h = sum(p["height"] for p in palos) / len(palos)
+    y_tolerance = avg_h * 0.6
+    lines = []
+    current_line = [sorted_palos[0]]
+    for p in sorted_palos[1:]:
+        y_dist = abs(p["center"][1] - np.mean([x["center"][1] for x in current_line]))
+        if y_dist < y_tolerance:
+            current_line.append(p)
+        else:
+            current_line.sort(key=lambda x: x["center"][0])
+            lines.append(current_line)
+            current_line = [p]
+    if current_line:
+        current_line.sort(key=lambda x: x["center"][0])
+        lines.append(current_line)
+    return lines
+
+
+def legacy_segment_intervals(lines, marks, total_intervals=5):
+    if not lines: return [[] for _ in range(total_intervals)]
+    palos_ordered = [p for line in lines for p in line]
+    if not marks:
+        chunk_size = max(1, len(palos_ordered) // total_intervals)
+        return [palos_ordered[i*chunk_size:(i+1)*chunk_size if i<4 else None] for i in range(total_intervals)]
+    delimiters = sorted(marks[:4], key=lambda m: (m["center"][1], m["center"][0]))
+    intervals = [[] for _ in range(total_intervals)]
+    for palo in palos_ordered:
+        p_x, p_y = palo["center"]
+        interval_idx = 0
+        for i, mark in enumerate(delimiters):
+            m_x, m_y = mark["center"]
+            line_tol = palo.get("height", 30) * 0.6
+            if p_y < m_y - line_tol or (abs(p_y - m_y) <= line_tol and p_x < m_x):
+                interval_idx = i
+                break
+            else:
+                interval_idx = i + 1
+        intervals[min(interval_idx, total_intervals - 1)].append(palo)
+    return intervals
+
+
+def ids(groups):
+    return [[p["id"] for p in g] for g in groups]
+
+
+@pytest.fixture(scope="module", params=sorted(SHEETS))
+def detected(request):
+    detector = PaloDetector()
+    _, gray, processed = detector.preprocess_image(SHEETS[request.param]())
+    palos = detector.detect_palos(processed, gray, roi=detector.detect_test_area(processed))
+    return detector, palos
+
+
+def test_to_dicts_roundtrip(detected):
+    _, palos = detected
+    assert isinstance(palos, PaloSet)
+    as_dicts = palos.to_dicts()
+    assert jsonify_dict({"palos": palos}) == {"palos": as_dicts}
+    assert PaloSet.from_dicts(as_dicts).to_dicts() == as_dicts
+    assert [p["id"] for p in as_dicts] == [f"palo_{i+1}" for i in range(len(palos))]
+
+
+@pytest.mark.parametrize("with_marks", [True, False])
+def test_pipeline_matches_dict_version(detected, with_marks):
+    detector, palos = detected
+    as_dicts = palos.to_dicts()
+    # Marcas sintéticas entre as linhas para exercitar o caminho com delimitadores
+    ys = sorted(p["center"][1] for p in as_dicts)
+    marks = [{"center": [float(300 + 100 * k), ys[len(ys) * (k + 1) // 5]]} for k in range(4)] if with_marks else []
+
+    detector.last_marks = marks
+    lines = detector.cluster_lines(palos, img_height=2000)
+    legacy_lines = legacy_cluster_lines(as_dicts)
+    assert ids(l.to_dicts() for l in lines) == ids(legacy_lines)
+
+    intervals = detector.segment_intervals(lines)
+    legacy_intervals = legacy_segment_intervals(legacy_lines, marks)
+    assert ids(i.to_dicts() for i in intervals) == ids(legacy_intervals)
+
+    # Dicts (edições manuais) e PaloSet passam pelo mesmo caminho
+    assert ids(i.to_dicts() for i in detector.segment_intervals(detector.cluster_lines(as_dicts, 2000))) == ids(legacy_intervals)
+
+    detector.last_run_meta["roi_confidence"] = 0.9
+    metrics = detector.calculate_metrics(intervals)
+    assert metrics["status"] == "success"
+    assert metrics["intervals"] == [len(i) for i in legacy_intervals]
+
+
+def test_from_dicts_accepts_partial_manual_items():
+    palos = PaloSet.from_dicts([
+        {"id": "manual_1", "center": [10, 20]},
+        {"id": 7, "center": [30.5, 40], "bbox": [28, 20, 5, 40], "height": 40, "hooks": {"top": "left"}},
+    ])
+    out = palos.to_dicts()
+    assert [p["id"] for p in out] == ["manual_1", 7]
+    assert out[0]["height"] == 30 and out[1]["hooks"] == {"top": "left", "bottom": "none"}
+    assert PaloSet.concat([palos.take([1]), PaloSet.empty(2)]).id_labels() == [7, "palo_1", "palo_2"]
+
+
+def synthetic_palos(n, seed=0):
+    """Grade de palos com jitter vertical (centros meio-inteiros, como no detector)."""
+    rng = np.random.default_rng(seed)
+    per_line = 40
+    rows, cols = np.divmod(np.arange(n), per_line)
+    h = rng.integers(30, 60, n)
+    y = rows * 120 + rng.integers(-12, 12, n)
+    x = cols * 25 + rng.integers(-3, 3, n)
+    w = rng.integers(2, 8, n)
+    palos = PaloSet.empty(n)
+    palos.bbox[:] = np.stack([x, y, w, h], axis=1)
+    palos.center[:] = np.stack([x + w / 2, y + h / 2], axis=1)
+    palos.height[:] = h
+    palos.width[:] = w
+    return palos.take(rng.permutation(n))
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_cluster_lines_matches_legacy_on_large_sets(seed):
+    palos = synthetic_palos(4000, seed)
+    lines = PaloDetector().cluster_lines(palos, img_height=15000)
+    assert ids(l.to_dicts() for l in lines) == ids(legacy_cluster_lines(palos.to_dicts()))
+
+
+@pytest.mark.parametrize("n_marks", [1, 2, 4, 6])
+def test_segment_intervals_matches_legacy_with_random_marks(n_marks):
+    rng = np.random.default_rng(n_marks)
+    palos = synthetic_palos(3000, seed=n_marks)
+    detector = PaloDetector()
+    lines = detector.cluster_lines(palos, img_height=10000)
+    # Marcas no meio das linhas, inclusive coincidindo com a coordenada de palos
+    centers = palos.center[rng.choice(len(palos), n_marks, replace=False)]
+    marks = [{"center": [float(x), float(y)]} for x, y in centers]
+
+    detector.last_marks = marks
+    intervals = detector.segment_intervals(lines)
+    legacy = legacy_segment_intervals([l.to_dicts() for l in lines], marks)
+    assert ids(i.to_dicts() for i in intervals) == ids(legacy)
@@ -0,0 +1,24 @@
+import cv2
+import numpy as np
+
+from benchmark_preprocess import create_a4_photo
+from vision import PaloDetector
+
+
+def test_paper_downscale_is_opt_in():
+    img, truth = create_a4_photo(150, return_corners=True)
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+
+    exact = PaloDetector()
+    assert exact.config["paper_detect_max_side"] is None
+    timings = {}
+    rect = exact.locate_paper(img, gray=gray, timings=timings)
+    assert "paper_downscale" not in timings and "paper_refine" not in timings
+
+    multi = PaloDetector(dict(exact.config, paper_detect_max_side=600))
+    timings = {}
+    rect_multi = multi.locate_paper(img, gray=gray, timings=timings)
+    assert "paper_refine" in timings
+    # Modo reduzido: cantos a poucos pixels da busca em resolução total
+    assert np.max(np.linalg.norm(rect_multi - rect, axis=1)) <= 3
+    assert np.max(np.linalg.norm(rect - truth, axis=1)) <= 3
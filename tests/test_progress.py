@@ -0,0 +1,86 @@
+import detection_cache
+import models
+import progress
+import worker
+from detection_cache import DetectionCache
+from progress import ProgressReporter
+from test_worker_pool import create_sheet, db, make_job  # noqa: F401 (fixture)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return self.now
+
+
+def test_updates_are_coalesced_per_interval():
+    clock, writes = FakeClock(), []
+    reporter = ProgressReporter(lambda *a: writes.append(a), flush_ms=500, progress=10, step="preprocess", clock=clock)
+    for i in range(100):
+        reporter.update("preprocess", i / 100)
+    assert writes == []  # ainda dentro do primeiro intervalo
+    clock.now = 0.6
+    reporter.update("detect", 0.5)
+    assert writes == [(42, "detect")]
+    clock.now = 0.8
+    reporter.update("detect", 1.0)
+    assert len(writes) == 1 and reporter.progress == 55
+    reporter.flush()
+    reporter.flush()  # sem mudança pendente não grava de novo
+    assert writes == [(42, "detect"), (55, "detect")]
+
+
+def test_progress_never_goes_back_and_repeats_skip_the_clock():
+    clock, writes = FakeClock(), []
+    reporter = ProgressReporter(lambda *a: writes.append(a), flush_ms=0, clock=clock)
+    reporter.update("detect", 0.8)
+    reporter.update("detect", 0.2)
+    assert reporter.progress == 50
+    calls = clock.calls
+    for _ in range(1000):
+        reporter.update("detect", 0.8)
+    assert clock.calls == calls and writes == [(50, "detect")]
+
+
+def test_write_failure_does_not_raise():
+    def broken(*_):
+        raise RuntimeError("banco fora")
+    reporter = ProgressReporter(broken, flush_ms=0)
+    reporter.update("metrics", 1.0)
+    assert reporter.flushes == 1
+
+
+def test_worker_reports_substeps_with_bounded_writes(db, tmp_path, monkeypatch):
+    monkeypatch.setattr(detection_cache, "_default_cache", DetectionCache(tmp_path / "cache", max_mb=0))
+    writes = []
+    real_writer = worker.job_progress_writer
+
+    def recording_writer(job_id):
+        write = real_writer(job_id)
+        return lambda value, step: (writes.append((value, step)), write(value, step))
+
+    monkeypatch.setattr(worker, "job_progress_writer", recording_writer)
+    image = tmp_path / "sheet.png"
+    create_sheet(image)
+
+    monkeypatch.setattr(progress, "JOB_PROGRESS_FLUSH_MS", 0)
+    job_id = make_job(db, image)
+    worker.process_vision_task(worker.claim_next_job(db))
+    values = [v for v, _ in writes]
+    assert values == sorted(values) and len(set(values)) > 5
+    assert {s for _, s in writes} == {"preprocess", "detect", "metrics"}
+    db.expire_all()
+    assert db.get(models.Job, job_id).progress == 100
+
+    # Intervalo longo: só a escrita forçada antes de a sessão gravar os resultados
+    writes.clear()
+    monkeypatch.setattr(progress, "JOB_PROGRESS_FLUSH_MS", 60_000)
+    job_id = make_job(db, image)
+    worker.process_vision_task(worker.claim_next_job(db))
+    assert writes == [(70, "metrics")]
+    db.expire_all()
+    assert db.get(models.Job, job_id).status == models.JobStatus.DONE
@@ -0,0 +1,105 @@
+import json
+
+import cv2
+import numpy as np
+import pytest
+
+import blob_store
+import models
+import renditions
+from test_blob_store import blobs, ref_count  # noqa: F401 (fixture)
+from test_corrections import client  # noqa: F401 (fixture)
+
+
+@pytest.fixture()
+def tiles(tmp_path, monkeypatch):
+    monkeypatch.setattr(renditions, "TILE_DIR", tmp_path / "tiles")
+    return tmp_path / "tiles"
+
+
+def scan(h=700, w=500, seed=0):
+    return np.random.default_rng(seed).integers(0, 255, (h, w, 3), dtype=np.uint8)
+
+
+def test_pyramid_info_halves_down_to_one_tile():
+    info = renditions.pyramid_info(5000, 7000, tile_size=256)
+    assert info["max_level"] == 5
+    top, bottom = info["levels"][-1], info["levels"][0]
+    assert (top["width"], top["height"], top["cols"], top["rows"]) == (5000, 7000, 20, 28)
+    assert bottom["cols"] == bottom["rows"] == 1
+    assert renditions.pyramid_info(200, 100, tile_size=256)["max_level"] == 0
+
+
+def test_write_pyramid_covers_image(tiles):
+    img = scan()
+    info = renditions.write_pyramid(img, "ab" * 32, tile_size=128, fmt="png")
+    root = renditions.tile_dir("ab" * 32)
+    assert json.loads((root / "meta.json").read_text()) == info
+
+    top = info["levels"][info["max_level"]]
+    rows = [np.hstack([cv2.imread(str(root / str(info["max_level"]) / f"{x}_{y}.png")) for x in range(top["cols"])])
+            for y in range(top["rows"])]
+    assert np.array_equal(np.vstack(rows), img)
+    assert cv2.imread(str(root / "0" / "0_0.png")).shape[:2] == (info["levels"][0]["height"], info["levels"][0]["width"])
+    # Segunda chamada reaproveita a pirâmide publicada
+    assert renditions.write_pyramid(img, "ab" * 32, tile_size=128, fmt="png") == info
+    assert not [p for p in tiles.iterdir() if p.name.startswith(".")]
+
+
+def test_store_renditions_compacts_and_releases_previous(client, blobs, tiles, monkeypatch):
+    _, db = client
+    monkeypatch.setattr(renditions, "WARPED_FORMAT", "webp")
+    monkeypatch.setattr(renditions, "PREVIEW_MAX_PX", 200)
+    img = cv2.GaussianBlur(scan(seed=1), (9, 9), 3)
+    png = cv2.imencode(".png", img)[1].tobytes()
+
+    first = renditions.store_renditions(db, png, ".png", ".png")
+    db.commit()
+    assert first["warped"].endswith(".webp")
+    warped = cv2.imread(first["warped"])
+    assert warped.shape == img.shape and len(open(first["warped"], "rb").read()) < len(png)
+    assert max(cv2.imread(first["preview"]).shape[:2]) == 200
+    assert (renditions.tile_dir(first["warped_sha256"]) / "meta.json").is_file()
+
+    second = renditions.store_renditions(db, cv2.imencode(".png", scan(seed=2))[1].tobytes(), ".png", ".png", previous=first)
+    db.commit()
+    assert ref_count(db, first["warped_sha256"]) == 0 and ref_count(db, first["preview_sha256"]) == 0
+    assert ref_count(db, second["warped_sha256"]) == 1
+
+    result = blob_store.gc(db, grace_s=0)
+    assert result["removed_tile_sets"] == 1
+    assert not renditions.tile_dir(first["warped_sha256"]).exists()
+    assert renditions.tile_dir(second["warped_sha256"]).exists()
+    db.expire_all()
+    assert db.get(models.Blob, second["preview_sha256"]).ref_count == 1
+
+
+def test_tile_endpoint_generates_lazily_and_revalidates(client, blobs, tiles, monkeypatch):
+    http, db = client
+    monkeypatch.setattr(renditions, "TILES_PREGENERATE", False)
+    monkeypatch.setattr(renditions, "TILE_SIZE", 128)
+    user = db.query(models.User).first()
+    case = models.Case(patient_code="T-1", created_by=user.id)
+    db.add(case)
+    db.commit()
+    processed = renditions.store_renditions(db, cv2.imencode(".png", scan(seed=3))[1].tobytes(), ".png", ".png")
+    db.add(models.CaseFile(case_id=case.id, original_file_url="/nao/existe.png", processed_images_urls=processed))
+    db.commit()
+    assert not renditions.tile_dir(processed["warped_sha256"]).exists()
+
+    info = http.get(f"/cases/{case.id}/image/tiles").json()
+    assert (info["width"], info["height"], info["max_level"]) == (500, 700, 3)
+    url = info["url_template"].format(z=3, x=1, y=2)
+
+    r = http.get(url)
+    assert r.status_code == 200 and r.headers["content-type"] == "image/jpeg"
+    assert "immutable" in r.headers["cache-control"]
+    assert cv2.imdecode(np.frombuffer(r.content, np.uint8), cv2.IMREAD_COLOR).shape[:2] == (128, 128)
+
+    etag = r.headers["etag"]
+    unversioned = url.split("?")[0]
+    r = http.get(unversioned, headers={"If-None-Match": etag})
+    assert r.status_code == 304 and r.headers["cache-control"] == "private, no-cache"
+    assert http.get(f"/cases/{case.id}/image/tiles/3/99/0").status_code == 404
+    assert http.get(f"/cases/{case.id}/image/tiles/9/0/0").status_code == 404
+    assert http.get("/cases/999999/image/tiles/0/0/0").status_code == 404
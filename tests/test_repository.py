@@ -0,0 +1,105 @@
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, event, inspect, text
+
+import database
+import dedupe_case_rows
+import models
+import repository
+import worker
+from test_corrections import client  # noqa: F401 (fixture)
+from test_worker_pool import create_sheet, db, make_job  # noqa: F401 (fixture)
+
+
+@contextmanager
+def recorded_queries(engine):
+    statements = []
+
+    def record(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", record)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", record)
+
+
+def test_case_bundle_is_one_query_with_latest_rows(client):
+    http, db = client
+    user = db.query(models.User).first()
+    case = models.Case(patient_code="B-1", created_by=user.id)
+    db.add(case)
+    db.commit()
+    t0 = datetime(2025, 1, 1)
+    files = [models.CaseFile(case_id=case.id, original_file_url=f"/f{i}.png", processed_images_urls={}, created_at=t0 + timedelta(minutes=i))
+             for i in (2, 0, 1)]
+    jobs = [models.Job(case_id=case.id, status=models.JobStatus.DONE, created_at=t0 + timedelta(minutes=i)) for i in (0, 3, 1)]
+    db.add_all(files + jobs)
+    db.add(models.Detection(case_id=case.id, palo_objects={"palos": []}, roi_config={}))
+    db.add(models.Metric(case_id=case.id, total_count=7, by_interval={}, stats={}, confidence_level="High", confidence_reasons={}))
+    db.commit()
+    case_id = case.id
+    db.expunge_all()
+
+    with recorded_queries(database.engine) as statements:
+        bundle = repository.get_case_bundle(db, case_id)
+    assert len(statements) == 1
+    assert bundle.case.id == case_id
+    assert bundle.file.original_file_url == "/f2.png"
+    assert bundle.job.created_at == t0 + timedelta(minutes=3)
+    assert bundle.metric.total_count == 7 and bundle.detection is not None
+    assert repository.latest_file(db, case_id).id == bundle.file.id
+    assert repository.latest_job(db, case_id).id == bundle.job.id
+
+    body = http.get(f"/cases/{case_id}").json()
+    assert body["file"]["original_file_url"] == "/f2.png" and body["metric"]["total_count"] == 7
+    assert http.get("/cases/999999").status_code == 404
+
+
+def test_reanalysis_upserts_one_detection_and_metric(db, tmp_path):
+    image = tmp_path / "sheet.png"
+    create_sheet(image)
+    first = make_job(db, image)
+    job = db.get(models.Job, first)
+    second = models.Job(case_id=job.case_id, file_id=job.file_id, status=models.JobStatus.QUEUED)
+    db.add(second)
+    db.commit()
+    for _ in range(2):
+        worker.process_vision_task(worker.claim_next_job(db))
+    db.expire_all()
+    assert db.query(models.Detection).filter(models.Detection.case_id == job.case_id).count() == 1
+    assert db.query(models.Metric).filter(models.Metric.case_id == job.case_id).count() == 1
+    assert db.get(models.Job, second.id).status == models.JobStatus.DONE
+
+
+def test_create_missing_indexes_never_deletes_rows(tmp_path, capsys):
+    engine = create_engine(f"sqlite:///{tmp_path / 'legacy.db'}")
+    models.Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        for name in ("uq_detections_case_id", "ix_jobs_case_id_created_at"):
+            conn.execute(text(f"DROP INDEX {name}"))
+        for i in range(3):
+            conn.execute(text("INSERT INTO detections (case_id, palo_objects, roi_config, updated_at) VALUES (1, :p, '{}', '2025-01-01')"), {"p": f'{{"n": {i}}}'})
+        conn.execute(text("INSERT INTO detections (case_id, palo_objects, roi_config, updated_at) VALUES (2, '{}', '{}', '2025-01-01')"))
+
+    models.create_missing_indexes(engine)
+    # Índices comuns são criados; o único fica pendente e nenhuma linha some
+    assert "ix_jobs_case_id_created_at" in {ix["name"] for ix in inspect(engine).get_indexes("jobs")}
+    assert "uq_detections_case_id" not in {ix["name"] for ix in inspect(engine).get_indexes("detections")}
+    assert "dedupe_case_rows.py" in capsys.readouterr().out
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT count(*) FROM detections")).scalar() == 4
+
+    # Comando de manutenção: sem --apply só lista; com --apply mantém a mais recente
+    assert dedupe_case_rows.dedupe(engine) == 2
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT count(*) FROM detections")).scalar() == 4
+    assert dedupe_case_rows.dedupe(engine, apply=True) == 2
+    log = capsys.readouterr().out
+    assert "detections id=1 (caso 1" in log and "detections id=2 (caso 1" in log and "mantida id=3" in log
+    assert "uq_detections_case_id" in {ix["name"] for ix in inspect(engine).get_indexes("detections")}
+    with engine.connect() as conn:
+        rows = conn.execute(text("SELECT case_id, palo_objects FROM detections ORDER BY case_id")).all()
+    assert rows == [(1, '{"n": 2}'), (2, '{}')]
\ No newline at end of file
@@ -0,0 +1,61 @@
+from sqlalchemy import MetaData, Table, create_engine, inspect, text
+from sqlalchemy.orm import Session
+
+import models
+import worker
+
+# Colunas que não existiam no esquema original (bancos criados antes delas)
+LEGACY_MISSING = {
+    "jobs": {"attempts"},
+    "case_files": {"content_hash", "width", "height"},
+}
+
+
+def legacy_engine(tmp_path, missing):
+    """Banco com as tabelas atuais menos `missing` e sem os índices novos."""
+    engine = create_engine(f"sqlite:///{tmp_path / 'legacy.db'}")
+    legacy = MetaData()
+    for table in models.Base.metadata.sorted_tables:
+        Table(table.name, legacy, *[c._copy() for c in table.columns if c.name not in missing.get(table.name, ())])
+    legacy.create_all(bind=engine)
+    return engine
+
+
+def columns(engine, table):
+    return {c["name"] for c in inspect(engine).get_columns(table)}
+
+
+def test_init_db_adds_missing_columns_to_existing_tables(tmp_path):
+    engine = legacy_engine(tmp_path, LEGACY_MISSING)
+    with Session(engine) as db:
+        db.add(models.User(id=1, name="u", email="u@x", password_hash="x"))
+        db.add(models.Case(id=1, patient_code="P", created_by=1))
+        db.commit()
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO case_files (id, case_id, original_file_url, processed_images_urls, created_at) "
+                          "VALUES (1, 1, 'a.png', '{}', '2025-01-01')"))
+        conn.execute(text("INSERT INTO jobs (id, case_id, file_id, status, progress, created_at, updated_at) "
+                          "VALUES (1, 1, 1, 'QUEUED', 0, '2025-01-01', '2025-01-01')"))
+
+    models.init_db(engine)
+    models.init_db(engine)  # idempotente
+    for table, missing in LEGACY_MISSING.items():
+        assert missing <= columns(engine, table)
+    assert "ix_case_files_content_hash" in {ix["name"] for ix in inspect(engine).get_indexes("case_files")}
+
+    with Session(engine) as db:
+        assert db.get(models.CaseFile, 1).content_hash is None
+        assert worker.claim_next_job(db) == 1
+        assert db.get(models.Job, 1).attempts == 1  # linhas antigas começam com o default 0
+
+
+def test_init_db_adds_batch_id_before_its_index(tmp_path):
+    # Banco anterior à importação em lote: sem cases.batch_id nem import_batches
+    engine = legacy_engine(tmp_path, {"cases": {"batch_id"}})
+    with engine.begin() as conn:
+        conn.execute(text("DROP TABLE import_batches"))
+
+    models.init_db(engine)
+    assert "batch_id" in columns(engine, "cases")
+    assert "ix_cases_batch_id_created_at_id" in {ix["name"] for ix in inspect(engine).get_indexes("cases")}
+    assert [fk["referred_table"] for fk in inspect(engine).get_foreign_keys("cases") if fk["constrained_columns"] == ["batch_id"]] == ["import_batches"]
@@ -0,0 +1,46 @@
+import cv2
+import numpy as np
+import pytest
+
+from tests_adaptive_robustness import create_realistic_test_sheet
+from vision import PaloDetector
+
+
+def band_with_line(y, angle_deg=0.0, width=1000, height=700):
+    band = np.zeros((height, width), dtype=np.uint8)
+    dy = np.tan(np.radians(angle_deg)) * width / 2
+    cv2.line(band, (40, int(round(y - dy))), (width - 40, int(round(y + dy))), 255, 3)
+    # Topos de palos (pontos espaçados) e traço curto de cabeçalho não são linha
+    for x in range(100, 900, 40):
+        cv2.line(band, (x, 500), (x, 560), 255, 2)
+    cv2.line(band, (100, 100), (300, 100), 255, 2)
+    return band
+
+
+@pytest.mark.parametrize("angle", [0.0, 1.5, -2.5])
+def test_projection_finds_tilted_line(angle):
+    assert abs(PaloDetector.find_separator_projection(band_with_line(250, angle)) - 250) <= 3
+
+
+def test_projection_ignores_short_segments_and_dotted_rows():
+    band = band_with_line(250)
+    band[240:262] = 0
+    assert PaloDetector.find_separator_projection(band) == -1
+    assert PaloDetector.find_separator_projection(np.zeros((0, 10), np.uint8)) == -1
+
+
+def test_projection_picks_lowest_line():
+    band = band_with_line(400)
+    cv2.line(band, (40, 150), (960, 150), 255, 3)
+    assert abs(PaloDetector.find_separator_projection(band) - 400) <= 3
+
+
+def test_detect_test_area_uses_configured_detector():
+    gray = cv2.cvtColor(create_realistic_test_sheet(), cv2.COLOR_BGR2GRAY)
+    detector = PaloDetector(dict(PaloDetector().config, separator_detector="projection"))
+    roi = detector.detect_test_area(gray)
+    meta = detector.last_run_meta
+    assert meta["separator_detector"] == "projection" and meta["separator_found"]
+    assert abs(roi[1] - 310) <= 10  # linha em y=300 + margem de 10 px
+    # Na imagem em cinza o hough concorda (ele pega a borda inferior do traço, a projeção o pico)
+    assert abs(PaloDetector().detect_test_area(gray)[1] - roi[1]) <= 2
@@ -0,0 +1,66 @@
+import hashlib
+import io
+
+import cv2
+import numpy as np
+import pytest
+
+import models
+import uploads
+from test_corrections import client  # noqa: F401 (fixture)
+
+
+def png_bytes(seed=0):
+    img = np.random.default_rng(seed).integers(0, 255, (64, 48, 3), dtype=np.uint8)
+    return cv2.imencode(".png", img)[1].tobytes()
+
+
+def test_receive_upload_streams_hashes_and_names_by_content(tmp_path):
+    data = png_bytes()
+    stored = uploads.receive_upload(io.BytesIO(data), tmp_path, max_bytes=10**6, chunk_size=7)
+    assert stored.sha256 == hashlib.sha256(data).hexdigest()
+    assert stored.size == len(data)
+    assert stored.path.suffix == ".png" and stored.path.read_bytes() == data
+    assert [p.name for p in tmp_path.iterdir()] == [stored.path.name]
+
+
+@pytest.mark.parametrize("payload, error", [
+    (b"%PDF-1.7 ...", uploads.UnsupportedFileType),
+    (b"", uploads.UnsupportedFileType),
+    (png_bytes() * 4, uploads.UploadTooLarge),
+])
+def test_rejected_uploads_leave_nothing_on_disk(tmp_path, payload, error):
+    with pytest.raises(error):
+        uploads.receive_upload(io.BytesIO(payload), tmp_path, max_bytes=len(png_bytes()) * 2, chunk_size=64)
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_sniff_image_type():
+    assert uploads.sniff_image_type(cv2.imencode(".jpg", np.zeros((8, 8), np.uint8))[1].tobytes()) == ".jpg"
+    assert uploads.sniff_image_type(b"RIFF\x00\x00\x00\x00WEBPVP8 ") == ".webp"
+    assert uploads.sniff_image_type(b"II*\x00") == ".tif"
+    assert uploads.sniff_image_type(b"GIF89a") is None
+
+
+def test_upload_endpoint_validates_and_deduplicates(client, monkeypatch):
+    http, db = client
+    user = db.query(models.User).first()
+    cases = [models.Case(patient_code=f"U-{i}", created_by=user.id) for i in range(2)]
+    db.add_all(cases)
+    db.commit()
+
+    data = png_bytes(1)
+    # Nome/extensão do cliente são ignorados: o tipo vem do conteúdo
+    first = http.post(f"/cases/{cases[0].id}/upload", files={"file": ("foto.jpeg", data, "image/jpeg")})
+    second = http.post(f"/cases/{cases[1].id}/upload", files={"file": ("copia.png", data, "image/png")})
+    assert first.status_code == second.status_code == 200, first.text
+    assert first.json()["content_hash"] == hashlib.sha256(data).hexdigest()
+    assert first.json()["original_file_url"] == second.json()["original_file_url"]
+    assert first.json()["original_file_url"].endswith(".png")
+
+    garbage = http.post(f"/cases/{cases[0].id}/upload", files={"file": ("scan.png", b"not an image", "image/png")})
+    assert garbage.status_code == 415
+
+    monkeypatch.setattr(uploads, "UPLOAD_MAX_MB", len(data) / 2 / 2**20)
+    too_big = http.post(f"/cases/{cases[0].id}/upload", files={"file": ("big.png", data, "image/png")})
+    assert too_big.status_code == 413
@@ -0,0 +1,151 @@
+import time
+
+import cv2
+import numpy as np
+import pytest
+
+import database
+import models
+import worker
+
+
+def create_sheet(path):
+    img = np.ones((1414, 1000, 3), dtype=np.uint8) * 255
+    cv2.line(img, (50, 300), (950, 300), (0, 0, 0), 2)
+    for row in range(5):
+        for col in range(20):
+            x = 100 + col * 40
+            cv2.line(img, (x, 400 + row * 150), (x, 460 + row * 150), (0, 0, 0), 2)
+    cv2.imwrite(str(path), img)
+
+
+@pytest.fixture()
+def db():
+    models.Base.metadata.create_all(bind=database.engine)
+    session = database.SessionLocal()
+    session.query(models.Job).delete()
+    session.commit()
+    yield session
+    session.close()
+
+
+def make_job(db, image_path):
+    user = db.query(models.User).first()
+    if not user:
+        user = models.User(name="t", email="worker@test.com", password_hash="x")
+        db.add(user)
+        db.commit()
+    case = models.Case(patient_code="W-1", created_by=user.id)
+    db.add(case)
+    db.commit()
+    case_file = models.CaseFile(case_id=case.id, original_file_url=str(image_path), processed_images_urls={})
+    db.add(case_file)
+    db.commit()
+    job = models.Job(case_id=case.id, file_id=case_file.id, status=models.JobStatus.QUEUED)
+    db.add(job)
+    db.commit()
+    return job.id
+
+
+def test_claim_is_exclusive(db, tmp_path):
+    job_id = make_job(db, tmp_path / "missing.png")
+    assert worker.claim_next_job(db) == job_id
+    assert worker.claim_next_job(db) is None
+    job = db.get(models.Job, job_id)
+    db.refresh(job)
+    assert job.status == models.JobStatus.PROCESSING
+    assert job.attempts == 1
+
+
+def test_recover_stale_jobs_requeues_then_fails(db, tmp_path, monkeypatch):
+    job_id = make_job(db, tmp_path / "missing.png")
+    monkeypatch.setattr(worker, "VISION_JOB_MAX_ATTEMPTS", 2)
+    for expected in (models.JobStatus.QUEUED, models.JobStatus.FAILED):
+        assert worker.claim_next_job(db) == job_id
+        assert worker.recover_stale_jobs(db, stale_after_s=-1) == 1
+        job = db.get(models.Job, job_id)
+        db.refresh(job)
+        assert job.status == expected
+
+
+def test_pool_processes_queued_jobs(db, tmp_path):
+    image_path = tmp_path / "sheet.png"
+    create_sheet(image_path)
+    job_ids = [make_job(db, image_path) for _ in range(2)]
+
+    pool = worker.VisionWorkerPool(concurrency=2, poll_interval=0.1)
+    pool.start()
+    try:
+        deadline = time.monotonic() + 120
+        while time.monotonic() < deadline:
+            db.expire_all()
+            statuses = [db.get(models.Job, j).status for j in job_ids]
+            if all(s in (models.JobStatus.DONE, models.JobStatus.FAILED) for s in statuses):
+                break
+            time.sleep(0.2)
+    finally:
+        pool.stop()
+
+    for job_id in job_ids:
+        job = db.get(models.Job, job_id)
+        assert job.status == models.JobStatus.DONE, job.error_message
+        assert db.query(models.Detection).filter(models.Detection.case_id == job.case_id).count() == 1
+
+
+def test_broken_pool_requeues_only_lost_jobs(monkeypatch):
+    from concurrent.futures import Future
+    from concurrent.futures.process import BrokenProcessPool
+
+    pool = worker.VisionWorkerPool(concurrency=3)
+    finished, failed, lost, running = Future(), Future(), Future(), Future()
+    finished.set_result(None)
+    failed.set_exception(RuntimeError("falha"))
+    lost.set_exception(BrokenProcessPool())
+    pool._inflight = {finished: 1, lost: 2, failed: 3, running: 4}
+
+    requeued = []
+    monkeypatch.setattr(pool, "_reset_executor",
+                        lambda reason, extra=(): requeued.append(sorted(pool._inflight.values()) + list(extra)))
+    # O future quebrado vem antes dos demais concluídos na iteração
+    pool._collect_finished([lost, finished, failed])
+    assert requeued == [[2, 4]]
+
+
+def test_broken_submit_settles_finished_futures(monkeypatch):
+    from concurrent.futures import Future
+    from concurrent.futures.process import BrokenProcessPool
+
+    class BrokenExecutor:
+        def submit(self, *args):
+            raise BrokenProcessPool()
+
+    pool = worker.VisionWorkerPool(concurrency=3)
+    finished, lost = Future(), Future()
+    finished.set_result(None)
+    lost.set_exception(BrokenProcessPool())
+    pool._inflight = {finished: 1, lost: 2}
+    pool._executor = BrokenExecutor()
+
+    claimed = iter([5])
+    monkeypatch.setattr(worker, "claim_next_job", lambda db: next(claimed, None))
+    requeued = []
+    monkeypatch.setattr(pool, "_reset_executor",
+                        lambda reason, extra=(): requeued.append(sorted(pool._inflight.values()) + list(extra)))
+    pool._dispatch(db=None)
+    assert requeued == [[2, 5]]
+    assert None not in pool._inflight
+
+
+def test_requeue_keeps_finished_jobs(db, tmp_path):
+    done_id = make_job(db, tmp_path / "missing.png")
+    assert worker.claim_next_job(db) == done_id
+    job = db.get(models.Job, done_id)
+    job.status = models.JobStatus.DONE
+    db.commit()
+    lost_id = make_job(db, tmp_path / "missing.png")
+    assert worker.claim_next_job(db) == lost_id
+
+    worker.requeue_jobs(db, [done_id, lost_id], "pool quebrado")
+    db.expire_all()
+    assert db.get(models.Job, done_id).status == models.JobStatus.DONE
+    assert db.get(models.Job, lost_id).status == models.JobStatus.QUEUED